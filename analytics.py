@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import records
+import repository
+
+# Progress analytics. A user's strength history (workout_sets) is loaded
+# once into a columnar DataFrame; every metric below is computed with
+# vectorized NumPy/pandas operations over those columns (no per-row Python
+# loops).
+
+HISTORY_COLUMNS = {
+    "workout_id": "int64",
+    "exercise": "category",
+    "reps": "int32",
+    "weight": "float64",
+}
+
+
+# -------------------------
+# Loading
+# -------------------------
+def load_history(user_id, exercise=None):
+    sql = """
+        SELECT w.id AS workout_id, w.date, w.exercise_name AS exercise, ws.reps, ws.weight
+        FROM workouts w
+        JOIN workout_sets ws ON ws.workout_id = w.id
+        WHERE w.user_id = ?
+    """
+    params = [user_id]
+    if exercise is not None:
+        sql += " AND w.exercise_name = ?"
+        params.append(exercise)
+    with repository.connection(user_id) as conn:
+        df = pd.read_sql_query(sql, conn, params=params)
+    return prepare(df)
+
+
+def load_rollups(user_id, period="week"):
+    # The pre-aggregated totals (see rollups.py): O(weeks) rows, not O(sets)
+    df = pd.DataFrame(repository.get_rollups(user_id, period), columns=repository.Rollup._fields)
+    df = df.rename(columns={"exercise_name": "exercise"})
+    df["period"] = pd.to_datetime(df["period"])
+    return df
+
+
+def load_targets(user_id):
+    # One row per exercise name: the latest target the user set for it
+    with repository.connection(user_id) as conn:
+        targets = pd.read_sql_query("""
+            SELECT name AS exercise, target_sets, target_reps, MAX(id) AS latest FROM exercises
+            WHERE user_id = ? AND type = 'Strength' AND target_sets > 0
+            GROUP BY name
+        """, conn, params=(user_id,))
+    return targets.drop(columns="latest")
+
+
+def prepare(df):
+    # Normalises dtypes and adds the derived columns every metric uses
+    df = df.astype(HISTORY_COLUMNS)
+    df["date"] = pd.to_datetime(df["date"])
+    df["week"] = df["date"].dt.to_period("W").dt.start_time
+    df["tonnage"] = df["reps"].to_numpy() * df["weight"].to_numpy()
+    df["e1rm"] = estimate_1rm(df["weight"].to_numpy(), df["reps"].to_numpy())
+    return df
+
+
+def estimate_1rm(weight, reps, formula=None):
+    # Array version of records.estimate_1rm
+    formula = formula or records.FORMULA
+    reps = reps.astype("float64")
+    if formula == "brzycki":
+        estimate = weight * 36 / np.maximum(37 - reps, 1)
+        return np.where((reps <= 1) | (reps >= 37), weight, estimate)
+    return np.where(reps <= 1, weight, weight * (1 + reps / 30))
+
+
+# -------------------------
+# Metrics
+# -------------------------
+def adherence(df, targets):
+    # Share of the target (sets x reps) met by each session, capped at 1
+    hit_reps = df.merge(targets, on="exercise", how="inner")
+    if hit_reps.empty:
+        return pd.DataFrame(columns=["workout_id", "exercise", "date", "adherence"])
+    hit_reps["hit"] = hit_reps["reps"].to_numpy() >= hit_reps["target_reps"].to_numpy()
+    sessions = (hit_reps.groupby(["workout_id", "exercise", "date"], observed=True)
+                        .agg(sets_hit=("hit", "sum"), target_sets=("target_sets", "first"))
+                        .reset_index())
+    sessions["adherence"] = np.minimum(sessions["sets_hit"].to_numpy() / sessions["target_sets"].to_numpy(), 1.0)
+    return sessions[["workout_id", "exercise", "date", "adherence"]]
+
+
+def rolling_average(frame, value, window="28D", by="exercise", order="week"):
+    # Mean of `value` over the rows of each group dated within `window` (a
+    # time span) up to each row; weeks with nothing logged don't widen it
+    frame = frame.sort_values([by, order])
+    means = frame.groupby(by, observed=True).rolling(window, on=order, min_periods=1)[value].mean()
+    # Indexed by (group, date) in the sorted frame's order
+    return pd.Series(means.to_numpy(), index=frame.index, name=value)
@@ -0,0 +1,329 @@
+import re
+import json
+import asyncio
+import itertools
+import concurrent.futures
+from urllib.parse import parse_qs
+import cache
+import repository
+import services
+
+# Headless JSON API over services.py, as a plain ASGI app (no framework).
+# SQLite calls block, so every handler body runs on a thread pool sized
+# to the connection pool; the event loop only parses and writes HTTP.
+# Each worker process has its own pool and cache (kept coherent with the
+# other workers' writes through the database's cache epochs, see
+# cache.py), so it scales out with
+#     uvicorn api:app --workers 4
+# POST /login exchanges mail and password for a signed token; every other
+# request sends it as "Authorization: Bearer <token>", which is checked
+# against the user's token generation (one primary-key read), so POST
+# /logout revokes it in every worker.
+#
+#   POST   /signup                          {name, age, weight, mail, password}
+#   POST   /login                           {mail, password} -> {token, user}
+#   POST   /logout                          revokes all of the user's tokens
+#   GET    /programs
+#   POST   /programs                        {name, days}
+#   GET    /programs/{id}                   program, exercises by day, PRs
+#   DELETE /programs/{id}
+#   GET    /programs/{id}/exercises
+#   POST   /programs/{id}/exercises         {day, name, type, target_sets, target_reps}
+#   POST   /programs/{id}/workouts          one workout or a list of them:
+#          {exercise_name, date, sets: [[reps, weight], ...]}
+#          {exercise_name, date, type: "Cardio", distance_km, duration_s}
+#   GET    /exercises/{name}/records
+#   GET    /exercises/{name}/recommendation?reps=&date=
+#          today's suggested top set and the state it comes from
+#   GET    /exercises/{name}/history?before=DATE,ID&limit=&start=&end=
+#          session summaries, each with its set logs, and the next cursor
+#   GET    /exercises/{name}/history/sets?start=&end=
+#          every set, newest first, streamed as newline-delimited JSON
+
+MAX_BODY = 1 << 20
+# Rows per chunk of a streamed response
+STREAM_ROWS = 500
+
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=repository.POOL_SIZE,
+                                                  thread_name_prefix="gym-api")
+_routes = []
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Stream:
+    # A handler result sent as newline-delimited JSON; rows are pulled on
+    # the thread pool STREAM_ROWS at a time, as the client reads
+    def __init__(self, rows):
+        self.rows = iter(rows)
+
+    def chunk(self):
+        return "".join(json.dumps(_jsonable(row), allow_nan=False) + "\n"
+                       for row in itertools.islice(self.rows, STREAM_ROWS)).encode()
+
+
+def route(method, pattern):
+    # Path parameters are {name} segments, passed to the handler by keyword
+    regex = re.compile("^" + re.sub(r"\{(\w+)\}", r"(?P<\1>[^/]+)", pattern) + "$")
+
+    def register(handler):
+        _routes.append((method, regex, handler))
+        return handler
+    return register
+
+
+# -------------------------
+# Handlers (run on the thread pool)
+# -------------------------
+@route("POST", "/signup")
+def signup(user, body, query):
+    user_id = services.signup(body.get("name"), body.get("age"), body.get("weight"),
+                              body.get("mail"), body.get("password"))
+    return 201, {"id": user_id}
+
+
+@route("POST", "/login")
+def login(user, body, query):
+    user = services.login(body.get("mail"), body.get("password"))
+    if user is None:
+        raise HTTPError(401, "Invalid email or password.")
+    return 200, {"token": services.issue_token(user), "user": user}
+
+
+@route("POST", "/logout")
+def logout(user, body, query):
+    services.logout(user.id)
+    return 204, None
+
+
+@route("GET", "/programs")
+def list_programs(user, body, query):
+    return 200, services.list_programs(user.id)
+
+
+@route("POST", "/programs")
+def create_program(user, body, query):
+    return 201, {"id": services.create_program(user.id, body.get("name"), body.get("days"))}
+
+
+@route("GET", "/programs/{prog_id}")
+def get_program(user, body, query, prog_id):
+    view = services.get_program_view(user.id, int(prog_id))
+    if view is None:
+        raise services.NotFound(f"Program {prog_id} not found.")
+    return 200, view
+
+
+@route("DELETE", "/programs/{prog_id}")
+def delete_program(user, body, query, prog_id):
+    services.delete_program(user.id, int(prog_id))
+    return 204, None
+
+
+@route("GET", "/programs/{prog_id}/exercises")
+def list_exercises(user, body, query, prog_id):
+    services.require_program(user.id, int(prog_id))
+    return 200, services.list_exercises(user.id, int(prog_id))
+
+
+@route("POST", "/programs/{prog_id}/exercises")
+def add_exercise(user, body, query, prog_id):
+    ex_id = services.add_exercise(user.id, int(prog_id), body.get("day"), body.get("name"),
+                                  body.get("type", "Strength"), body.get("target_sets"), body.get("target_reps"))
+    return 201, {"id": ex_id}
+
+
+@route("POST", "/programs/{prog_id}/workouts")
+def log_workouts(user, body, query, prog_id):
+    items = body if isinstance(body, list) else [body]
+    workouts = []
+    for item in items:
+        if not isinstance(item, dict):
+            raise services.ValidationError("Each workout must be an object.")
+        if item.get("type") == "Cardio":
+            workouts.append(services.cardio_input(user.id, int(prog_id), item.get("exercise_name"),
+                                                  item.get("distance_km"), item.get("duration_s"), item.get("date")))
+        else:
+            sets = item.get("sets")
+            if not isinstance(sets, list) or not all(isinstance(s, list) and len(s) == 2 for s in sets):
+                raise services.ValidationError("sets must be a list of [reps, weight] pairs.")
+            workouts.append(services.strength_input(user.id, int(prog_id), item.get("exercise_name"),
+                                                    sets, item.get("date")))
+    return 201, {"ids": services.log_workouts(workouts)}
+
+
+@route("GET", "/exercises/{ex_name}/records")
+def get_records(user, body, query, ex_name):
+    return 200, {"personal_record": services.get_personal_record(user.id, ex_name),
+                 "rep_maxes": services.get_rep_maxes(user.id, ex_name),
+                 "cardio": services.get_cardio_stats(user.id, ex_name)}
+
+
+@route("GET", "/exercises/{ex_name}/recommendation")
+def get_recommendation(user, body, query, ex_name):
+    reps = _query_int(query["reps"], "reps") if "reps" in query else None
+    return 200, {"recommendation": services.recommend(user.id, ex_name, reps, query.get("date")),
+                 "state": services.get_exercise_state(user.id, ex_name)}
+
+
+@route("GET", "/exercises/{ex_name}/history")
+def get_history(user, body, query, ex_name):
+    before = None
+    if "before" in query:
+        date, _, workout_id = query["before"].rpartition(",")
+        before = (date, _query_int(workout_id, "before"))
+    limit = min(max(_query_int(query.get("limit", "10"), "limit"), 1), 100)
+    sessions, sets, cursor = services.get_history_page(user.id, ex_name, before, limit,
+                                                       query.get("start"), query.get("end"))
+    return 200, {"sessions": [dict(s._asdict(), logs=sets.get(s.workout_id, ())) for s in sessions],
+                 "next": f"{cursor[0]},{cursor[1]}" if cursor else None}
+
+
+@route("GET", "/exercises/{ex_name}/history/sets")
+def stream_history(user, body, query, ex_name):
+    return 200, Stream(services.iter_history(user.id, ex_name, query.get("start"), query.get("end")))
+
+
+def _query_int(value, field):
+    try:
+        number = int(value)
+    except ValueError:
+        raise services.ValidationError(f"{field} must be an integer.") from None
+    if abs(number) > services.MAX_INTEGER:
+        raise services.ValidationError(f"{field} is too large.")
+    return number
+
+
+# -------------------------
+# Dispatch
+# -------------------------
+PUBLIC = (signup, login)
+# Handlers taking a JSON list as well as an object
+LIST_BODIES = (log_workouts,)
+
+
+def _authenticate(headers):
+    scheme, _, token = headers.get("authorization", "").partition(" ")
+    return services.user_from_token(token) if scheme.lower() == "bearer" else None
+
+
+def _handle(method, path, headers, body, query):
+    # Runs on the thread pool: one pooled connection and one cache epoch
+    # check per user per request
+    repository.init_db()
+    with repository.connection(), cache.scope():
+        for route_method, regex, handler in _routes:
+            match = regex.match(path)
+            if match and route_method == method:
+                user = None
+                if handler not in PUBLIC:
+                    user = _authenticate(headers)
+                    if user is None:
+                        raise HTTPError(401, "Missing, invalid or expired token.")
+                if isinstance(body, list) and handler not in LIST_BODIES:
+                    raise HTTPError(400, "Body must be a JSON object.")
+                params = match.groupdict()
+                # Ids beyond SQLite's integer range can't exist
+                prog_id = params.get("prog_id")
+                if prog_id is not None and not (prog_id.isascii() and prog_id.isdigit()
+                                                and int(prog_id) <= services.MAX_INTEGER):
+                    raise HTTPError(404, "Not found.")
+                return handler(user, body, query, **params)
+        if any(regex.match(path) for _, regex, _ in _routes):
+            raise HTTPError(405, "Method not allowed.")
+        raise HTTPError(404, "Not found.")
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+    query = {k: v[-1] for k, v in parse_qs(scope.get("query_string", b"").decode()).items()}
+    try:
+        raw = await _read_body(receive)
+        body = json.loads(raw) if raw else {}
+        if not isinstance(body, (dict, list)):
+            raise HTTPError(400, "Body must be a JSON object or list.")
+        loop = asyncio.get_running_loop()
+        status, payload = await loop.run_in_executor(
+            _executor, _handle, scope["method"], scope["path"], headers, body, query)
+    except json.JSONDecodeError:
+        status, payload = 400, {"error": "Body is not valid JSON."}
+    except HTTPError as e:
+        status, payload = e.status, {"error": str(e)}
+    except services.ValidationError as e:
+        status, payload = 400, {"error": str(e)}
+    except services.NotFound as e:
+        status, payload = 404, {"error": str(e)}
+    except services.Conflict as e:
+        status, payload = 409, {"error": str(e)}
+    except (services.Busy, repository.PoolTimeout) as e:
+        status, payload = 503, {"error": str(e)}
+    if isinstance(payload, Stream):
+        await _stream(send, status, payload)
+    else:
+        await _respond(send, status, payload)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await asyncio.get_running_loop().run_in_executor(_executor, repository.init_db)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            _executor.shutdown(wait=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def _read_body(receive):
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY:
+            raise HTTPError(413, "Request body too large.")
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def _respond(send, status, payload):
+    # Strict JSON: NaN and Infinity are not valid JSON
+    body = b"" if payload is None else json.dumps(_jsonable(payload), allow_nan=False).encode()
+    headers = [(b"content-type", b"application/json")] if payload is not None else []
+    headers.append((b"content-length", str(len(body)).encode()))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _stream(send, status, stream):
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/x-ndjson")]})
+    loop = asyncio.get_running_loop()
+    while True:
+        chunk = await loop.run_in_executor(_executor, stream.chunk)
+        await send({"type": "http.response.body", "body": chunk, "more_body": bool(chunk)})
+        if not chunk:
+            return
+
+
+def _jsonable(value):
+    # Repository namedtuples become objects rather than arrays
+    if hasattr(value, "_asdict"):
+        return {k: _jsonable(v) for k, v in value._asdict().items()}
+    if isinstance(value, dict):
+        return {str(k): _jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    return value
@@ -0,0 +1,187 @@
+import os
+import zlib
+import math
+import struct
+import records
+
+# Cold storage for old sessions. Every pooled connection attaches a second
+# database file as schema "archive" (gym_data.db -> gym_data_archive.db).
+# maintenance.py moves sessions older than a horizon there (copy, commit,
+# then delete the hot rows - see copy_before()): one row per
+# session holding its summary (what the history list shows) and its sets
+# packed and zlib-compressed, instead of a workouts row, N workout_sets
+# rows and their index entries in the hot file. Archived rep maxes are
+# kept per program so records can still be rebuilt and programs deleted.
+# Rollups and personal records already include archived sessions and
+# are left as they are. Functions take an open connection, like records.py.
+
+SCHEMA = "archive"
+HORIZON_DAYS = 365
+BATCH_SIZE = 1000
+
+# set_number, reps, weight (NaN for a missing weight)
+_SET = struct.Struct("<IId")
+
+# Archived sessions whose hot rows are gone. A crash between the two
+# commits of a move (copy_before(), then drop_hot()) leaves a session in
+# both files; readers of the archive add this condition so it counts once.
+NOT_HOT = "NOT EXISTS (SELECT 1 FROM main.workouts hot WHERE hot.id = workout_id)"
+
+
+def path_for(db_path):
+    if db_path == ":memory:":
+        return ":memory:"
+    root, ext = os.path.splitext(db_path)
+    return f"{root}_{SCHEMA}{ext or '.db'}"
+
+
+def attach(conn, path):
+    # Must run outside a transaction
+    conn.execute(f"ATTACH DATABASE ? AS {SCHEMA}", (path,))
+
+
+def ensure_schema(conn):
+    # auto_vacuum only takes effect on a file that has no tables yet
+    conn.execute(f"PRAGMA {SCHEMA}.auto_vacuum=INCREMENTAL")
+    conn.execute(f"PRAGMA {SCHEMA}.journal_mode=WAL")
+    conn.execute(f'''CREATE TABLE IF NOT EXISTS {SCHEMA}.sessions (
+                     workout_id INTEGER PRIMARY KEY,
+                     user_id INTEGER,
+                     program_id INTEGER,
+                     exercise_name TEXT,
+                     date TEXT,
+                     sets INTEGER,
+                     total_reps INTEGER,
+                     volume REAL,
+                     top_weight REAL,
+                     top_reps INTEGER,
+                     best_e1rm REAL,
+                     distance_km REAL,
+                     duration_s INTEGER,
+                     set_data BLOB
+                    )''')
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {SCHEMA}.idx_sessions_user_exercise "
+                 f"ON sessions (user_id, exercise_name, date)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {SCHEMA}.idx_sessions_program ON sessions (program_id)")
+    conn.execute(f'''CREATE TABLE IF NOT EXISTS {SCHEMA}.rep_maxes (
+                     user_id INTEGER,
+                     exercise_name TEXT,
+                     program_id INTEGER,
+                     reps INTEGER,
+                     max_weight REAL,
+                     PRIMARY KEY (user_id, exercise_name, program_id, reps)
+                    ) WITHOUT ROWID''')
+
+
+# -------------------------
+# Set packing
+# -------------------------
+def pack_sets(sets):
+    # sets: [(set_number, reps, weight), ...]
+    raw = b"".join(_SET.pack(n, r, math.nan if w is None else w) for n, r, w in sets)
+    return zlib.compress(raw, 9)
+
+
+def unpack_sets(blob):
+    if not blob:
+        return []
+    return [(n, r, None if math.isnan(w) else w) for n, r, w in _SET.iter_unpack(zlib.decompress(blob))]
+
+
+# -------------------------
+# Moving sessions
+# -------------------------
+def copy_before(conn, cutoff, after_id=0, limit=BATCH_SIZE):
+    # Copies up to `limit` sessions dated before cutoff with ids above
+    # after_id into the archive; returns their ids. Commit this on its own
+    # before drop_hot(): in WAL mode SQLite only makes a commit atomic per
+    # file, so a crash during one commit spanning both could keep the hot
+    # delete and lose the copy. Rerunning after a crash in between is
+    # safe, the copy is INSERT OR IGNORE.
+    workouts = conn.execute("""
+        SELECT w.id, w.user_id, w.program_id, w.exercise_name, w.date, c.distance_km, c.duration_s
+        FROM workouts w
+        LEFT JOIN cardio_sessions c ON c.workout_id = w.id
+        WHERE w.id > ? AND w.date < ?
+        ORDER BY w.id LIMIT ?
+    """, (after_id, str(cutoff), limit)).fetchall()
+    if not workouts:
+        return []
+    ids = [w[0] for w in workouts]
+    placeholders = ", ".join("?" * len(ids))
+    sets = {}
+    for workout_id, set_number, reps, weight in conn.execute(f"""
+            SELECT workout_id, set_number, reps, weight FROM workout_sets
+            WHERE workout_id IN ({placeholders}) ORDER BY workout_id, set_number""", ids):
+        sets.setdefault(workout_id, []).append((set_number, reps, weight))
+
+    sessions, rep_maxes = [], {}
+    for workout_id, user_id, program_id, ex_name, date, distance, duration in workouts:
+        rows = sets.get(workout_id, [])
+        lifted = [(r, w) for _, r, w in rows if r and w is not None]
+        top = max(lifted, key=lambda s: s[1]) if lifted else (None, None)
+        sessions.append((workout_id, user_id, program_id, ex_name, date, len(rows),
+                         sum(r or 0 for _, r, _ in rows) if rows else None,
+                         sum(r * w for r, w in lifted) if rows else None,
+                         top[1], top[0],
+                         max((records.estimate_1rm(w, r) for r, w in lifted), default=None),
+                         distance, duration, pack_sets(rows) if rows else None))
+        for r, w in lifted:
+            key = (user_id, ex_name, program_id, r)
+            rep_maxes[key] = max(w, rep_maxes.get(key, w))
+
+    conn.executemany(f"INSERT OR IGNORE INTO {SCHEMA}.sessions VALUES ({', '.join('?' * 14)})", sessions)
+    conn.executemany(f"""
+        INSERT INTO {SCHEMA}.rep_maxes (user_id, exercise_name, program_id, reps, max_weight)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (user_id, exercise_name, program_id, reps) DO UPDATE SET
+            max_weight = MAX(max_weight, excluded.max_weight)
+    """, [key + (w,) for key, w in rep_maxes.items()])
+    return ids
+
+
+def drop_hot(conn, ids):
+    # Second half of a move, once copy_before() is committed. Sets and
+    # cardio rows go with their workout (ON DELETE CASCADE)
+    conn.execute(f"DELETE FROM workouts WHERE id IN ({', '.join('?' * len(ids))})", ids)
+
+
+def delete_program(conn, user_id, prog_id):
+    # Drops the program's archived sessions; returns their exercise names
+    names = [r[0] for r in conn.execute(
+        f"SELECT DISTINCT exercise_name FROM {SCHEMA}.sessions WHERE program_id=? AND user_id=?", (prog_id, user_id))]
+    conn.execute(f"DELETE FROM {SCHEMA}.sessions WHERE program_id=? AND user_id=?", (prog_id, user_id))
+    conn.execute(f"DELETE FROM {SCHEMA}.rep_maxes WHERE program_id=? AND user_id=?", (prog_id, user_id))
+    return names
+
+
+# -------------------------
+# Reading
+# -------------------------
+def session_sets(conn, user_id, workout_ids):
+    # {workout_id: [(date, set_number, reps, weight), ...]} for archived ids
+    workout_ids = list(workout_ids)
+    if not workout_ids:
+        return {}
+    rows = conn.execute(f"""
+        SELECT workout_id, date, set_data FROM {SCHEMA}.sessions
+        WHERE user_id=? AND workout_id IN ({', '.join('?' * len(workout_ids))}) AND set_data IS NOT NULL
+    """, [user_id] + workout_ids).fetchall()
+    return {workout_id: [(date,) + s for s in unpack_sets(blob)] for workout_id, date, blob in rows}
+
+
+def iter_sessions(conn, user_id=None, exercise_name=None, start_date=None, end_date=None):
+    # Archived sessions as (workout_id, user_id, program_id, exercise_name,
+    # date, [(set_number, reps, weight)], distance_km, duration_s)
+    where, params = [], []
+    for column, value, op in (("user_id", user_id, "="), ("exercise_name", exercise_name, "="),
+                              ("date", start_date, ">="), ("date", end_date, "<=")):
+        if value is not None:
+            where.append(f"{column} {op} ?")
+            params.append(value)
+    cursor = conn.execute(f"""
+        SELECT workout_id, user_id, program_id, exercise_name, date, set_data, distance_km, duration_s
+        FROM {SCHEMA}.sessions WHERE {' AND '.join(where + [NOT_HOT])} ORDER BY workout_id
+    """, params)
+    for row in cursor:
+        yield row[:5] + (unpack_sets(row[5]),) + row[6:]
@@ -0,0 +1,149 @@
+import os
+import hmac
+import json
+import time
+import base64
+import hashlib
+import secrets
+import threading
+import concurrent.futures
+
+# Password hashing and session tokens. Passwords are stored as salted
+# scrypt hashes, "scrypt$<log2 n>$<r>$<p>$<salt>$<hash>", so the cost can
+# be raised later without invalidating existing hashes (needs_rehash()
+# tells the caller to upgrade one on the next successful login). Hashing
+# is deliberately slow and memory-hungry, so it runs on a small bounded
+# pool: a burst of logins queues up instead of starving every other
+# session of CPU. Session tokens are HMAC-signed and carry the user's
+# token generation at issue time; the caller compares it with the stored
+# one (services.user_from_token), so bumping it on logout revokes every
+# token issued before.
+
+COST = int(os.environ.get("GYM_AUTH_COST", "14"))
+BLOCK_SIZE = 8
+PARALLELISM = 1
+SALT_BYTES = 16
+WORKERS = 4
+TOKEN_TTL_S = 7 * 24 * 3600
+SECRET_FILE = os.environ.get("GYM_SECRET_FILE", ".gym_secret")
+
+_pool = concurrent.futures.ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="gym-auth")
+_lock = threading.Lock()
+_secret = None
+_dummy_hash = None
+
+
+# -------------------------
+# Passwords
+# -------------------------
+def _scrypt(password, salt, cost, r, p):
+    return hashlib.scrypt(password.encode(), salt=salt, n=1 << cost, r=r, p=p,
+                          maxmem=256 * r * (1 << cost) + (1 << 20))
+
+
+def _hash(password, cost):
+    salt = secrets.token_bytes(SALT_BYTES)
+    digest = _scrypt(password, salt, cost, BLOCK_SIZE, PARALLELISM)
+    return "$".join(["scrypt", str(cost), str(BLOCK_SIZE), str(PARALLELISM), _b64(salt), _b64(digest)])
+
+
+def _verify(password, stored):
+    try:
+        scheme, cost, r, p, salt, digest = stored.split("$")
+        if scheme != "scrypt":
+            return False
+        return hmac.compare_digest(_scrypt(password, _unb64(salt), int(cost), int(r), int(p)), _unb64(digest))
+    except (AttributeError, ValueError):
+        return False
+
+
+def hash_password(password, cost=None):
+    return _pool.submit(_hash, password, cost or COST).result()
+
+
+def hash_many(passwords, cost=None):
+    # For migrations and imports: the pool's workers hash in parallel
+    # (hashlib releases the GIL)
+    return list(_pool.map(_hash, passwords, [cost or COST] * len(passwords)))
+
+
+def verify_password(password, stored):
+    # stored may be None (unknown user): a dummy hash is checked instead so
+    # the response time doesn't reveal whether the mail exists
+    global _dummy_hash
+    if stored is None:
+        with _lock:
+            if _dummy_hash is None:
+                _dummy_hash = _hash(secrets.token_hex(8), COST)
+        _pool.submit(_verify, password, _dummy_hash).result()
+        return False
+    return _pool.submit(_verify, password, stored).result()
+
+
+def is_hashed(stored):
+    return bool(stored) and stored.startswith("scrypt$")
+
+
+def needs_rehash(stored):
+    try:
+        _, cost, r, p, _, _ = stored.split("$")
+        return (int(cost), int(r), int(p)) != (COST, BLOCK_SIZE, PARALLELISM)
+    except (AttributeError, ValueError):
+        return True
+
+
+# -------------------------
+# Session tokens
+# -------------------------
+def _load_secret():
+    global _secret
+    with _lock:
+        if _secret is None:
+            env = os.environ.get("GYM_SECRET_KEY")
+            if env:
+                _secret = env.encode()
+            else:
+                # Shared by every process running from this directory (API
+                # workers, Streamlit) so their tokens are interchangeable
+                try:
+                    fd = os.open(SECRET_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                    with os.fdopen(fd, "w") as f:
+                        f.write(secrets.token_hex(32))
+                except FileExistsError:
+                    pass
+                with open(SECRET_FILE) as f:
+                    _secret = f.read().strip().encode()
+    return _secret
+
+
+def issue_token(user_id, name, generation, ttl=TOKEN_TTL_S):
+    payload = _b64(json.dumps({"uid": user_id, "name": name, "gen": generation,
+                               "exp": int(time.time() + ttl)}).encode())
+    return f"{payload}.{_sign(payload)}"
+
+
+def read_token(token):
+    # (user_id, name, generation) from a token this app signed and that
+    # hasn't expired; None otherwise
+    try:
+        payload, signature = token.split(".")
+        if not hmac.compare_digest(signature, _sign(payload)):
+            return None
+        claims = json.loads(_unb64(payload))
+    except (AttributeError, ValueError):
+        return None
+    if claims.get("exp", 0) < time.time():
+        return None
+    return claims["uid"], claims["name"], claims.get("gen", 0)
+
+
+def _sign(payload):
+    return _b64(hmac.new(_load_secret(), payload.encode(), hashlib.sha256).digest())
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
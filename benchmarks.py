@@ -0,0 +1,367 @@
+import os
+import sys
+import time
+import tempfile
+import random
+import datetime
+import threading
+import statistics
+import multiprocessing
+import repository
+import cache
+import profiling
+import seed
+import services
+import writer
+
+# Usage: python benchmarks.py [name ...]
+# Each benchmark runs against a throwaway database in a temp directory.
+
+
+# -------------------------
+# Helpers
+# -------------------------
+def _fresh_db(pool_size=repository.POOL_SIZE, shards=0):
+    path = os.path.join(tempfile.mkdtemp(prefix="gym_bench_"), "bench.db")
+    # Plain connections: time the queries, not the instrumentation
+    profiling.ENABLED = False
+    repository.configure(path, pool_size, shards)
+    repository.init_db()
+    # Measure the database, not the read cache
+    cache.configure(0)
+    return path
+
+
+def _timed(fn, repeat=20):
+    # Median wall time of fn() in milliseconds
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def _count_statements(fn):
+    # Number of SQL statements fn() sends to the thread's connection
+    statements = []
+    with repository.connection() as conn:
+        conn.set_trace_callback(statements.append)
+        try:
+            fn()
+        finally:
+            conn.set_trace_callback(None)
+    return len(statements)
+
+
+def _seed_program(user_id, days, per_day):
+    with repository.transaction(user_id) as conn:
+        prog_id = conn.execute("INSERT INTO programs (user_id, name, days, date_created) VALUES (?, ?, ?, ?)",
+                               (user_id, f"Program {days}x{per_day}", days, "2024-01-01")).lastrowid
+        for day in range(1, days + 1):
+            for i in range(per_day):
+                name = f"Exercise {day}-{i}"
+                conn.execute("""INSERT INTO exercises (user_id, program_id, day, name, type, target_sets, target_reps)
+                                VALUES (?, ?, ?, ?, 'Strength', 3, 8)""", (user_id, prog_id, day, name))
+                conn.execute("INSERT INTO personal_records (user_id, exercise_name, max_weight, reps) VALUES (?, ?, ?, ?)",
+                             (user_id, name, 100.0, 5))
+    return prog_id
+
+
+# -------------------------
+# view_program_exercises
+# -------------------------
+def _program_view_n_plus_one(user_id, prog_id):
+    # The page's original access pattern: one query per day, one per exercise
+    program = repository.get_program(user_id, prog_id)
+    for day in range(1, program.days + 1):
+        for ex in repository.list_exercises(user_id, prog_id, day=day):
+            repository.get_personal_record(user_id, ex.name)
+
+
+def bench_program_view():
+    _fresh_db()
+    print(f"{'exercises':>10} {'per-row ms':>12} {'queries':>8} {'batched ms':>12} {'queries':>8}")
+    with repository.connection():
+        for user_id, per_day in enumerate((2, 8, 32, 128), start=1):
+            prog_id = _seed_program(user_id, 7, per_day)
+            old = lambda: _program_view_n_plus_one(user_id, prog_id)
+            new = lambda: repository.get_program_view(user_id, prog_id)
+            print(f"{7 * per_day:>10} {_timed(old):>12.2f} {_count_statements(old):>8} "
+                  f"{_timed(new):>12.2f} {_count_statements(new):>8}")
+
+
+# -------------------------
+# Read cache
+# -------------------------
+def bench_read_cache():
+    # Many logged-in users rerunning the program page, with the cache on
+    _fresh_db()
+    users = range(1, 201)
+    programs = {user_id: _seed_program(user_id, 3, 5) for user_id in users}
+    cache.configure(max_entries=1000)
+    with repository.connection():
+        for _ in range(10):
+            for user_id in users:
+                repository.list_programs(user_id)
+                repository.get_program_view(user_id, programs[user_id])
+    print(cache.stats())
+
+
+# -------------------------
+# Bulk workout save
+# -------------------------
+def bench_bulk_save():
+    _fresh_db()
+    prog_id = _seed_program(1, 1, 1)
+    print(f"{'workouts':>10} {'sets':>8} {'ms':>10} {'sets/s':>10}")
+    for count in (100, 1000, 10000):
+        workouts = [repository.WorkoutInput(1, prog_id, "Exercise 1-0", f"2024-01-{i % 28 + 1:02d}",
+                                            [(5, 100.0 + s) for s in range(5)])
+                    for i in range(count)]
+        start = time.perf_counter()
+        repository.save_workouts(workouts)
+        elapsed = time.perf_counter() - start
+        print(f"{count:>10} {count * 5:>8} {elapsed * 1000:>10.1f} {count * 5 / elapsed:>10.0f}")
+
+
+# -------------------------
+# Concurrent saves
+# -------------------------
+def bench_write_burst(threads=(1, 8, 32), saves_per_thread=50):
+    # Every thread saves workouts as fast as it can: each save its own
+    # transaction, vs. through the write-behind queue (group commit)
+    _fresh_db(pool_size=max(threads) + 1)
+    prog_id = _seed_program(1, 1, 1)
+
+    def direct(wk):
+        repository.save_workouts([wk])
+
+    def queued(wk):
+        writer.submit([wk]).result()
+
+    print(f"{'mode':>8} {'threads':>8} {'saves/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for mode, save in (("direct", direct), ("queued", queued)):
+        for count in threads:
+            latencies, lock = [], threading.Lock()
+
+            def worker():
+                local = []
+                wk = repository.WorkoutInput(1, prog_id, "Exercise 1-0", "2024-01-01", [(5, 100.0)] * 3)
+                for _ in range(saves_per_thread):
+                    start = time.perf_counter()
+                    save(wk)
+                    local.append((time.perf_counter() - start) * 1000)
+                with lock:
+                    latencies.extend(local)
+
+            workers = [threading.Thread(target=worker) for _ in range(count)]
+            start = time.perf_counter()
+            for w in workers:
+                w.start()
+            for w in workers:
+                w.join()
+            elapsed = time.perf_counter() - start
+            pct = statistics.quantiles(latencies, n=100)
+            print(f"{mode:>8} {count:>8} {len(latencies) / elapsed:>10.0f} {statistics.median(latencies):>8.2f} "
+                  f"{pct[98]:>8.2f}")
+    print(writer.stats())
+
+
+# -------------------------
+# Sharded storage
+# -------------------------
+def _shard_writer(path, shards, programs, seconds, results):
+    # One process: saves one workout per transaction for random users
+    profiling.ENABLED = False
+    repository.configure(path, shards=shards)
+    rng = random.Random(os.getpid())
+    users = list(programs)
+    saves, deadline = 0, time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        user_id = rng.choice(users)
+        repository.save_workouts([repository.WorkoutInput(user_id, programs[user_id], "Exercise 1-0", "2024-01-01",
+                                                          [(5, 100.0)] * 3)])
+        saves += 1
+    results.put(saves)
+
+
+def bench_shards(shard_counts=(1, 2, 4, 8), processes=None, users=64, seconds=3):
+    # Write throughput with the users spread over more files: worker
+    # processes (one per core) contend for one write lock per file, so
+    # saves scale with the shard count up to the number of cores
+    processes = processes or max(2, os.cpu_count() or 1)
+    print(f"{'shards':>8} {'processes':>10} {'saves/s':>10} {'speedup':>8}")
+    baseline = None
+    for shards in shard_counts:
+        path = _fresh_db(shards=shards)
+        programs = {}
+        for i in range(users):
+            user_id = repository.create_user(f"Bench {i}", 30, 80.0, f"bench{i}@example.com", None)
+            programs[user_id] = _seed_program(user_id, 1, 1)
+        # No open connections may cross into the workers
+        repository.configure(path, shards=shards)
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=_shard_writer, args=(path, shards, programs, seconds, results))
+                   for _ in range(processes)]
+        for w in workers:
+            w.start()
+        saves = sum(results.get() for _ in workers)
+        for w in workers:
+            w.join()
+        rate = saves / seconds
+        baseline = baseline or rate
+        print(f"{shards:>8} {processes:>10} {rate:>10.0f} {rate / baseline:>7.2f}x")
+
+
+# -------------------------
+# Analytics
+# -------------------------
+def bench_analytics(n_sets=1_000_000):
+    # Synthetic history: 5 sets per session, 20 exercises, ~3 years
+    import numpy as np
+    import pandas as pd
+    import analytics
+
+    rng = np.random.default_rng(0)
+    workout_id = np.arange(n_sets) // 5
+    frame = pd.DataFrame({
+        "workout_id": workout_id,
+        "date": (np.datetime64("2022-01-01") + (workout_id * 1095 // (workout_id[-1] + 1))).astype(str),
+        "exercise": np.array([f"Exercise {i}" for i in range(20)])[workout_id % 20],
+        "reps": rng.integers(1, 13, n_sets),
+        "weight": rng.uniform(20, 200, n_sets).round(1),
+    })
+    targets = pd.DataFrame({"exercise": [f"Exercise {i}" for i in range(20)], "target_sets": 5, "target_reps": 8})
+
+    start = time.perf_counter()
+    history = analytics.prepare(frame)
+    print(f"{'prepare':>16} {(time.perf_counter() - start) * 1000:>10.1f} ms  ({n_sets} sets)")
+    weekly = history.groupby(["exercise", "week"], observed=True)["tonnage"].sum().reset_index()
+    steps = {
+        "adherence": lambda: analytics.adherence(history, targets),
+        "rolling_average": lambda: analytics.rolling_average(weekly, "tonnage"),
+    }
+    for name, step in steps.items():
+        print(f"{name:>16} {_timed(step, repeat=3):>10.1f} ms")
+
+
+# -------------------------
+# Page query sets at scale
+# -------------------------
+# Each entry replays the repository calls one page render (or save) makes.
+def _page_home(ctx):
+    repository.list_programs(ctx["user_id"])
+
+
+def _page_program_view(ctx):
+    repository.get_program_view(ctx["user_id"], ctx["prog_id"])
+
+
+def _page_exercise_details(ctx):
+    user_id, prog_id, ex_name = ctx["user_id"], ctx["prog_id"], ctx["exercise"]
+    repository.get_exercise(user_id, prog_id, ex_name)
+    repository.get_personal_record(user_id, ex_name)
+    repository.get_rep_maxes(user_id, ex_name)
+    sessions, _ = repository.get_history_page(user_id, ex_name)
+    repository.get_session_sets(user_id, [s.workout_id for s in sessions])
+
+
+def _page_log_workout_save(ctx):
+    repository.save_workout(ctx["user_id"], ctx["prog_id"], ctx["exercise"], str(datetime.date.today()),
+                            [(5, 100.0), (5, 100.0), (5, 100.0)])
+
+
+def _page_login(ctx):
+    services.login(f"user{ctx['user_id']}@example.com", seed.PASSWORD)
+
+
+PAGES = {
+    "home": _page_home,
+    "view_program_exercises": _page_program_view,
+    "exercise_details": _page_exercise_details,
+    "log_workout save": _page_log_workout_save,
+    "login_callback": _page_login,
+}
+
+
+def _contexts(user_ids):
+    contexts = []
+    with repository.connection() as conn:
+        for user_id in user_ids:
+            prog_id, ex_name = conn.execute("""SELECT program_id, name FROM exercises
+                                               WHERE user_id=? AND type='Strength' LIMIT 1""", (user_id,)).fetchone()
+            contexts.append({"user_id": user_id, "prog_id": prog_id, "exercise": ex_name})
+    return contexts
+
+
+def _run_page(page, contexts, threads, iterations):
+    # Latencies (ms) and SQLite VM steps per call, across `threads` workers
+    latencies, vm_steps = [], []
+    lock = threading.Lock()
+
+    def worker(rng):
+        local_latencies, local_steps = [], []
+        with repository.connection() as conn:
+            steps = [0]
+
+            def count():
+                steps[0] += 1
+            conn.set_progress_handler(count, 10)
+            try:
+                for _ in range(iterations):
+                    ctx = rng.choice(contexts)
+                    steps[0] = 0
+                    start = time.perf_counter()
+                    page(ctx)
+                    local_latencies.append((time.perf_counter() - start) * 1000)
+                    local_steps.append(steps[0] * 10)
+            finally:
+                conn.set_progress_handler(None, 0)
+        with lock:
+            latencies.extend(local_latencies)
+            vm_steps.extend(local_steps)
+
+    workers = [threading.Thread(target=worker, args=(random.Random(i),)) for i in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return latencies, vm_steps
+
+
+def bench_pages(user_counts=(10, 50, 200), concurrency=(1, 4, 16), iterations=50):
+    # p50/p99 latency per page as data size and concurrency grow. SQLite
+    # doesn't expose rows scanned to Python; VM steps (sampled every 10
+    # instructions) are the proxy: a query that starts scanning shows up
+    # as steps growing with the data size.
+    for users in user_counts:
+        _fresh_db(pool_size=max(concurrency))
+        contexts = _contexts(seed.seed(users=users, years=1))
+        with repository.connection() as conn:
+            sets = conn.execute("SELECT COUNT(*) FROM workout_sets").fetchone()[0]
+        print(f"-- {users} users, {sets} sets")
+        print(f"{'page':>24} {'threads':>8} {'p50 ms':>8} {'p99 ms':>8} {'vm steps':>10}")
+        for page_name, page in PAGES.items():
+            for threads in concurrency:
+                latencies, steps = _run_page(page, contexts, threads, iterations)
+                pct = statistics.quantiles(latencies, n=100)
+                print(f"{page_name:>24} {threads:>8} {statistics.median(latencies):>8.2f} {pct[98]:>8.2f} "
+                      f"{statistics.median(steps):>10.0f}")
+
+
+BENCHMARKS = {
+    "program_view": bench_program_view,
+    "read_cache": bench_read_cache,
+    "bulk_save": bench_bulk_save,
+    "write_burst": bench_write_burst,
+    "shards": bench_shards,
+    "analytics": bench_analytics,
+    "pages": bench_pages,
+}
+
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHMARKS:
+        print(f"== {name}")
+        BENCHMARKS[name]()
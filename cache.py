@@ -0,0 +1,213 @@
+import time
+import threading
+import functools
+import contextlib
+from collections import OrderedDict, defaultdict
+
+# Process-wide LRU cache for per-user reads. Keys look like
+# (user_id, kind, *args); write paths call invalidate() for the entries they
+# touch. Writes made by other processes (API workers, the maintenance and
+# import tools) can't call it, so every entry also records the user's epoch
+# from the database (bumped by triggers on any write, see migrations.py);
+# a hit whose epoch has moved is reloaded. The epoch lookup is one primary
+# key read, done once per user per scope() (a Streamlit rerun, an API
+# request) and otherwise reused for EPOCH_CHECK_S, so other processes'
+# writes show up by the next request or within that time. A write made
+# through this process always shows at once.
+
+MAX_ENTRIES = 10000
+EPOCH_CHECK_S = 1.0
+
+_epoch_source = None
+# user_id -> (epoch, writes) read in the current thread's scope()
+_local = threading.local()
+
+
+class LRUCache:
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._by_user = defaultdict(set)
+        # Bumped on every invalidation so in-flight loads don't store stale
+        # rows; kept only while the user has entries or loads in flight
+        self._generation = {}
+        self._loading = {}
+        # user_id -> (epoch, when it was read); same lifetime as _generation
+        self._epochs = {}
+        # invalidate() calls so far; an epoch read in a scope before one of
+        # them may be behind this process's own write
+        self._writes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def get_or_load(self, key, loader):
+        user_id = key[0]
+        epoch = self._epoch(user_id) if self.max_entries > 0 else None
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] == epoch:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                # Written by another process since it was loaded
+                del self._data[key]
+                self._discard_user_key(key)
+                self.invalidations += 1
+            self.misses += 1
+            generation = self._generation.get(user_id, 0)
+            self._loading[user_id] = self._loading.get(user_id, 0) + 1
+
+        try:
+            value = loader()
+        except BaseException:
+            with self._lock:
+                self._done_loading(user_id)
+            raise
+
+        with self._lock:
+            stale = self._generation.get(user_id, 0) != generation
+            self._done_loading(user_id)
+            if self.max_entries <= 0 or stale:
+                return value
+            self._data[key] = (value, epoch)
+            self._data.move_to_end(key)
+            self._by_user[user_id].add(key)
+            while len(self._data) > self.max_entries:
+                old_key, _ = self._data.popitem(last=False)
+                self._discard_user_key(old_key)
+                self.evictions += 1
+        return value
+
+    def invalidate(self, user_id, kind=None, *args):
+        # Drops the user's entries matching kind and the leading args
+        prefix = (user_id,) + ((kind,) + args if kind is not None else ())
+        with self._lock:
+            # The write moved the epoch too; read it afresh
+            self._epochs.pop(user_id, None)
+            self._writes += 1
+            if user_id in self._by_user or user_id in self._loading:
+                self._generation[user_id] = self._generation.get(user_id, 0) + 1
+            for key in [k for k in self._by_user.get(user_id, ()) if k[:len(prefix)] == prefix]:
+                del self._data[key]
+                self._discard_user_key(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._by_user.clear()
+            self._generation.clear()
+            self._epochs.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "users": len(self._by_user),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _discard_user_key(self, key):
+        keys = self._by_user.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[key[0]]
+                self._forget_user(key[0])
+
+    def _epoch(self, user_id):
+        if _epoch_source is None:
+            return None
+        scope = getattr(_local, "epochs", None)
+        now = time.monotonic()
+        with self._lock:
+            writes = self._writes
+            if scope is not None:
+                known = scope.get(user_id)
+                if known is not None and known[1] == writes:
+                    return known[0]
+            else:
+                known = self._epochs.get(user_id)
+                if known is not None and now - known[1] < EPOCH_CHECK_S:
+                    return known[0]
+        epoch = _epoch_source(user_id)
+        with self._lock:
+            if scope is not None:
+                scope[user_id] = (epoch, writes)
+            elif EPOCH_CHECK_S > 0 and (user_id in self._by_user or user_id in self._loading):
+                self._epochs[user_id] = (epoch, now)
+        return epoch
+
+    def _done_loading(self, user_id):
+        self._loading[user_id] -= 1
+        if not self._loading[user_id]:
+            del self._loading[user_id]
+            self._forget_user(user_id)
+
+    def _forget_user(self, user_id):
+        # Nothing left to protect once no entry or load refers to the user
+        if user_id not in self._by_user and user_id not in self._loading:
+            self._generation.pop(user_id, None)
+            self._epochs.pop(user_id, None)
+
+
+_cache = LRUCache()
+
+
+def configure(max_entries=MAX_ENTRIES):
+    # max_entries=0 turns caching off (benchmarks measure the database)
+    global _cache
+    _cache = LRUCache(max_entries)
+
+
+@contextlib.contextmanager
+def scope():
+    # Reads each user's epoch at most once until the block ends (again
+    # after a write through this process); nested scopes share the outer one
+    if getattr(_local, "epochs", None) is not None:
+        yield
+        return
+    _local.epochs = {}
+    try:
+        yield
+    finally:
+        _local.epochs = None
+
+
+def epoch(user_id):
+    # The user's epoch as cached reads see it; callers keeping their own
+    # copies of rows (session state) compare against it
+    return _cache._epoch(user_id)
+
+
+def set_epoch_source(source):
+    # source(user_id) -> the user's current epoch (repository.cache_epoch)
+    global _epoch_source
+    _epoch_source = source
+
+
+def cached(kind):
+    # For read functions taking user_id first; results must be immutable
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(user_id, *args, **kwargs):
+            key = (user_id, kind) + args + tuple(sorted(kwargs.items()))
+            return _cache.get_or_load(key, lambda: fn(user_id, *args, **kwargs))
+        return wrapper
+    return decorate
+
+
+def invalidate(user_id, kind=None, *args):
+    _cache.invalidate(user_id, kind, *args)
+
+
+def clear():
+    _cache.clear()
+
+
+def stats():
+    return _cache.stats()
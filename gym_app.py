@@ -1,13 +1,28 @@
+import os
 import streamlit as st
-import sqlite3
 import datetime
 import login
+import repository
+import services
+import analytics
+import profiling
+import cache
+import writer
+
+# User ids (comma-separated) allowed on the query stats page; nobody by default
+ADMIN_USERS = {int(u) for u in os.environ.get("GYM_ADMIN_USERS", "").split(",") if u.strip()}
 
 for key, default in [("user_id", None), ("page", "login"), ("name", "")]:
     if key not in st.session_state:
         st.session_state[key] = default
 
 
+def format_duration(seconds):
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
 def run_app():
     # --- Ensure user is logged in ---
     if "user_id" not in st.session_state:
@@ -17,56 +32,9 @@ def run_app():
     user_id = st.session_state["user_id"]
 
     # -------------------------
-    # Database Setup
+    # Database Setup (schema is created once per process)
     # -------------------------
-    conn = sqlite3.connect("gym_data.db", check_same_thread=False)
-    c = conn.cursor()
-
-    # Programs table
-    c.execute('''CREATE TABLE IF NOT EXISTS programs
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  user_id INTEGER,
-                  name TEXT,
-                  days INTEGER,
-                  date_created TEXT)''')
-
-    # Exercises table
-    c.execute('''CREATE TABLE IF NOT EXISTS exercises
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  user_id INTEGER,
-                  program_id INTEGER,
-                  day INTEGER,
-                  name TEXT,
-                  type TEXT,
-                  target_sets INTEGER,
-                  target_reps INTEGER)''')
-
-    # Workouts table
-    c.execute('''CREATE TABLE IF NOT EXISTS workouts
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  user_id INTEGER,
-                  program_id INTEGER,
-                  exercise_name TEXT,
-                  date TEXT)''')
-
-    # Workout sets table
-    c.execute('''CREATE TABLE IF NOT EXISTS workout_sets
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  user_id INTEGER,
-                  workout_id INTEGER,
-                  set_number INTEGER,
-                  reps INTEGER,
-                  weight REAL)''')
-
-    # Personal records table
-    c.execute('''CREATE TABLE IF NOT EXISTS personal_records (
-                    exercise_name TEXT,
-                    user_id INTEGER,
-                    max_weight REAL,
-                    reps INTEGER DEFAULT 0,
-                    PRIMARY KEY (exercise_name, user_id)
-                 )''')
-    conn.commit()
+    repository.init_db()
 
     # -------------------------
     # Session State Defaults
@@ -78,6 +46,18 @@ def run_app():
     def go_to(page):
         st.session_state["page"] = page
 
+    def program_snapshot():
+        # Program row + exercises kept across reruns; reloaded only after a
+        # write bumps the program's version
+        snapshot = services.program_snapshot(user_id, st.session_state["selected_program"],
+                                             st.session_state.get("program_snapshot"))
+        st.session_state["program_snapshot"] = snapshot
+        return snapshot.program if snapshot else None
+
+    # Admin view: open the app with ?admin=queries as one of ADMIN_USERS
+    if st.query_params.get("admin") == "queries" and user_id in ADMIN_USERS:
+        st.session_state["page"] = "query_stats"
+
     # -------------------------
     # Home Page
     # -------------------------
@@ -87,21 +67,24 @@ def run_app():
         st.write("Choose an option:")
 
         st.button("📅 Create a Program", on_click=lambda: go_to("create_program"))
+        st.button("📈 Progress Stats", on_click=lambda: go_to("stats"))
 
         # Logout button
         def logout():
-            for key in ["user_id", "user_name", "selected_program", "selected_exercise", "current_workout", "page"]:
+            services.logout(user_id)
+            for key in ["user_id", "user_name", "selected_program", "selected_exercise", "current_workout", "page",
+                        "program_snapshot", "suggestion"]:
                 st.session_state.pop(key, None)
+            st.query_params.pop("session", None)
         st.button("🔒 Logout", on_click=logout)
 
         # Show existing programs
-        c.execute("SELECT name, id FROM programs WHERE user_id=?", (user_id,))
-        programs = c.fetchall()
+        programs = services.list_programs(user_id)
         if programs:
-            program_names = [p[0] for p in programs]
+            program_names = [p.name for p in programs]
             selected_program_name = st.selectbox("Select Existing Program", program_names)
             def select_program():
-                program_id = [p[1] for p in programs if p[0] == selected_program_name][0]
+                program_id = [p.id for p in programs if p.name == selected_program_name][0]
                 st.session_state["selected_program"] = program_id
                 go_to("program_page")
             st.button("Select Program", on_click=select_program)
@@ -117,13 +100,11 @@ def run_app():
         def create_program_callback():
             prog_name = st.session_state.get("prog_name_input")
             prog_days = st.session_state.get("prog_days_input")
-            if prog_name:
-                c.execute(
-                    "INSERT INTO programs (user_id, name, days, date_created) VALUES (?, ?, ?, ?)",
-                    (user_id, prog_name, prog_days, str(datetime.date.today()))
-                )
-                conn.commit()
+            try:
+                services.create_program(user_id, prog_name, prog_days)
                 st.success(f"✅ Program '{prog_name}' created!")
+            except services.ServiceError as e:
+                st.error(f"❌ {e}")
 
         st.button("Create Program", on_click=create_program_callback)
         st.button("⬅️ Back to Home", on_click=lambda: go_to("home"))
@@ -133,10 +114,9 @@ def run_app():
     # -------------------------
     elif st.session_state["page"] == "program_page":
         prog_id = st.session_state["selected_program"]
-        c.execute("SELECT name, days FROM programs WHERE id=? AND user_id=?", (prog_id, user_id))
-        result = c.fetchone()
-        if result:
-            prog_name, prog_days = result
+        program = program_snapshot()
+        if program:
+            prog_name, prog_days = program.name, program.days
             st.header(f"📋 Program: {prog_name} ({prog_days} days)")
         else:
             st.error("❌ Program not found.")
@@ -155,10 +135,9 @@ def run_app():
     # -------------------------
     elif st.session_state["page"] == "add_exercises":
         prog_id = st.session_state["selected_program"]
-        c.execute("SELECT name, days FROM programs WHERE id=? AND user_id=?", (prog_id, user_id))
-        result = c.fetchone()
-        if result:
-            prog_name, prog_days = result
+        program = program_snapshot()
+        if program:
+            prog_name, prog_days = program.name, program.days
             st.header(f"➕ Add Exercises to Program: {prog_name}")
         else:
             st.error("❌ Program not found.")
@@ -178,13 +157,11 @@ def run_app():
             ex_type = st.session_state.get("ex_type_input")
             sets = st.session_state.get("target_sets_input")
             reps = st.session_state.get("target_reps_input")
-            if ex_name:
-                c.execute(
-                    "INSERT INTO exercises (user_id, program_id, day, name, type, target_sets, target_reps) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                    (user_id, prog_id, day_choice, ex_name, ex_type, sets, reps)
-                )
-                conn.commit()
+            try:
+                services.add_exercise(user_id, prog_id, day_choice, ex_name, ex_type, sets, reps)
                 st.success(f"✅ Added exercise '{ex_name}' to Day {day_choice}")
+            except services.ServiceError as e:
+                st.error(f"❌ {e}")
 
         st.button("Add Exercise", on_click=add_exercise_callback)
         st.button("⬅️ Back to Program Page", on_click=lambda: go_to("program_page"))
@@ -194,15 +171,13 @@ def run_app():
     # -------------------------
     elif st.session_state["page"] == "delete_program":
         prog_id = st.session_state["selected_program"]
-        c.execute("SELECT name FROM programs WHERE id=? AND user_id=?", (prog_id, user_id))
-        result = c.fetchone()
-        if result:
-            prog_name = result[0]
+        program = program_snapshot()
+        if program:
+            prog_name = program.name
             st.write(f"Are you sure you want to delete '{prog_name}'?")
 
             def delete_program_callback():
-                c.execute("DELETE FROM programs WHERE id=? AND user_id=?", (prog_id, user_id))
-                conn.commit()
+                services.delete_program(user_id, prog_id)
                 st.success(f"✅ Program '{prog_name}' deleted!")
                 st.session_state["selected_program"] = None
                 go_to("home")
@@ -221,11 +196,10 @@ def run_app():
 # -------------------------
     elif st.session_state["page"] == "view_program_exercises":
         prog_id = st.session_state["selected_program"]
-        c.execute("SELECT name, days FROM programs WHERE id=? AND user_id=?", (prog_id, st.session_state["user_id"]))
-        result = c.fetchone()
-        if result:
-            prog_name, prog_days = result
-            st.header(f"📖 Exercises & Stats - {prog_name}")
+        # Program, exercises and PRs come back from a single query
+        view = services.get_program_view(user_id, prog_id)
+        if view:
+            st.header(f"📖 Exercises & Stats - {view.program.name}")
         else:
             st.error("❌ Program not found for this user.")
             st.button("⬅️ Back to Home", on_click=lambda: st.session_state.update({"page": "home"}))
@@ -233,24 +207,22 @@ def run_app():
         # Callback to go to exercise details
         def show_exercise_details(ex_name):
             st.session_state["selected_exercise"] = ex_name
+            st.session_state["history_cursors"] = [None]
             st.session_state["page"] = "exercise_details"
     
-        for day in range(1, prog_days + 1):
+        for day, exercises in (view.days if view else []):
             st.subheader(f"Day {day}")
-            c.execute("SELECT * FROM exercises WHERE program_id=? AND day=? AND user_id=?", (prog_id, day, st.session_state["user_id"]))
-            exercises = c.fetchall()
             if exercises:
                 for ex in exercises:
-                    _, _, _, _, ex_name, ex_type, t_sets, t_reps = ex
+                    ex_name, ex_type, t_sets, t_reps = ex.name, ex.type, ex.target_sets, ex.target_reps
                     col1, col2 = st.columns([6,1])
                     col1.write(f"- {ex_name} [{ex_type}]")
                     if ex_type == "Strength" and t_sets and t_reps:
                         col1.caption(f"Target: {t_sets} sets × {t_reps} reps")
                     # PR
-                    c.execute("SELECT max_weight, reps FROM personal_records WHERE exercise_name=? AND user_id=?", (ex_name, st.session_state["user_id"]))
-                    pr = c.fetchone()
+                    pr = ex.pr
                     if pr:
-                        col1.caption(f"🏆 PR: {pr[0]} kg × {pr[1]} reps")
+                        col1.caption(f"🏆 PR: {pr.max_weight} kg × {pr.reps} reps")
                     # Info button
                     col2.button(
                         "ℹ️",
@@ -278,10 +250,9 @@ def run_app():
             st.header(f"📋 Exercise Details: {ex_name}")
     
             # Fetch exercise info (type & targets)
-            c.execute("SELECT type, target_sets, target_reps FROM exercises WHERE program_id=? AND name=? AND user_id=?", (prog_id, ex_name, user_id))
-            ex_info = c.fetchone()
+            ex_info = services.get_exercise(user_id, prog_id, ex_name)
             if ex_info:
-                ex_type, target_sets, target_reps = ex_info
+                ex_type, target_sets, target_reps = ex_info.type, ex_info.target_sets, ex_info.target_reps
                 st.subheader("Exercise Info")
                 st.write(f"Type: **{ex_type}**")
                 if ex_type == "Strength":
@@ -289,34 +260,72 @@ def run_app():
             else:
                 st.warning("Exercise not found in this program.")
     
+            is_cardio = bool(ex_info) and ex_info.type == "Cardio"
+
             # Personal Record
-            c.execute("SELECT max_weight, reps FROM personal_records WHERE exercise_name=? AND user_id=?", (ex_name, user_id))
-            pr = c.fetchone()
-            st.subheader("🏆 Personal Record")
-            if pr:
-                st.write(f"**{pr[0]} kg × {pr[1]} reps**")
+            pr = None if is_cardio else services.get_personal_record(user_id, ex_name)
+            cardio_stats = services.get_cardio_stats(user_id, ex_name) if is_cardio else None
+            if is_cardio:
+                st.subheader("🏃 Cardio Stats")
+                if cardio_stats:
+                    col1, col2, col3 = st.columns(3)
+                    col1.metric("Sessions", cardio_stats.sessions)
+                    col2.metric("Total distance", f"{cardio_stats.total_distance:.1f} km")
+                    col3.metric("Best pace", f"{format_duration(cardio_stats.best_pace)} /km"
+                                if cardio_stats.best_pace else "–")
+                    weekly = services.get_rollups(user_id, "week", ex_name)
+                    st.bar_chart({"Distance (km)": {r.period: r.distance for r in weekly}})
+                else:
+                    st.write("No cardio sessions recorded yet.")
+            elif pr:
+                st.subheader("🏆 Personal Record")
+                st.write(f"**{pr.max_weight} kg × {pr.reps} reps**")
+                if pr.e1rm:
+                    st.caption(f"Estimated 1RM: {pr.e1rm} kg")
+                rep_maxes = services.get_rep_maxes(user_id, ex_name)
+                if rep_maxes:
+                    st.table({"Reps": [rm.reps for rm in rep_maxes],
+                              "Best (kg)": [rm.max_weight for rm in rep_maxes]})
             else:
+                st.subheader("🏆 Personal Record")
                 st.write("No personal record recorded yet.")
     
-            # Workout History
-            c.execute("""
-                SELECT w.date, ws.set_number, ws.reps, ws.weight
-                FROM workouts w
-                JOIN workout_sets ws ON w.id = ws.workout_id
-                WHERE w.exercise_name=? AND w.user_id=?
-                ORDER BY w.date ASC, ws.set_number ASC
-            """, (ex_name, user_id))
-            logs = c.fetchall()
-    
+            # Workout History (newest first, one page of sessions at a time)
             st.subheader("📝 Workout History")
-            if logs:
-                current_date = None
-                for log in logs:
-                    date, set_number, reps, weight = log
-                    if date != current_date:
-                        st.markdown(f"**Date: {date}**")
-                        current_date = date
-                    st.write(f"Set {set_number}: {weight} kg × {reps} reps")
+            date_range = st.date_input("Date range", value=(), key="history_range",
+                                       on_change=lambda: st.session_state.update({"history_cursors": [None]}))
+            start_date, end_date = (list(date_range) + [None, None])[:2]
+            if start_date and not end_date:
+                end_date = start_date
+
+            # Stack of keyset cursors; the last one is the current page
+            cursors = st.session_state.setdefault("history_cursors", [None])
+            if is_cardio:
+                sessions, next_cursor = services.get_cardio_page(
+                    user_id, ex_name, before=cursors[-1], start_date=start_date, end_date=end_date)
+            else:
+                sessions, sets_by_session, next_cursor = services.get_history_page(
+                    user_id, ex_name, before=cursors[-1], start_date=start_date, end_date=end_date)
+
+            if sessions and is_cardio:
+                for session in sessions:
+                    pace = f" ({format_duration(session.pace_s_per_km)} /km)" if session.pace_s_per_km else ""
+                    st.write(f"**{session.date}** — {session.distance_km} km in "
+                             f"{format_duration(session.duration_s)}{pace}")
+            elif sessions:
+                for session in sessions:
+                    label = (f"{session.date} — {session.sets} sets, {session.volume or 0:g} kg volume, "
+                             f"top set {session.top_weight} kg × {session.top_reps}")
+                    with st.expander(label):
+                        for log in sets_by_session.get(session.workout_id, ()):
+                            st.write(f"Set {log.set_number}: {log.weight} kg × {log.reps} reps")
+
+            if sessions:
+                col1, col2 = st.columns(2)
+                if len(cursors) > 1:
+                    col1.button("⬅️ Newer", on_click=cursors.pop)
+                if next_cursor:
+                    col2.button("Older ➡️", on_click=cursors.append, args=(next_cursor,))
             else:
                 st.write("No workout logs yet.")
     
@@ -324,26 +333,86 @@ def run_app():
             st.button("⬅️ Back to Program Exercises", on_click=lambda: st.session_state.update({"page": "view_program_exercises"}))
 
 
+    # -------------------------
+    # Progress Stats
+    # -------------------------
+    elif st.session_state["page"] == "stats":
+        st.header("📈 Progress Stats")
+        # Charts read the rollup tables; only adherence needs the raw sets
+        weekly = analytics.load_rollups(user_id, "week")
+        weekly = weekly[weekly["sets"] > 0].copy()
+        if weekly.empty:
+            st.info("No strength workouts logged yet.")
+        else:
+            exercise = st.selectbox("Exercise", sorted(weekly["exercise"].unique()))
+
+            weekly["4-week average"] = analytics.rolling_average(weekly, "tonnage", order="period")
+            ex_weekly = weekly[weekly["exercise"] == exercise].set_index("period")
+            st.subheader("Weekly tonnage (kg)")
+            st.line_chart(ex_weekly[["tonnage", "4-week average"]])
+            st.subheader("Weekly sets")
+            st.bar_chart(ex_weekly["sets"])
+
+            daily = analytics.load_rollups(user_id, "day")
+            st.subheader("Estimated 1RM (kg)")
+            st.line_chart(daily[daily["exercise"] == exercise].set_index("period")["best_e1rm"])
+
+            history = analytics.load_history(user_id, exercise)
+            sessions = analytics.adherence(history, analytics.load_targets(user_id))
+            if not sessions.empty:
+                st.subheader("Target adherence")
+                st.metric("Average", f"{sessions['adherence'].mean():.0%}")
+                st.line_chart(sessions.set_index("date")["adherence"])
+
+            st.subheader("Total daily tonnage (all exercises)")
+            st.area_chart(daily.groupby("period")["tonnage"].sum())
+
+        st.button("⬅️ Back to Home", on_click=lambda: go_to("home"))
+
+    # -------------------------
+    # Query Stats (admin)
+    # -------------------------
+    elif st.session_state["page"] == "query_stats" and user_id in ADMIN_USERS:
+        st.header("🔍 Query Stats")
+        profiling.SLOW_QUERY_MS = st.number_input("Log queries slower than (ms)", min_value=0.0,
+                                                  value=profiling.SLOW_QUERY_MS, step=10.0)
+        if not profiling.ENABLED:
+            st.warning("Query profiling is off (GYM_PROFILE_QUERIES=0).")
+
+        st.subheader("Per page (averages per rerun)")
+        st.dataframe(profiling.page_stats(), use_container_width=True)
+        st.subheader("Top statements by total time")
+        st.dataframe(profiling.top_statements(50), use_container_width=True)
+        st.subheader("Read cache")
+        st.write(cache.stats())
+        st.subheader("Write queue")
+        st.write(writer.stats())
+
+        st.button("Reset stats", on_click=profiling.reset)
+
+        def leave_admin():
+            st.query_params.pop("admin", None)
+            go_to("home")
+        st.button("⬅️ Back to Home", on_click=leave_admin)
+
     # -------------------------
     # Log Workout Page
     # -------------------------
     elif st.session_state["page"] == "log_workout":
         prog_id = st.session_state["selected_program"]
-        c.execute("SELECT name, days FROM programs WHERE id=? AND user_id=?", (prog_id, user_id))
-        result = c.fetchone()
-        if result:
-            prog_name, prog_days = result
+        program = program_snapshot()
+        if program:
+            prog_name, prog_days = program.name, program.days
             st.header(f"💪 Log Workout - {prog_name}")
         else:
             st.error("❌ Program not found.")
             st.button("⬅️ Back to Home", on_click=lambda: go_to("home"))
             return
 
-        # Fetch exercises
-        c.execute("SELECT id, day, name, type, target_sets, target_reps FROM exercises WHERE program_id=? AND user_id=?", (prog_id, user_id))
-        exercises = c.fetchall()
+        # From the session snapshot: set entry reruns don't touch the database
+        exercises = st.session_state["program_snapshot"].exercises
         if exercises:
-            ex_names_display = [f"{e[2]} [{e[3]}] (Day {e[1]})" for e in exercises]
+            ex_names_display = [f"{e.name} [{e.type}] (Day {e.day})" for e in exercises]
             selected_ex_display = st.selectbox("Choose Exercise", ex_names_display)
             ex_row = exercises[ex_names_display.index(selected_ex_display)]
             ex_id, day, ex_name, ex_type, target_sets, target_reps = ex_row
@@ -351,12 +420,9 @@ def run_app():
             today = str(datetime.date.today())
 
             def start_workout():
-                c.execute("INSERT INTO workouts (user_id, program_id, exercise_name, date) VALUES (?, ?, ?, ?)",
-                          (user_id, prog_id, ex_name, today))
-                workout_id = c.lastrowid
-                conn.commit()
+                # Nothing is written until the workout is saved
                 st.session_state["current_workout"] = {
-                    "id": workout_id,
+                    "date": today,
                     "exercise_name": ex_name,
                     "type": ex_type,
                     "target_sets": target_sets,
@@ -372,30 +438,34 @@ def run_app():
 
                 if ex_type == "Strength":
                     st.info(f"📌 Target: {target_sets} sets × {target_reps} reps")
+                    # Kept next to the snapshot and valid as long as it is:
+                    # set entry reruns don't recompute it
+                    key = (ex_name, target_reps, workout["date"], st.session_state["program_snapshot"].epoch)
+                    if st.session_state.get("suggestion", (None,))[0] != key:
+                        st.session_state["suggestion"] = (key, services.recommend(user_id, ex_name, target_reps,
+                                                                                  workout["date"]))
+                    suggestion = st.session_state["suggestion"][1]
+                    if suggestion:
+                        st.success(f"🎯 Today: **{suggestion.weight:g} kg × {suggestion.reps}** "
+                                   f"({suggestion.readiness}) - {suggestion.reason}")
                     num_sets = st.number_input("Number of sets performed", min_value=1, step=1, key="num_sets_input")
                     reps_inputs, weight_inputs = [], []
 
                     for s in range(1, num_sets + 1):
                         st.write(f"Set {s}")
                         reps = st.number_input(f"Reps (Set {s})", min_value=1, step=1, key=f"reps_{s}")
-                        weight = st.number_input(f"Weight (kg, Set {s})", min_value=0.0, step=0.5, key=f"weight_{s}")
+                        weight = st.number_input(f"Weight (kg, Set {s})", min_value=0.0, step=0.5, key=f"weight_{s}",
+                                                 value=float(suggestion.weight) if suggestion else 0.0)
                         reps_inputs.append(reps)
                         weight_inputs.append(weight)
 
                     def save_strength_callback():
-                        for idx, (r, w) in enumerate(zip(reps_inputs, weight_inputs), start=1):
-                            c.execute("""INSERT INTO workout_sets (user_id, workout_id, set_number, reps, weight)
-                                         VALUES (?, ?, ?, ?, ?)""",
-                                      (user_id, workout["id"], idx, r, w))
-                            # Update PR
-                            c.execute("SELECT max_weight, reps FROM personal_records WHERE exercise_name=? AND user_id=?",
-                                      (ex_name, user_id))
-                            record = c.fetchone()
-                            if record is None or w > record[0]:
-                                c.execute("""REPLACE INTO personal_records (user_id, exercise_name, max_weight, reps)
-                                             VALUES (?, ?, ?, ?)""",
-                                          (user_id, ex_name, w, r))
-                        conn.commit()
+                        try:
+                            services.log_strength(user_id, prog_id, ex_name, zip(reps_inputs, weight_inputs),
+                                                  workout["date"])
+                        except services.ServiceError as e:
+                            st.error(f"❌ {e}")
+                            return
                         st.success("✅ Strength workout saved!")
                         st.session_state["current_workout"] = None
 
@@ -406,10 +476,12 @@ def run_app():
                     duration = st.number_input("Duration (minutes)", min_value=0.0, step=1.0, key="cardio_duration")
 
                     def save_cardio_callback():
-                        c.execute("""INSERT INTO workout_sets (user_id, workout_id, set_number, reps, weight)
-                                     VALUES (?, ?, ?, ?, ?)""",
-                                  (user_id, workout["id"], 1, int(duration), distance))
-                        conn.commit()
+                        try:
+                            services.log_cardio(user_id, prog_id, ex_name, distance, round(duration * 60),
+                                                workout["date"])
+                        except services.ServiceError as e:
+                            st.error(f"❌ {e}")
+                            return
                         st.success("✅ Cardio workout saved!")
                         st.session_state["current_workout"] = None
 
@@ -420,7 +492,16 @@ def run_app():
 
         st.button("⬅️ Back to Program Page", on_click=lambda: go_to("program_page"))
 
-if st.session_state["user_id"] is None:
-    login.show_login()
-else:
-    run_app()
+# Each query takes a pooled connection only for as long as it runs, so a
+# slow render doesn't hold a slot; cached reads check the user's epoch
+# once per rerun. With every slot busy for POOL_TIMEOUT_S, say so instead
+# of showing a traceback.
+try:
+    if st.session_state["user_id"] is None and not login.restore_session():
+        with profiling.page("login"):
+            login.show_login()
+    else:
+        with cache.scope(), profiling.page(st.session_state["page"] or "home"):
+            run_app()
+except repository.PoolTimeout:
+    st.error("❌ The app is busy right now, please try again in a moment.")
@@ -1,19 +1,13 @@
 import streamlit as st
-import sqlite3
+import repository
+import services
 
-# --- Database connection ---
-conn = sqlite3.connect("gym_data.db", check_same_thread=False)
-c = conn.cursor()
+# --- Database ---
+repository.init_db()
 
-c.execute('''CREATE TABLE IF NOT EXISTS users
-             (id INTEGER PRIMARY KEY AUTOINCREMENT,
-              user_id INTEGER,
-              name TEXT,
-              age INTEGER,
-              weight REAL,
-              mail TEXT UNIQUE,
-              code TEXT)''')
-conn.commit()
+# Lifetime of the token kept in the URL: URLs end up in browser history,
+# so it is much shorter than an API token's and logout revokes it
+SESSION_TTL_S = 12 * 3600
 
 
 def show_login():
@@ -28,18 +22,13 @@ def show_login():
         code = st.text_input("Password", type="password")
 
         def signup_callback():
-            if not name or not mail or not code:
-                st.error("❌ All fields are required.")
-                return
             try:
-                c.execute("INSERT INTO users (name, age, weight, mail, code) VALUES (?, ?, ?, ?, ?)",
-                          (name, age, kilos, mail, code))
-                conn.commit()
+                services.signup(name, age, kilos, mail, code)
                 st.success("✅ Account created! Please log in.")
                 st.session_state["page"] = "login"
                 st.rerun()
-            except sqlite3.IntegrityError:
-                st.error("❌ Email already exists.")
+            except services.ServiceError as e:
+                st.error(f"❌ {e}")
 
         st.button("Create Account", on_click=signup_callback)
 
@@ -48,11 +37,13 @@ def show_login():
         code = st.text_input("Password", type="password")
 
         def login_callback():
-            c.execute("SELECT id, name FROM users WHERE mail=? AND code=?", (mail, code))
-            user = c.fetchone()
+            user = services.login(mail, code)
             if user:
-                st.session_state["user_id"] = user[0]
-                st.session_state["name"] = user[1]
+                st.session_state["user_id"] = user.id
+                st.session_state["name"] = user.name
+                # Signed token in the URL: a browser refresh starts a new
+                # session, which restore_session() picks up without a login
+                st.query_params["session"] = services.issue_token(user, SESSION_TTL_S)
                 st.session_state["page"] = "home"
                 st.success("✅ Logged in!")
                 st.rerun()
@@ -60,3 +51,15 @@ def show_login():
                 st.error("❌ Invalid email or password.")
 
         st.button("Login", on_click=login_callback)
+
+
+def restore_session():
+    # True when the URL carries a valid, unrevoked session token
+    user = services.user_from_token(st.query_params.get("session"))
+    if user is None:
+        return False
+    st.session_state["user_id"] = user.id
+    st.session_state["name"] = user.name
+    if st.session_state.get("page") in (None, "login"):
+        st.session_state["page"] = "home"
+    return True
@@ -0,0 +1,133 @@
+import os
+import sys
+import argparse
+import datetime
+import archive
+import cache
+import progression
+import records
+import repository
+import rollups
+
+# Housekeeping for the database files:
+#   1. purge orphans (rows whose program or workout is gone, empty workouts)
+#      and rebuild the records/rollups they fed
+#   2. move sessions older than the horizon into the archive (archive.py);
+#      rollups and records stay in the hot file, history reads both
+#   3. hand freed pages back to the filesystem with incremental vacuum
+# Each step commits in batches, so the app can keep running meanwhile.
+# With sharded storage (sharding.py) every step goes file by file.
+#
+# Usage: python maintenance.py [--db gym_data.db] [--horizon-days 365]
+#                              [--no-archive] [--no-vacuum]
+
+# (table, condition) for rows that no longer belong to anything. Foreign
+# keys prevent most of these today; older files and the archive (which
+# has no foreign keys into the hot file) can still hold them.
+ORPHANS = [
+    ("exercises", "program_id IS NULL OR program_id NOT IN (SELECT id FROM programs)"),
+    ("workouts", "program_id IS NULL OR program_id NOT IN (SELECT id FROM programs)"),
+    ("workout_sets", "workout_id NOT IN (SELECT id FROM workouts)"),
+    ("cardio_sessions", "workout_id NOT IN (SELECT id FROM workouts)"),
+    ("workouts", "id NOT IN (SELECT workout_id FROM workout_sets) AND id NOT IN (SELECT workout_id FROM cardio_sessions)"),
+    ("archive.sessions", "program_id IS NULL OR program_id NOT IN (SELECT id FROM main.programs)"),
+    ("archive.rep_maxes", "program_id IS NULL OR program_id NOT IN (SELECT id FROM main.programs)"),
+]
+
+
+def purge_orphans():
+    # Returns {table: rows deleted}
+    counts = {}
+    for pool in repository.pools():
+        with repository.transaction(pool=pool) as conn:
+            affected = set()
+            for table, condition in ORPHANS:
+                if table in ("workouts", "archive.sessions"):
+                    affected.update(conn.execute(f"SELECT DISTINCT user_id, exercise_name FROM {table} WHERE {condition}"))
+                deleted = conn.execute(f"DELETE FROM {table} WHERE {condition}").rowcount
+                counts[table] = counts.get(table, 0) + deleted
+            by_user = {}
+            for user_id, ex_name in affected:
+                by_user.setdefault(user_id, []).append(ex_name)
+            for user_id, ex_names in by_user.items():
+                records.rebuild(conn, user_id, ex_names)
+                rollups.rebuild(conn, user_id, ex_names)
+                progression.rebuild(conn, user_id, ex_names)
+        for user_id in by_user:
+            cache.invalidate(user_id)
+    return counts
+
+
+def archive_sessions(horizon_days=archive.HORIZON_DAYS, batch_size=archive.BATCH_SIZE):
+    # Moves sessions dated more than horizon_days ago; returns how many
+    cutoff = datetime.date.today() - datetime.timedelta(days=horizon_days)
+    moved = 0
+    for pool in repository.pools():
+        after_id = 0
+        while True:
+            # One transaction per batch keeps write locks short; the hot
+            # rows only go once the archive copy is committed
+            with repository.transaction(pool=pool) as conn:
+                ids = archive.copy_before(conn, cutoff, after_id, batch_size)
+            if not ids:
+                break
+            with repository.transaction(pool=pool) as conn:
+                archive.drop_hot(conn, ids)
+            moved += len(ids)
+            after_id = ids[-1]
+    return moved
+
+
+def _file_bytes(path):
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+
+
+def vacuum():
+    # Returns {file: (bytes before, bytes after)} for every database and
+    # archive file. A file that predates auto_vacuum=INCREMENTAL gets one
+    # full VACUUM to switch it over; after that only the free pages are
+    # released.
+    report = {}
+    for pool in repository.pools():
+        with repository.connection(pool=pool) as conn:
+            for schema, path in (("main", pool.path), (archive.SCHEMA, pool.archive_path)):
+                before = _file_bytes(path)
+                if conn.execute(f"PRAGMA {schema}.auto_vacuum").fetchone()[0] != 2:
+                    conn.execute(f"PRAGMA {schema}.auto_vacuum=INCREMENTAL")
+                    conn.execute(f"VACUUM {schema}")
+                else:
+                    # execute() steps a result-less statement once, which frees a
+                    # single page; executescript() runs it to completion
+                    conn.executescript(f"PRAGMA {schema}.incremental_vacuum;")
+                conn.execute(f"PRAGMA {schema}.wal_checkpoint(TRUNCATE)").fetchall()
+                report[path] = (before, _file_bytes(path))
+    return report
+
+
+def run(horizon_days=archive.HORIZON_DAYS, archive_old=True, compact=True):
+    report = {"orphans": purge_orphans()}
+    if archive_old:
+        report["archived"] = archive_sessions(horizon_days)
+    if compact:
+        report["vacuum"] = vacuum()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Purge orphans, archive old sessions and vacuum")
+    parser.add_argument("--db", default=repository.DB_PATH)
+    parser.add_argument("--horizon-days", type=int, default=archive.HORIZON_DAYS)
+    parser.add_argument("--no-archive", action="store_true")
+    parser.add_argument("--no-vacuum", action="store_true")
+    args = parser.parse_args()
+
+    repository.configure(args.db)
+    report = run(args.horizon_days, not args.no_archive, not args.no_vacuum)
+    purged = {table: n for table, n in report["orphans"].items() if n}
+    print("🧹 Orphans purged: " + (", ".join(f"{n} {table}" for table, n in purged.items()) or "none"))
+    if "archived" in report:
+        print(f"📦 Archived {report['archived']} sessions older than {args.horizon_days} days")
+    for path, (before, after) in report.get("vacuum", {}).items():
+        print(f"💾 {path}: {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB "
+              f"({(before - after) / 1e6:.1f} MB reclaimed)")
+    sys.exit(0)
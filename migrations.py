@@ -0,0 +1,441 @@
+import sqlite3
+import sys
+import inspect
+import logging
+import collections
+import archive
+import auth
+import profiling
+import progression
+import records
+import rollups
+import sharding
+
+# Each migration is (version, function). The database records the last
+# applied version in PRAGMA user_version; migrate() applies the rest in order
+# in a single transaction. Steps listed in REBUILD_AFTER add a derived
+# table (personal records, rollups, progression state) or change what they
+# are computed from; those are rebuilt once, with the current code, after
+# the last pending step.
+
+log = logging.getLogger("gym_app.migrations")
+
+
+# -------------------------
+# 1: base schema
+# -------------------------
+def _base_schema(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS users
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     user_id INTEGER,
+                     name TEXT,
+                     age INTEGER,
+                     weight REAL,
+                     mail TEXT UNIQUE,
+                     code TEXT)''')
+    # Very old databases were created without the mail column
+    if "mail" not in _columns(conn, "users"):
+        conn.execute("ALTER TABLE users ADD COLUMN mail TEXT")
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS programs
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     user_id INTEGER,
+                     name TEXT,
+                     days INTEGER,
+                     date_created TEXT)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS exercises
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     user_id INTEGER,
+                     program_id INTEGER,
+                     day INTEGER,
+                     name TEXT,
+                     type TEXT,
+                     target_sets INTEGER,
+                     target_reps INTEGER)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS workouts
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     user_id INTEGER,
+                     program_id INTEGER,
+                     exercise_name TEXT,
+                     date TEXT)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS workout_sets
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     user_id INTEGER,
+                     workout_id INTEGER,
+                     set_number INTEGER,
+                     reps INTEGER,
+                     weight REAL)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS personal_records (
+                     exercise_name TEXT,
+                     user_id INTEGER,
+                     max_weight REAL,
+                     reps INTEGER DEFAULT 0,
+                     PRIMARY KEY (exercise_name, user_id)
+                    )''')
+
+
+# -------------------------
+# 2: foreign keys with ON DELETE CASCADE
+# -------------------------
+def _foreign_keys(conn):
+    # Drop rows already orphaned by earlier program deletes
+    conn.execute("DELETE FROM exercises WHERE program_id NOT IN (SELECT id FROM programs)")
+    conn.execute("DELETE FROM workouts WHERE program_id NOT IN (SELECT id FROM programs)")
+    conn.execute("DELETE FROM workout_sets WHERE workout_id NOT IN (SELECT id FROM workouts)")
+
+    # SQLite can't add constraints in place: rebuild each child table
+    _rebuild(conn, "exercises", '''
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+         user_id INTEGER,
+         program_id INTEGER REFERENCES programs(id) ON DELETE CASCADE,
+         day INTEGER,
+         name TEXT,
+         type TEXT,
+         target_sets INTEGER,
+         target_reps INTEGER)''')
+    _rebuild(conn, "workouts", '''
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+         user_id INTEGER,
+         program_id INTEGER REFERENCES programs(id) ON DELETE CASCADE,
+         exercise_name TEXT,
+         date TEXT)''')
+    _rebuild(conn, "workout_sets", '''
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+         user_id INTEGER,
+         workout_id INTEGER REFERENCES workouts(id) ON DELETE CASCADE,
+         set_number INTEGER,
+         reps INTEGER,
+         weight REAL)''')
+
+
+# -------------------------
+# 3: indexes for the hot query paths
+# -------------------------
+def _hot_path_indexes(conn):
+    # Covers the program list on the home page
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_programs_user ON programs (user_id, name, days, date_created)")
+    # Covers exercises by program/day; also serves the cascade from programs
+    conn.execute('''CREATE INDEX IF NOT EXISTS idx_exercises_program
+                    ON exercises (program_id, user_id, day, name, type, target_sets, target_reps)''')
+    # History lookup by exercise; second index serves the cascade from programs
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_workouts_user_exercise ON workouts (user_id, exercise_name, date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_workouts_program ON workouts (program_id)")
+    # Covers the workouts -> sets join and the cascade from workouts
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_workout_sets_workout ON workout_sets (workout_id, set_number, reps, weight)")
+
+
+# -------------------------
+# 4: estimated 1RM and rep-max records
+# -------------------------
+def _rep_maxes(conn):
+    if "e1rm" not in _columns(conn, "personal_records"):
+        conn.execute("ALTER TABLE personal_records ADD COLUMN e1rm REAL")
+    conn.execute('''CREATE TABLE IF NOT EXISTS rep_maxes (
+                     user_id INTEGER,
+                     exercise_name TEXT,
+                     reps INTEGER,
+                     max_weight REAL,
+                     PRIMARY KEY (user_id, exercise_name, reps)
+                    ) WITHOUT ROWID''')
+    # Existing records compared weight only; REBUILD_AFTER recomputes them
+
+
+# -------------------------
+# 5: drop empty workouts
+# -------------------------
+def _empty_workouts(conn):
+    # Left behind when "Start Logging" inserted the workout before any sets
+    conn.execute("DELETE FROM workouts WHERE NOT EXISTS (SELECT 1 FROM workout_sets ws WHERE ws.workout_id = workouts.id)")
+
+
+# -------------------------
+# 6: daily/weekly rollups
+# -------------------------
+def _rollups(conn):
+    for table, period in rollups.PERIODS.items():
+        conn.execute(f'''CREATE TABLE IF NOT EXISTS {table} (
+                         user_id INTEGER,
+                         exercise_name TEXT,
+                         {period} TEXT,
+                         sets INTEGER,
+                         reps INTEGER,
+                         tonnage REAL,
+                         max_weight REAL,
+                         best_e1rm REAL,
+                         distance REAL,
+                         duration INTEGER,
+                         PRIMARY KEY (user_id, exercise_name, {period})
+                        ) WITHOUT ROWID''')
+
+
+# -------------------------
+# 7: dedicated cardio storage
+# -------------------------
+def _cardio_sessions(conn):
+    # Cardio used to be stored as one workout_sets row with the duration in
+    # minutes as reps and the distance as weight
+    conn.execute('''CREATE TABLE IF NOT EXISTS cardio_sessions (
+                     workout_id INTEGER PRIMARY KEY REFERENCES workouts(id) ON DELETE CASCADE,
+                     user_id INTEGER,
+                     exercise_name TEXT,
+                     date TEXT,
+                     distance_km REAL,
+                     duration_s INTEGER,
+                     pace_s_per_km REAL GENERATED ALWAYS AS
+                         (CASE WHEN distance_km > 0 THEN duration_s / distance_km END) STORED
+                    )''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_cardio_user_exercise ON cardio_sessions (user_id, exercise_name, date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_cardio_pace ON cardio_sessions (user_id, exercise_name, pace_s_per_km)")
+    conn.execute('''INSERT INTO cardio_sessions (workout_id, user_id, exercise_name, date, distance_km, duration_s)
+                    SELECT w.id, w.user_id, w.exercise_name, w.date, SUM(ws.weight), SUM(ws.reps) * 60
+                    FROM workouts w
+                    JOIN workout_sets ws ON ws.workout_id = w.id
+                    WHERE EXISTS (SELECT 1 FROM exercises e
+                                  WHERE e.program_id = w.program_id AND e.name = w.exercise_name
+                                    AND e.type = 'Cardio')
+                    GROUP BY w.id''')
+    conn.execute("DELETE FROM workout_sets WHERE workout_id IN (SELECT workout_id FROM cardio_sessions)")
+
+
+# -------------------------
+# 8: program version counter
+# -------------------------
+def _program_versions(conn):
+    # Bumped by every write that changes a program or its exercise list,
+    # so clients holding a snapshot can tell when it went stale
+    if "version" not in _columns(conn, "programs"):
+        conn.execute("ALTER TABLE programs ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+
+# -------------------------
+# 9: hashed passwords, unique mail
+# -------------------------
+def _credentials(conn):
+    # Databases created by the old db_setup.py have no UNIQUE on mail, so
+    # duplicates can exist: the oldest account keeps the address, the
+    # others are left without one (and can't log in) so the index can go
+    # on. Their old addresses are kept in duplicate_mails and the ids are
+    # logged; to let such an account log in again (same password), give
+    # it a new address: UPDATE users SET mail = '<new mail>' WHERE id = <id>
+    if "password_hash" not in _columns(conn, "users"):
+        conn.execute("ALTER TABLE users ADD COLUMN password_hash TEXT")
+    conn.execute("UPDATE users SET mail = lower(trim(mail)) WHERE mail IS NOT NULL")
+    duplicates = conn.execute('''SELECT id, mail FROM users
+                                 WHERE mail IS NOT NULL
+                                   AND id > (SELECT MIN(id) FROM users u WHERE u.mail = users.mail)''').fetchall()
+    if duplicates:
+        conn.execute('''CREATE TABLE IF NOT EXISTS duplicate_mails (
+                         user_id INTEGER PRIMARY KEY,
+                         mail TEXT NOT NULL
+                        )''')
+        conn.executemany("INSERT OR REPLACE INTO duplicate_mails (user_id, mail) VALUES (?, ?)", duplicates)
+        conn.executemany("UPDATE users SET mail = NULL WHERE id = ?", [(user_id,) for user_id, _ in duplicates])
+        log.warning("Removed the duplicate mail from user(s) %s; their old addresses are in duplicate_mails",
+                    ", ".join(str(user_id) for user_id, _ in duplicates))
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_mail ON users (mail)")
+
+    plaintext = conn.execute("SELECT id, code FROM users WHERE code IS NOT NULL AND password_hash IS NULL").fetchall()
+    hashes = auth.hash_many([code for _, code in plaintext])
+    conn.executemany("UPDATE users SET password_hash = ?, code = NULL WHERE id = ?",
+                     [(hashed, user_id) for (user_id, _), hashed in zip(plaintext, hashes)])
+
+
+# -------------------------
+# 10: shard routing catalog
+# -------------------------
+def _user_shards(conn):
+    # Which shard file holds each user's data (see sharding.py). Only the
+    # main file's table is used; no row means the main file itself.
+    conn.execute('''CREATE TABLE IF NOT EXISTS user_shards (
+                     user_id INTEGER PRIMARY KEY,
+                     shard INTEGER NOT NULL
+                    )''')
+
+
+# -------------------------
+# 11: progression state
+# -------------------------
+def _exercise_state(conn):
+    # Per user x exercise state behind the weight suggestions (see
+    # progression.py); REBUILD_AFTER fills it from history
+    conn.execute('''CREATE TABLE IF NOT EXISTS exercise_state (
+                     user_id INTEGER,
+                     exercise_name TEXT,
+                     last_date TEXT,
+                     top_weight REAL,
+                     top_reps INTEGER,
+                     sessions INTEGER,
+                     e1rm REAL,
+                     fatigue REAL,
+                     fitness REAL,
+                     first_date TEXT,
+                     PRIMARY KEY (user_id, exercise_name)
+                    ) WITHOUT ROWID''')
+
+
+# -------------------------
+# 12: cache epochs
+# -------------------------
+# Tables whose rows feed cached reads (see cache.py)
+CACHED_TABLES = ["programs", "exercises", "workouts", "personal_records", "rep_maxes",
+                 "daily_rollups", "weekly_rollups", "exercise_state"]
+
+
+def _cache_epochs(conn):
+    # A per-user counter bumped by triggers on every write to the user's
+    # rows, whichever process or tool makes it, so caches in other
+    # processes can tell their entries went stale. Sets and cardio rows
+    # always change together with their workout row.
+    conn.execute('''CREATE TABLE IF NOT EXISTS cache_epochs (
+                     user_id INTEGER PRIMARY KEY,
+                     epoch INTEGER NOT NULL
+                    )''')
+    for table in CACHED_TABLES:
+        for event, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+            conn.execute(f'''CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_epoch
+                             AFTER {event} ON {table}
+                             BEGIN
+                                 INSERT INTO cache_epochs (user_id, epoch) VALUES ({row}.user_id, 1)
+                                 ON CONFLICT (user_id) DO UPDATE SET epoch = epoch + 1;
+                             END''')
+
+
+# -------------------------
+# 13: token revocation
+# -------------------------
+def _token_generations(conn):
+    # Session tokens carry the user's generation at issue time; logging
+    # out bumps it, which revokes every token issued before (see auth.py)
+    if "token_generation" not in _columns(conn, "users"):
+        conn.execute("ALTER TABLE users ADD COLUMN token_generation INTEGER NOT NULL DEFAULT 0")
+
+
+MIGRATIONS = [
+    (1, _base_schema),
+    (2, _foreign_keys),
+    (3, _hot_path_indexes),
+    (4, _rep_maxes),
+    (5, _empty_workouts),
+    (6, _rollups),
+    (7, _cardio_sessions),
+    (8, _program_versions),
+    (9, _credentials),
+    (10, _user_shards),
+    (11, _exercise_state),
+    (12, _cache_epochs),
+    (13, _token_generations),
+]
+
+REBUILD_AFTER = {4, 6, 7, 11}
+
+
+# -------------------------
+# Helpers
+# -------------------------
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _rebuild(conn, table, definition):
+    columns = ", ".join(_columns(conn, table))
+    conn.execute(f"CREATE TABLE new_{table} {definition}")
+    conn.execute(f"INSERT INTO new_{table} ({columns}) SELECT {columns} FROM {table}")
+    conn.execute(f"DROP TABLE {table}")
+    conn.execute(f"ALTER TABLE new_{table} RENAME TO {table}")
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    # conn must be in autocommit mode (isolation_level=None)
+    if current_version(conn) >= MIGRATIONS[-1][0]:
+        return
+    # Table rebuilds need enforcement off; it can only change outside a transaction
+    fk_enabled = conn.execute("PRAGMA foreign_keys").fetchone()[0]
+    conn.execute("PRAGMA foreign_keys=OFF")
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Re-read inside the write lock: another process may have migrated
+            start = current_version(conn)
+            pending = [(version, step) for version, step in MIGRATIONS if version > start]
+            for version, step in pending:
+                step(conn)
+            if REBUILD_AFTER.intersection(version for version, _ in pending):
+                records.rebuild(conn)
+                rollups.rebuild(conn)
+                progression.rebuild(conn)
+            violations = conn.execute("PRAGMA foreign_key_check").fetchall()
+            if violations:
+                raise sqlite3.IntegrityError(f"Migration left foreign key violations: {violations[:5]}")
+            if pending:
+                conn.execute(f"PRAGMA user_version={pending[-1][0]}")
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.execute(f"PRAGMA foreign_keys={'ON' if fk_enabled else 'OFF'}")
+
+
+# -------------------------
+# Query plan check
+# -------------------------
+def hot_queries():
+    # {name: [(sql, params), ...]}: the statements repository.HOT_READS
+    # send to the configured database, captured as they run (uncached).
+    # Imported here: repository imports this module.
+    import repository
+    queries = {"shard route": [(sharding.ROUTE_QUERY, (1,))]}
+    # Held open so connection setup (migrations, PRAGMAs) isn't captured
+    with repository.connection(), repository.connection(1):
+        for name, read, args in repository.HOT_READS:
+            with profiling.capture() as statements:
+                result = getattr(read, "__wrapped__", read)(*args)
+                if inspect.isgenerator(result):
+                    collections.deque(result, maxlen=0)
+            if not statements:
+                raise RuntimeError(f"{name}: no statements captured; query profiling is off (GYM_PROFILE_QUERIES=0)")
+            # One plan per statement shape
+            queries[name] = list({profiling.normalize(sql): (sql, params) for sql, params in statements}.values())
+    return queries
+
+
+def check_query_plans(conn, queries=None):
+    # Returns {name: [plan details]} for every query that scans a table;
+    # queries defaults to hot_queries()
+    failures = {}
+    for name, statements in (queries or hot_queries()).items():
+        for sql, params in statements:
+            details = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+            # Scanning a LIMITed subquery's output is fine; scanning a table is not
+            subqueries = {d.split()[1] for d in details if d.startswith(("CO-ROUTINE", "MATERIALIZE"))}
+            if any(d.startswith("SCAN") and d.split()[1] not in subqueries for d in details):
+                failures.setdefault(name, []).extend(details)
+    return failures
+
+
+if __name__ == "__main__":
+    # Usage: python migrations.py [db_path] [--check]
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    db_path = args[0] if args else "gym_data.db"
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    # Rebuilds read the archived sessions too
+    archive.attach(conn, archive.path_for(db_path))
+    archive.ensure_schema(conn)
+    migrate(conn)
+    print(f"Schema at version {current_version(conn)}")
+    if "--check" in sys.argv:
+        # Capture what the repository runs against this file
+        profiling.ENABLED = True
+        import repository
+        repository.configure(db_path)
+        failures = check_query_plans(conn)
+        for name, details in failures.items():
+            print(f"❌ {name}: {'; '.join(details)}")
+        if failures:
+            sys.exit(1)
+        print("✅ All hot queries use index lookups")
@@ -0,0 +1,255 @@
+import os
+import re
+import time
+import logging
+import sqlite3
+import threading
+import contextlib
+import statistics
+from collections import deque
+
+# Query instrumentation. Pooled connections are created with
+# InstrumentedConnection, whose cursors time every statement and count the
+# rows it returns. Stats are kept per (page, statement); gym_app tags each
+# rerun with page(). Statements slower than SLOW_QUERY_MS are logged;
+# capture() hands back the statements themselves (migrations.py --check
+# explains their query plans).
+
+ENABLED = os.environ.get("GYM_PROFILE_QUERIES", "1") != "0"
+SLOW_QUERY_MS = float(os.environ.get("GYM_SLOW_QUERY_MS", "50"))
+SAMPLES = 512
+
+log = logging.getLogger("gym_app.queries")
+
+_lock = threading.Lock()
+_local = threading.local()
+_statements = {}
+_pages = {}
+
+
+class StatementStats:
+    def __init__(self):
+        self.count = 0
+        self.rows = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.samples = deque(maxlen=SAMPLES)
+
+
+class PageStats:
+    def __init__(self):
+        self.reruns = 0
+        self.queries = 0
+        self.rows = 0
+        self.total_ms = 0.0
+
+
+def normalize(sql):
+    # One entry per statement shape: collapse whitespace and IN (?, ?, ...) lists
+    sql = " ".join(sql.split())
+    return re.sub(r"\(\?(?:, \?)+\)", "(?, ...)", sql)
+
+
+def _current_page():
+    return getattr(_local, "page", None) or "-"
+
+
+def _record(sql, elapsed_ms, rows):
+    key = (_current_page(), normalize(sql))
+    with _lock:
+        stats = _statements.get(key)
+        if stats is None:
+            stats = _statements[key] = StatementStats()
+        stats.count += 1
+        stats.rows += rows
+        stats.total_ms += elapsed_ms
+        stats.max_ms = max(stats.max_ms, elapsed_ms)
+        stats.samples.append(elapsed_ms)
+    totals = getattr(_local, "totals", None)
+    if totals is not None:
+        totals[0] += 1
+        totals[1] += rows
+        totals[2] += elapsed_ms
+    if elapsed_ms >= SLOW_QUERY_MS:
+        log.warning("slow query (%.1f ms, page %s): %s", elapsed_ms, key[0], key[1])
+
+
+# -------------------------
+# Instrumented connection
+# -------------------------
+class InstrumentedCursor(sqlite3.Cursor):
+    # Each statement is recorded once its cursor is exhausted, re-executed
+    # or closed, so the time spent fetching rows is included
+
+    _pending = None
+
+    def execute(self, sql, parameters=()):
+        self._flush()
+        captured = getattr(_local, "captured", None)
+        if captured is not None:
+            captured.append((sql, parameters))
+        start = time.perf_counter()
+        super().execute(sql, parameters)
+        self._pending = [sql, (time.perf_counter() - start) * 1000, 0]
+        if self.description is None:
+            # No result set (DML/DDL): nothing left to fetch
+            self._flush()
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._flush()
+        start = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        self._pending = [sql, (time.perf_counter() - start) * 1000, 0]
+        self._flush()
+        return self
+
+    def fetchone(self):
+        return self._fetched(super().fetchone, single=True)
+
+    def fetchmany(self, size=None):
+        return self._fetched(lambda: super(InstrumentedCursor, self).fetchmany(size or self.arraysize))
+
+    def fetchall(self):
+        result = self._fetched(super().fetchall)
+        self._flush()
+        return result
+
+    def __next__(self):
+        return self._fetched(super().__next__, single=True)
+
+    def close(self):
+        self._flush()
+        super().close()
+
+    def __del__(self):
+        self._flush()
+
+    def _fetched(self, fetch, single=False):
+        start = time.perf_counter()
+        try:
+            result = fetch()
+        except StopIteration:
+            self._flush()
+            raise
+        if self._pending is not None:
+            self._pending[1] += (time.perf_counter() - start) * 1000
+            if single:
+                if result is None:
+                    self._flush()
+                else:
+                    self._pending[2] += 1
+            else:
+                self._pending[2] += len(result)
+        return result
+
+    def _flush(self):
+        pending, self._pending = self._pending, None
+        if pending is not None:
+            _record(*pending)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    # Connection.execute() runs the statement in C, bypassing the cursor's
+    # Python methods, so route it through cursor().execute()
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def connection_factory():
+    return InstrumentedConnection if ENABLED else sqlite3.Connection
+
+
+# -------------------------
+# Page tagging
+# -------------------------
+@contextlib.contextmanager
+def page(name):
+    # Attributes statements run inside the block to `name` and counts the
+    # block as one rerun of that page
+    previous = getattr(_local, "page", None), getattr(_local, "totals", None)
+    _local.page, _local.totals = name, [0, 0, 0.0]
+    try:
+        yield
+    finally:
+        queries, rows, total_ms = _local.totals
+        _local.page, _local.totals = previous
+        with _lock:
+            stats = _pages.get(name)
+            if stats is None:
+                stats = _pages[name] = PageStats()
+            stats.reruns += 1
+            stats.queries += queries
+            stats.rows += rows
+            stats.total_ms += total_ms
+
+
+@contextlib.contextmanager
+def capture():
+    # Yields a list that collects (sql, parameters) for every statement
+    # this thread runs through an instrumented connection inside the block
+    previous, _local.captured = getattr(_local, "captured", None), []
+    try:
+        yield _local.captured
+    finally:
+        _local.captured = previous
+
+
+# -------------------------
+# Reporting
+# -------------------------
+def _percentile(samples, q):
+    if len(samples) < 2:
+        return samples[0] if samples else 0.0
+    return statistics.quantiles(samples, n=100, method="inclusive")[q - 1]
+
+
+def top_statements(limit=20, order_by="total_ms"):
+    with _lock:
+        rows = [{
+            "page": page_name,
+            "statement": sql,
+            "count": s.count,
+            "total_ms": round(s.total_ms, 2),
+            "mean_ms": round(s.total_ms / s.count, 3),
+            "p50_ms": round(_percentile(list(s.samples), 50), 3),
+            "p99_ms": round(_percentile(list(s.samples), 99), 3),
+            "max_ms": round(s.max_ms, 2),
+            "rows": s.rows,
+        } for (page_name, sql), s in _statements.items()]
+    return sorted(rows, key=lambda r: r[order_by], reverse=True)[:limit]
+
+
+def page_stats():
+    with _lock:
+        return [{
+            "page": name,
+            "reruns": s.reruns,
+            "queries/rerun": round(s.queries / s.reruns, 1),
+            "rows/rerun": round(s.rows / s.reruns, 1),
+            "ms/rerun": round(s.total_ms / s.reruns, 3),
+        } for name, s in sorted(_pages.items(), key=lambda item: -item[1].total_ms)]
+
+
+def reset():
+    with _lock:
+        _statements.clear()
+        _pages.clear()
+
+
+def report(limit=20):
+    lines = [f"{'page':<24} {'reruns':>7} {'queries':>8} {'rows':>8} {'ms':>9}"]
+    for p in page_stats():
+        lines.append(f"{p['page']:<24} {p['reruns']:>7} {p['queries/rerun']:>8} {p['rows/rerun']:>8} {p['ms/rerun']:>9}")
+    lines.append("")
+    lines.append(f"{'total ms':>10} {'count':>7} {'p50':>8} {'p99':>8} {'rows':>8}  page / statement")
+    for s in top_statements(limit):
+        lines.append(f"{s['total_ms']:>10} {s['count']:>7} {s['p50_ms']:>8} {s['p99_ms']:>8} {s['rows']:>8}  "
+                     f"{s['page']} / {s['statement'][:100]}")
+    return "\n".join(lines)
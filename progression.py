@@ -0,0 +1,295 @@
+import os
+import sys
+import math
+import heapq
+import sqlite3
+import argparse
+import datetime
+import itertools
+import concurrent.futures
+from collections import namedtuple
+import archive
+import records
+
+# Progressive-overload suggestions. exercise_state keeps one compact row per
+# user x exercise: the last session's top set, a rolling estimated 1RM and
+# two exponentially decaying training loads (session tonnage) - a fast one
+# for fatigue and a slow one for fitness. Saves advance the state in their
+# own transaction, so the log page suggests today's weight from one row
+# instead of reading history. Like records.py, functions take an open
+# connection and run inside the caller's transaction.
+#
+# A session dated before the state's last one can't be folded in, so the
+# user's exercise is replayed from history instead. Bulk imports skip the
+# per-save update and call recompute(), which replays whole users in a
+# process pool.
+
+# Share of the newest session in the rolling e1RM
+ALPHA = 0.3
+# Time constants (days) of the fatigue and fitness loads
+FATIGUE_DAYS = 7
+FITNESS_DAYS = 28
+# Fatigue rate over fitness rate above which the next session is lighter;
+# only judged once the history spans FITNESS_DAYS
+FATIGUE_RATIO = 1.5
+# A gap this long (days) also means a lighter restart
+LAYOFF_DAYS = 14
+DELOAD = 0.9
+INCREMENT = 2.5
+# Suggestions are rounded to the weight input's step
+WEIGHT_STEP = 0.5
+# Users per batch job
+CHUNK_USERS = 200
+
+ExerciseState = namedtuple("ExerciseState", "last_date top_weight top_reps sessions e1rm fatigue fitness first_date")
+Recommendation = namedtuple("Recommendation", "weight reps readiness load_ratio reason")
+
+COLUMNS = "last_date, top_weight, top_reps, sessions, e1rm, fatigue, fitness, first_date"
+
+
+# -------------------------
+# State arithmetic
+# -------------------------
+def summarize(sets):
+    # (top weight, top reps, best e1RM, tonnage) of one session's (reps,
+    # weight) sets, or None when nothing was lifted. Ties on weight go to
+    # more reps, as in personal_records.
+    sets = [(r, w) for r, w in sets if r and w is not None]
+    if not sets:
+        return None
+    top_reps, top_weight = max(sets, key=lambda s: (s[1], s[0]))
+    return (top_weight, top_reps, max(records.estimate_1rm(w, r) for r, w in sets),
+            sum(r * w for r, w in sets))
+
+
+def advance(state, date, session):
+    # The state after one more session (from summarize()) dated `date`
+    top_weight, top_reps, best_e1rm, tonnage = session
+    if state is None:
+        return ExerciseState(date, top_weight, top_reps, 1, best_e1rm, tonnage, tonnage, date)
+    days = _days_between(state.last_date, date)
+    return ExerciseState(date, top_weight, top_reps, state.sessions + 1,
+                         round(state.e1rm + ALPHA * (best_e1rm - state.e1rm), 2),
+                         state.fatigue * _decay(days, FATIGUE_DAYS) + tonnage,
+                         state.fitness * _decay(days, FITNESS_DAYS) + tonnage,
+                         state.first_date)
+
+
+def load_ratio(state, today):
+    # Fatigue rate over fitness rate as of today; None while the history is
+    # too short for it to mean anything
+    if _days_between(state.first_date, today) < FITNESS_DAYS:
+        return None
+    days = _days_between(state.last_date, today)
+    fitness = state.fitness * _decay(days, FITNESS_DAYS) / FITNESS_DAYS
+    if not fitness:
+        return None
+    return round(state.fatigue * _decay(days, FATIGUE_DAYS) / FATIGUE_DAYS / fitness, 2)
+
+
+def recommend(state, target_reps=None, today=None):
+    # Today's working weight for target_reps (default: the last top set's
+    # reps) by double progression: add INCREMENT once the last top set
+    # reached the target, otherwise repeat it; back off by DELOAD after a
+    # layoff or while fatigue runs well ahead of fitness. None without a
+    # logged session.
+    if state is None:
+        return None
+    today = str(today or datetime.date.today())
+    reps = target_reps or state.top_reps
+    ratio = load_ratio(state, today)
+    gap = _days_between(state.last_date, today)
+    if gap >= LAYOFF_DAYS:
+        weight, readiness = state.top_weight * DELOAD, "rested"
+        reason = f"First session in {gap} days: ease back in"
+    elif ratio is not None and ratio > FATIGUE_RATIO:
+        weight, readiness = state.top_weight * DELOAD, "fatigued"
+        reason = f"Recent load is {ratio}× your usual: lighter day"
+    elif state.top_reps >= reps:
+        weight, readiness = state.top_weight + INCREMENT, "ready"
+        reason = f"Hit {state.top_reps} × {state.top_weight:g} kg last time: add {INCREMENT:g} kg"
+    else:
+        weight, readiness = state.top_weight, "ready"
+        reason = f"Got {state.top_reps} of {reps} reps at {state.top_weight:g} kg: repeat it"
+    return Recommendation(round(weight / WEIGHT_STEP) * WEIGHT_STEP, reps, readiness, ratio, reason)
+
+
+def _days_between(start, end):
+    try:
+        return (datetime.date.fromisoformat(str(end)) - datetime.date.fromisoformat(str(start))).days
+    except ValueError:
+        return 0
+
+
+def _decay(days, time_constant):
+    return math.exp(-max(days, 0) / time_constant)
+
+
+# -------------------------
+# Incremental update on save
+# -------------------------
+def update_from_workouts(conn, workouts):
+    # workouts: repository.WorkoutInput rows (sets as lists) just inserted,
+    # in id order
+    sessions = {}
+    for wk in workouts:
+        session = summarize(wk.sets) if wk.type != "Cardio" else None
+        if session:
+            sessions.setdefault((wk.user_id, wk.exercise_name), []).append((str(wk.date), session))
+
+    backdated = {}
+    for (user_id, ex_name), logged in sessions.items():
+        # Stable: same-day sessions keep their id order
+        logged.sort(key=lambda s: s[0])
+        row = conn.execute(f"SELECT {COLUMNS} FROM exercise_state WHERE user_id=? AND exercise_name=?",
+                           (user_id, ex_name)).fetchone()
+        state = ExerciseState._make(row) if row else None
+        if state is not None and logged[0][0] < state.last_date:
+            backdated.setdefault(user_id, []).append(ex_name)
+            continue
+        for date, session in logged:
+            state = advance(state, date, session)
+        _write(conn, [(user_id, ex_name) + state])
+    for user_id, ex_names in backdated.items():
+        rebuild(conn, user_id, ex_names)
+
+
+def _write(conn, rows):
+    conn.executemany(f"INSERT OR REPLACE INTO exercise_state (user_id, exercise_name, {COLUMNS}) "
+                     f"VALUES (?, ?, {', '.join('?' * 8)})", rows)
+
+
+# -------------------------
+# Rebuild from history
+# -------------------------
+def states(conn, user_id=None, exercise_names=None):
+    # Replays history (hot and archived sessions, oldest first) into
+    # (user_id, exercise_name, *ExerciseState) rows
+    sessions = heapq.merge(_hot_sessions(conn, user_id, exercise_names),
+                           _archived_sessions(conn, user_id, exercise_names), key=lambda s: s[:4])
+    for key, logged in itertools.groupby(sessions, key=lambda s: s[:2]):
+        state = None
+        for _, _, date, _, session in logged:
+            state = advance(state, date, session)
+        yield key + state
+
+
+def _hot_sessions(conn, user_id, exercise_names):
+    scope, params = records.scope_filter(user_id, exercise_names, "w.")
+    rows = conn.execute(f"""
+        SELECT w.user_id, w.exercise_name, w.date, w.id, ws.reps, ws.weight
+        FROM workouts w
+        JOIN workout_sets ws ON ws.workout_id = w.id
+        WHERE {scope}
+        ORDER BY w.user_id, w.exercise_name, w.date, w.id, ws.set_number
+    """, params)
+    for key, sets in itertools.groupby(rows, key=lambda r: r[:4]):
+        session = summarize([r[4:] for r in sets])
+        if session:
+            yield key + (session,)
+
+
+def _archived_sessions(conn, user_id, exercise_names):
+    if not records.archive_attached(conn):
+        return
+    scope, params = records.scope_filter(user_id, exercise_names)
+    for row in conn.execute(f"""
+            SELECT user_id, exercise_name, date, workout_id, set_data FROM {archive.SCHEMA}.sessions
+            WHERE {scope} AND set_data IS NOT NULL AND {archive.NOT_HOT}
+            ORDER BY user_id, exercise_name, date, workout_id""", params):
+        session = summarize([(r, w) for _, r, w in archive.unpack_sets(row[4])])
+        if session:
+            yield row[:4] + (session,)
+
+
+def rebuild(conn, user_id=None, exercise_names=None):
+    # Scoped like records.rebuild()
+    if exercise_names is not None:
+        exercise_names = list(exercise_names)
+        if not exercise_names:
+            return
+    scope, params = records.scope_filter(user_id, exercise_names)
+    rows = list(states(conn, user_id, exercise_names))
+    conn.execute(f"DELETE FROM exercise_state WHERE {scope}", params)
+    _write(conn, rows)
+
+
+# -------------------------
+# Batch recompute
+# -------------------------
+def _replay_users(path, archive_path, user_ids):
+    # Runs in a worker process: read-only replay of some users of one file,
+    # from one snapshot, plus the users' cache epochs in that snapshot
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        archive.attach(conn, archive_path)
+        conn.execute("BEGIN")
+        epochs = _epochs(conn, user_ids)
+        return epochs, [row for user_id in user_ids for row in states(conn, user_id)]
+    finally:
+        conn.close()
+
+
+def _epochs(conn, user_ids):
+    # Bumped by every write to a user's rows (migrations.py, step 12)
+    found = dict(conn.execute(
+        f"SELECT user_id, epoch FROM cache_epochs WHERE user_id IN ({', '.join('?' * len(user_ids))})", user_ids))
+    return {user_id: found.get(user_id, 0) for user_id in user_ids}
+
+
+def _store(conn, user_ids, epochs, rows):
+    # Writes a worker's replay, inside the write transaction. Users written
+    # to since the worker's snapshot are replayed again here, under the
+    # write lock, so a save in between isn't overwritten with stale state.
+    moved = {user_id for user_id, epoch in _epochs(conn, user_ids).items() if epoch != epochs[user_id]}
+    if moved:
+        rows = [row for row in rows if row[0] not in moved]
+        rows += [row for user_id in sorted(moved) for row in states(conn, user_id)]
+    conn.execute(f"DELETE FROM exercise_state WHERE user_id IN ({', '.join('?' * len(user_ids))})", user_ids)
+    _write(conn, rows)
+    return len(rows)
+
+
+def recompute(user_ids=None, processes=None, chunk_size=CHUNK_USERS):
+    # Rebuilds exercise_state for user_ids (default: everyone) in parallel:
+    # worker processes replay chunks of users and this process writes each
+    # chunk in one transaction. Returns the number of states written.
+    import cache
+    import repository
+    jobs = []
+    for pool in repository.pools():
+        if user_ids is None:
+            with repository.connection(pool=pool) as conn:
+                present = [row[0] for row in conn.execute(f"""
+                    SELECT user_id FROM workouts UNION SELECT user_id FROM {archive.SCHEMA}.sessions
+                    UNION SELECT user_id FROM exercise_state""") if row[0] is not None]
+        else:
+            present = sorted({u for u in user_ids if repository.shard_pool(repository.shard_of(u)) is pool})
+        jobs.extend((pool, present[i:i + chunk_size]) for i in range(0, len(present), chunk_size))
+    if not jobs:
+        return 0
+
+    written = 0
+    with concurrent.futures.ProcessPoolExecutor(processes or os.cpu_count()) as executor:
+        futures = {executor.submit(_replay_users, pool.path, pool.archive_path, chunk): (pool, chunk)
+                   for pool, chunk in jobs}
+        for future in concurrent.futures.as_completed(futures):
+            pool, chunk = futures[future]
+            epochs, rows = future.result()
+            with repository.transaction(pool=pool) as conn:
+                written += _store(conn, chunk, epochs, rows)
+            for user_id in chunk:
+                cache.invalidate(user_id, "exercise_state")
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompute progression state for every user")
+    parser.add_argument("--db", default="gym_data.db")
+    parser.add_argument("--processes", type=int, help="worker processes (default: one per core)")
+    args = parser.parse_args()
+
+    import repository
+    repository.configure(args.db)
+    print(f"✅ Recomputed {recompute(processes=args.processes)} exercise states")
+    sys.exit(0)
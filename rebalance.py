@@ -0,0 +1,181 @@
+import sys
+import argparse
+import cache
+import repository
+import sharding
+
+# Moves users between database files to match a shard count (see
+# sharding.py): from a single gym_data.db into 4 shards with --shards 4,
+# from 4 to 8 with --shards 8 (jump hashing moves about half the users),
+# back into the main file with --shards 0. The plan comes from the users
+# table and the user_shards catalog.
+#
+# A user is copied into the target file in one transaction, re-routed in
+# the catalog, then deleted from the source. Rerunning after an
+# interruption finishes the job: a partial copy is redone and data left
+# in a file the user no longer routes to is purged. Program and workout
+# ids are per file, so a moved user's ids are renumbered (in the same
+# order). Run it with the app stopped, and restart the app with
+# GYM_SHARDS set to the new count.
+#
+# Usage: python rebalance.py --shards N [--db gym_data.db] [--dry-run]
+
+# (schema, table, renumbered columns) for every table holding user data,
+# parents first. Renumbered columns take the moved row's new id in the
+# named table; None leaves the column for the target to assign.
+USER_TABLES = [
+    ("main", "programs", {"id": "programs"}),
+    ("main", "exercises", {"id": None, "program_id": "programs"}),
+    ("main", "workouts", {"id": "workouts", "program_id": "programs"}),
+    ("main", "workout_sets", {"id": None, "workout_id": "workouts"}),
+    ("main", "cardio_sessions", {"workout_id": "workouts"}),
+    ("main", "personal_records", {}),
+    ("main", "rep_maxes", {}),
+    ("main", "daily_rollups", {}),
+    ("main", "weekly_rollups", {}),
+    ("main", "exercise_state", {}),
+    ("archive", "sessions", {"workout_id": "workouts", "program_id": "programs"}),
+    ("archive", "rep_maxes", {"program_id": "programs"}),
+]
+
+# Where the source file's schemas are attached during a copy
+SOURCE = {"main": "src", "archive": "src_archive"}
+
+
+def plan(count):
+    # [(user_id, current shard, target shard)] for every user not where
+    # `count` shards would put them; None is the main file
+    with repository.connection() as conn:
+        users = conn.execute("""SELECT u.id, s.shard FROM users u
+                                LEFT JOIN user_shards s ON s.user_id = u.id ORDER BY u.id""").fetchall()
+    moves = []
+    for user_id, current in users:
+        target = sharding.shard_for(user_id, count)
+        if target != current:
+            moves.append((user_id, current, target))
+    return moves
+
+
+def move_user(user_id, source, target):
+    # Returns the number of rows copied
+    src, dst = repository.shard_pool(source), repository.shard_pool(target)
+    with repository.connection(pool=dst) as conn:
+        conn.execute(f"ATTACH DATABASE ? AS {SOURCE['main']}", (src.path,))
+        conn.execute(f"ATTACH DATABASE ? AS {SOURCE['archive']}", (src.archive_path,))
+        try:
+            with repository.transaction(pool=dst):
+                # Anything already here is a partial copy from an interrupted run
+                _delete_user(conn, user_id)
+                copied = _copy_user(conn, user_id)
+        finally:
+            for schema in SOURCE.values():
+                conn.execute(f"DETACH DATABASE {schema}")
+    repository.set_shard(user_id, target)
+    with repository.transaction(pool=src) as conn:
+        _delete_user(conn, user_id)
+    cache.invalidate(user_id)
+    return copied
+
+
+def _copy_user(conn, user_id):
+    shift = _id_shifts(conn, user_id)
+    copied = 0
+    for schema, table, renumbered in USER_TABLES:
+        source = SOURCE[schema]
+        # table_xinfo's last column flags generated columns, which can't be inserted
+        columns = [row[1] for row in conn.execute(f"PRAGMA {source}.table_xinfo({table})")
+                   if row[6] == 0 and renumbered.get(row[1], "") is not None]
+        values = [f"{column} + {shift[renumbered[column]]}" if column in renumbered else column
+                  for column in columns]
+        copied += conn.execute(f"""INSERT INTO {schema}.{table} ({', '.join(columns)})
+                                   SELECT {', '.join(values)} FROM {source}.{table} WHERE user_id=?""",
+                               (user_id,)).rowcount
+    # Archived sessions keep workout ids the target must never hand out
+    top = conn.execute("SELECT MAX(workout_id) FROM archive.sessions WHERE user_id=?", (user_id,)).fetchone()[0]
+    if top is not None and not conn.execute("UPDATE main.sqlite_sequence SET seq = MAX(seq, ?) WHERE name='workouts'",
+                                            (top,)).rowcount:
+        conn.execute("INSERT INTO main.sqlite_sequence (name, seq) VALUES ('workouts', ?)", (top,))
+    return copied
+
+
+def _id_shifts(conn, user_id):
+    # Offsets that move the user's program and workout ids above every id
+    # the target file has used, keeping their order
+    programs_low = conn.execute(f"SELECT MIN(id) FROM {SOURCE['main']}.programs WHERE user_id=?",
+                                (user_id,)).fetchone()[0]
+    workouts_low = conn.execute(f"""SELECT MIN(id) FROM (
+                                        SELECT MIN(id) AS id FROM {SOURCE['main']}.workouts WHERE user_id=?
+                                        UNION ALL
+                                        SELECT MIN(workout_id) FROM {SOURCE['archive']}.sessions WHERE user_id=?)""",
+                                (user_id, user_id)).fetchone()[0]
+    workouts_next = max(_next_id(conn, "workouts"),
+                        (conn.execute("SELECT MAX(workout_id) FROM archive.sessions").fetchone()[0] or 0) + 1)
+    return {"programs": _next_id(conn, "programs") - (programs_low or 0),
+            "workouts": workouts_next - (workouts_low or 0)}
+
+
+def _next_id(conn, table):
+    # AUTOINCREMENT never reuses an id, so the next one is past both
+    return conn.execute(f"""SELECT MAX(COALESCE((SELECT seq FROM main.sqlite_sequence WHERE name='{table}'), 0),
+                                       COALESCE((SELECT MAX(id) FROM main.{table}), 0)) + 1""").fetchone()[0]
+
+
+def _delete_user(conn, user_id):
+    # Children first
+    for schema, table, _ in reversed(USER_TABLES):
+        conn.execute(f"DELETE FROM {schema}.{table} WHERE user_id=?", (user_id,))
+
+
+def purge_strays(db_path):
+    # Deletes user data sitting in a file the catalog doesn't route the
+    # user to (left by an interrupted move); returns how many users
+    purged = 0
+    for shard in [None] + sharding.existing_shards(db_path):
+        pool = repository.shard_pool(shard)
+        with repository.connection(pool=pool) as conn:
+            present = [row[0] for row in conn.execute(" UNION ".join(
+                f"SELECT user_id FROM {schema}.{table}" for schema, table, _ in USER_TABLES))]
+        for user_id in present:
+            if user_id is not None and repository.shard_of(user_id) != shard:
+                with repository.transaction(pool=pool) as conn:
+                    _delete_user(conn, user_id)
+                purged += 1
+    return purged
+
+
+def rebalance(db_path, count, progress=None):
+    # Returns (users moved, stray users purged)
+    moves = plan(count)
+    for done, (user_id, source, target) in enumerate(moves, start=1):
+        move_user(user_id, source, target)
+        if progress:
+            progress(done, len(moves))
+    return len(moves), purge_strays(db_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move users between shard files")
+    parser.add_argument("--shards", type=int, required=True, help="target shard count (0: unsharded)")
+    parser.add_argument("--db", default=repository.DB_PATH)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    # Sharded storage even for --shards 0, to read the current routes
+    repository.configure(args.db, shards=max(args.shards, 1))
+    moves = plan(args.shards)
+    flows = {}
+    for _, source, target in moves:
+        flow = " -> ".join("main" if shard is None else f"shard {shard}" for shard in (source, target))
+        flows[flow] = flows.get(flow, 0) + 1
+    for flow, n in sorted(flows.items()):
+        print(f"  {flow}: {n} users")
+    if args.dry_run:
+        print(f"Would move {len(moves)} users")
+        sys.exit(0)
+
+    def progress(done, total):
+        if done % 100 == 0 or done == total:
+            print(f"  moved {done}/{total}")
+
+    moved, purged = rebalance(args.db, args.shards, progress)
+    print(f"✅ Moved {moved} users, purged {purged} stray copies. Start the app with GYM_SHARDS={args.shards}")
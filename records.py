@@ -0,0 +1,151 @@
+import os
+import sys
+import sqlite3
+
+# Personal records. personal_records keeps the heaviest set per exercise
+# (ties go to more reps) plus the best estimated 1RM; rep_maxes keeps the
+# heaviest weight lifted for each rep count. Functions take an open
+# connection so they can run inside the caller's transaction.
+
+# Read by every process (app, API workers, tools) so stored estimates
+# agree; after changing it, rebuild records, rollups and progression state
+FORMULA = os.environ.get("GYM_FORMULA", "epley")
+
+
+def epley(weight, reps):
+    return weight if reps <= 1 else weight * (1 + reps / 30)
+
+
+def brzycki(weight, reps):
+    # Undefined from 37 reps up; fall back to the weight itself
+    if reps <= 1 or reps >= 37:
+        return weight
+    return weight * 36 / (37 - reps)
+
+
+FORMULAS = {"epley": epley, "brzycki": brzycki}
+if FORMULA not in FORMULAS:
+    raise ValueError(f"GYM_FORMULA must be one of {', '.join(FORMULAS)}, not {FORMULA!r}")
+
+
+def estimate_1rm(weight, reps, formula=None):
+    if weight is None or reps is None:
+        return None
+    return round(FORMULAS[formula or FORMULA](weight, reps), 2)
+
+
+# -------------------------
+# Incremental update on save
+# -------------------------
+def update_from_sets(conn, user_id, ex_name, sets):
+    # sets: iterable of (reps, weight) from one workout
+    sets = [(r, w) for r, w in sets if r and w is not None]
+    if not sets:
+        return
+
+    best_reps, best_weight = max(sets, key=lambda s: (s[1], s[0]))
+    best_e1rm = max(estimate_1rm(w, r) for r, w in sets)
+    conn.execute("""
+        INSERT INTO personal_records (exercise_name, user_id, max_weight, reps, e1rm)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (exercise_name, user_id) DO UPDATE SET
+            max_weight = CASE WHEN excluded.max_weight > max_weight
+                                OR (excluded.max_weight = max_weight AND excluded.reps > reps)
+                              THEN excluded.max_weight ELSE max_weight END,
+            reps = CASE WHEN excluded.max_weight > max_weight
+                          OR (excluded.max_weight = max_weight AND excluded.reps > reps)
+                        THEN excluded.reps ELSE reps END,
+            e1rm = MAX(COALESCE(e1rm, 0), excluded.e1rm)
+    """, (ex_name, user_id, best_weight, best_reps, best_e1rm))
+
+    best_by_reps = {}
+    for r, w in sets:
+        best_by_reps[r] = max(w, best_by_reps.get(r, w))
+    conn.executemany("""
+        INSERT INTO rep_maxes (user_id, exercise_name, reps, max_weight)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (user_id, exercise_name, reps) DO UPDATE SET
+            max_weight = MAX(max_weight, excluded.max_weight)
+    """, [(user_id, ex_name, r, w) for r, w in best_by_reps.items()])
+
+
+# -------------------------
+# Rebuild from history
+# -------------------------
+def scope_filter(user_id, exercise_names, prefix=""):
+    # WHERE clause limiting a rebuild to one user and some of their exercises
+    where, params = [], []
+    if user_id is not None:
+        where.append(f"{prefix}user_id = ?")
+        params.append(user_id)
+        if exercise_names is not None:
+            where.append(f"{prefix}exercise_name IN ({', '.join('?' * len(exercise_names))})")
+            params.extend(exercise_names)
+    return " AND ".join(where) or "1", params
+
+
+def archive_attached(conn):
+    # True when the archive database (see archive.py) is attached and set up
+    try:
+        conn.execute("SELECT 1 FROM archive.rep_maxes LIMIT 0")
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+
+def rebuild(conn, user_id=None, exercise_names=None):
+    # Recomputes records from workout_sets (strength only; cardio lives in
+    # cardio_sessions) plus the archived rep maxes. One aggregate pass fills
+    # rep_maxes; personal_records is then derived from the (much smaller)
+    # rep_maxes rows. Scope with user_id and optionally exercise_names.
+    if exercise_names is not None:
+        exercise_names = list(exercise_names)
+        if not exercise_names:
+            return
+    scope, params = scope_filter(user_id, exercise_names)
+    history_scope, _ = scope_filter(user_id, exercise_names, "w.")
+    conn.create_function("e1rm", 2, estimate_1rm, deterministic=True)
+
+    conn.execute(f"DELETE FROM rep_maxes WHERE {scope}", params)
+    conn.execute(f"DELETE FROM personal_records WHERE {scope}", params)
+    conn.execute(f"""
+        INSERT INTO rep_maxes (user_id, exercise_name, reps, max_weight)
+        SELECT w.user_id, w.exercise_name, ws.reps, MAX(ws.weight)
+        FROM workouts w
+        JOIN workout_sets ws ON ws.workout_id = w.id
+        WHERE ws.reps > 0 AND ws.weight IS NOT NULL AND {history_scope}
+        GROUP BY w.user_id, w.exercise_name, ws.reps
+    """, params)
+    if archive_attached(conn):
+        conn.execute(f"""
+            INSERT INTO rep_maxes (user_id, exercise_name, reps, max_weight)
+            SELECT user_id, exercise_name, reps, MAX(max_weight) FROM archive.rep_maxes
+            WHERE {scope}
+            GROUP BY user_id, exercise_name, reps
+            ON CONFLICT (user_id, exercise_name, reps) DO UPDATE SET
+                max_weight = MAX(max_weight, excluded.max_weight)
+        """, params)
+    conn.execute(f"""
+        INSERT INTO personal_records (exercise_name, user_id, max_weight, reps, e1rm)
+        SELECT exercise_name, user_id, max_weight, reps, best_e1rm FROM (
+            SELECT exercise_name, user_id, max_weight, reps,
+                   MAX(e1rm(max_weight, reps)) OVER per_exercise AS best_e1rm,
+                   ROW_NUMBER() OVER (per_exercise ORDER BY max_weight DESC, reps DESC) AS position
+            FROM rep_maxes
+            WHERE {scope}
+            WINDOW per_exercise AS (PARTITION BY user_id, exercise_name)
+        ) WHERE position = 1
+    """, params)
+
+
+if __name__ == "__main__":
+    # Usage: [GYM_FORMULA=epley|brzycki] python records.py [db_path]
+    args = sys.argv[1:]
+    import repository
+    repository.configure(args[0] if args else repository.DB_PATH)
+    count = 0
+    for pool in repository.pools():
+        with repository.transaction(pool=pool) as conn:
+            rebuild(conn)
+            count += conn.execute("SELECT COUNT(*) FROM personal_records").fetchone()[0]
+    print(f"✅ Rebuilt {count} personal records")
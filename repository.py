@@ -0,0 +1,759 @@
+import os
+import sqlite3
+import threading
+import queue
+import contextlib
+import datetime
+import heapq
+from collections import namedtuple
+import archive
+import migrations
+import profiling
+import cache
+import progression
+import records
+import rollups
+import sharding
+
+DB_PATH = "gym_data.db"
+POOL_SIZE = 8
+# How long connection() waits for a free slot before giving up
+POOL_TIMEOUT_S = 10
+# Number of shard files users are spread over (see sharding.py); 0 keeps
+# everything in DB_PATH
+SHARDS = int(os.environ.get("GYM_SHARDS", "0"))
+
+# Applied to every new connection
+PRAGMAS = [
+    # Lets maintenance.py hand freed pages back with incremental_vacuum;
+    # only applies to a new file (maintenance converts existing ones)
+    "PRAGMA auto_vacuum=INCREMENTAL",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA busy_timeout=5000",
+]
+
+User = namedtuple("User", "id name")
+Credentials = namedtuple("Credentials", "id name password_hash")
+Program = namedtuple("Program", "id name days date_created")
+Exercise = namedtuple("Exercise", "id day name type target_sets target_reps")
+PersonalRecord = namedtuple("PersonalRecord", "max_weight reps e1rm")
+RepMax = namedtuple("RepMax", "reps max_weight")
+Rollup = namedtuple("Rollup", "exercise_name period sets reps tonnage max_weight best_e1rm distance duration")
+HistoryRow = namedtuple("HistoryRow", "date set_number reps weight")
+SessionSummary = namedtuple("SessionSummary", "workout_id date sets total_reps volume top_weight top_reps")
+ExerciseView = namedtuple("ExerciseView", "id day name type target_sets target_reps pr")
+ProgramView = namedtuple("ProgramView", "program days")
+# epoch: the user's cache epoch the snapshot was checked against (services.py)
+ProgramSnapshot = namedtuple("ProgramSnapshot", "program exercises version epoch")
+# Strength workouts carry sets as [(reps, weight), ...]; cardio ones carry
+# distance (km) and duration (seconds) instead
+WorkoutInput = namedtuple("WorkoutInput", "user_id program_id exercise_name date sets type distance duration",
+                          defaults=("Strength", None, None))
+CardioSession = namedtuple("CardioSession", "workout_id date distance_km duration_s pace_s_per_km")
+CardioStats = namedtuple("CardioStats", "sessions total_distance total_duration best_pace longest_distance")
+
+
+# -------------------------
+# Connection pool
+# -------------------------
+class PoolTimeout(sqlite3.OperationalError):
+    pass
+
+
+class ConnectionPool:
+    """Bounded pool handing out one connection per worker thread.
+
+    A thread keeps the same connection for nested ``connection()`` blocks and
+    returns it to the pool when the outermost block exits. ``reserved()``
+    is one extra connection outside the slots for the write-behind thread,
+    which request threads holding every slot may be waiting on. The ``for_user``,
+    ``for_shard``, ``shard_of``, ``pools`` and ``assign`` methods are the
+    storage interface sharding.ShardedPool also implements; with one file
+    they are trivial.
+    """
+
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self.archive_path = archive.path_for(path)
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._local = threading.local()
+        self._reserved = None
+        self._reserved_lock = threading.Lock()
+
+    def _connect(self):
+        # isolation_level=None: transactions are opened explicitly in transaction()
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None,
+                               factory=profiling.connection_factory())
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        archive.attach(conn, self.archive_path)
+        return conn
+
+    @contextlib.contextmanager
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            yield conn
+            return
+
+        if not self._slots.acquire(timeout=POOL_TIMEOUT_S):
+            raise PoolTimeout(f"database busy: no free connection after {POOL_TIMEOUT_S}s")
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+            self._slots.release()
+
+    @contextlib.contextmanager
+    def reserved(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            yield conn
+            return
+        with self._reserved_lock:
+            if self._reserved is None:
+                self._reserved = self._connect()
+            conn = self._local.conn = self._reserved
+            try:
+                yield conn
+            finally:
+                self._local.conn = None
+                if conn.in_transaction:
+                    conn.rollback()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._reserved_lock:
+            if self._reserved is not None:
+                self._reserved.close()
+                self._reserved = None
+
+    def for_user(self, user_id):
+        return self
+
+    def for_shard(self, shard):
+        return self
+
+    def shard_of(self, user_id):
+        return None
+
+    def pools(self):
+        return [self]
+
+    def assign(self, conn, user_id):
+        pass
+
+
+def _setup(pool):
+    with pool.connection() as conn:
+        archive.ensure_schema(conn)
+        migrations.migrate(conn)
+
+
+def _storage(path, size, shards):
+    if shards:
+        return sharding.ShardedPool(path, shards, size, ConnectionPool, _setup)
+    return ConnectionPool(path, size)
+
+
+_pool = _storage(DB_PATH, POOL_SIZE, SHARDS)
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+def configure(path=DB_PATH, size=POOL_SIZE, shards=SHARDS):
+    # Point the module at another database file (tools, benchmarks)
+    global _pool, _schema_ready
+    with _schema_lock:
+        cache.clear()
+        _pool.close()
+        _pool = _storage(path, size, shards)
+        _schema_ready = False
+
+
+def init_db():
+    # Applies pending migrations once per process, to every file
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        for pool in _pool.pools():
+            _setup(pool)
+        _schema_ready = True
+
+
+def pools():
+    # Every database file's pool, for tools that work file by file
+    # (maintenance, rebuilds, exports); the catalog comes first
+    init_db()
+    return _pool.pools()
+
+
+def shard_of(user_id):
+    # Which file holds the user's data: None for the main one
+    init_db()
+    return _pool.shard_of(user_id)
+
+
+def shard_pool(shard):
+    # The pool of one shard file (None: the main file)
+    init_db()
+    return _pool.for_shard(shard)
+
+
+def set_shard(user_id, shard):
+    # Re-routes a user whose data rebalance.py has copied (sharded storage
+    # only)
+    with transaction() as conn:
+        _pool.route(conn, user_id, shard)
+
+
+@contextlib.contextmanager
+def connection(user_id=None, pool=None):
+    # The connection to the file holding user_id's data; without a user,
+    # the main file (users table, unsharded data). Tools going file by
+    # file pass one of pools() instead.
+    init_db()
+    with (pool or _pool.for_user(user_id)).connection() as conn:
+        yield conn
+
+
+@contextlib.contextmanager
+def writer_connection(user_id=None):
+    # The reserved connection of the file holding user_id's data; the
+    # write-behind thread (writer.py) saves through it, so it never
+    # competes with request threads for a pool slot
+    init_db()
+    with _pool.for_user(user_id).reserved() as conn:
+        yield conn
+
+
+@contextlib.contextmanager
+def transaction(user_id=None, pool=None):
+    with connection(user_id, pool) as conn:
+        if conn.in_transaction:
+            # Nested: the outer block owns commit/rollback
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.execute("COMMIT")
+
+
+def cache_epoch(user_id):
+    # Bumped by triggers on every write to the user's rows (migration 12)
+    with connection(user_id) as conn:
+        row = conn.execute("SELECT epoch FROM cache_epochs WHERE user_id=?", (user_id,)).fetchone()
+    return row[0] if row else 0
+
+
+cache.set_epoch_source(cache_epoch)
+
+
+# -------------------------
+# Users
+# -------------------------
+# Passwords arrive here already hashed (see auth.py); mails are matched
+# as stored, so callers normalise them first
+def create_user(name, age, weight, mail, password_hash):
+    # Raises sqlite3.IntegrityError when the mail is already taken
+    with transaction() as conn:
+        cur = conn.execute("INSERT INTO users (name, age, weight, mail, password_hash) VALUES (?, ?, ?, ?, ?)",
+                           (name, age, weight, mail, password_hash))
+        _pool.assign(conn, cur.lastrowid)
+        return cur.lastrowid
+
+
+def get_credentials(mail):
+    # One lookup on the unique mail index
+    with connection() as conn:
+        row = conn.execute("SELECT id, name, password_hash FROM users WHERE mail=?", (mail,)).fetchone()
+    return Credentials._make(row) if row else None
+
+
+def set_password_hash(user_id, password_hash):
+    with transaction() as conn:
+        conn.execute("UPDATE users SET password_hash=? WHERE id=?", (password_hash, user_id))
+
+
+def get_token_generation(user_id):
+    # Not cached: a logout in any process has to take effect at once.
+    # None for an unknown user.
+    with connection() as conn:
+        row = conn.execute("SELECT token_generation FROM users WHERE id=?", (user_id,)).fetchone()
+    return row[0] if row else None
+
+
+def revoke_tokens(user_id):
+    with transaction() as conn:
+        conn.execute("UPDATE users SET token_generation = token_generation + 1 WHERE id=?", (user_id,))
+
+
+# -------------------------
+# Programs
+# -------------------------
+@cache.cached("programs")
+def list_programs(user_id):
+    with connection(user_id) as conn:
+        rows = conn.execute("SELECT id, name, days, date_created FROM programs WHERE user_id=?",
+                            (user_id,)).fetchall()
+    return tuple(Program._make(r) for r in rows)
+
+
+@cache.cached("program")
+def get_program(user_id, prog_id):
+    with connection(user_id) as conn:
+        row = conn.execute("SELECT id, name, days, date_created FROM programs WHERE id=? AND user_id=?",
+                           (prog_id, user_id)).fetchone()
+    return Program._make(row) if row else None
+
+
+def get_program_snapshot(user_id, prog_id):
+    # Program row, exercise list and the version they were read at, from
+    # one statement so they are consistent with each other
+    with connection(user_id) as conn:
+        rows = conn.execute("""
+            SELECT p.id, p.name, p.days, p.date_created, p.version,
+                   e.id, e.day, e.name, e.type, e.target_sets, e.target_reps
+            FROM programs p
+            LEFT JOIN exercises e ON e.program_id = p.id AND e.user_id = p.user_id
+            WHERE p.id=? AND p.user_id=?
+            ORDER BY e.day, e.id
+        """, (prog_id, user_id)).fetchall()
+    if not rows:
+        return None
+    exercises = tuple(Exercise._make(row[5:]) for row in rows if row[5] is not None)
+    return ProgramSnapshot(Program._make(rows[0][:4]), exercises, rows[0][4], None)
+
+
+def create_program(user_id, name, days):
+    with transaction(user_id) as conn:
+        cur = conn.execute("INSERT INTO programs (user_id, name, days, date_created) VALUES (?, ?, ?, ?)",
+                           (user_id, name, days, str(datetime.date.today())))
+    cache.invalidate(user_id, "programs")
+    return cur.lastrowid
+
+
+def delete_program(user_id, prog_id):
+    # Exercises and workouts go with it (ON DELETE CASCADE), archived
+    # sessions explicitly, so the records for the exercises it logged are
+    # recomputed from what history remains
+    with transaction(user_id) as conn:
+        ex_names = [r[0] for r in conn.execute(
+            "SELECT DISTINCT exercise_name FROM workouts WHERE program_id=? AND user_id=?", (prog_id, user_id))]
+        ex_names = sorted(set(ex_names).union(archive.delete_program(conn, user_id, prog_id)))
+        conn.execute("DELETE FROM programs WHERE id=? AND user_id=?", (prog_id, user_id))
+        records.rebuild(conn, user_id, ex_names)
+        rollups.rebuild(conn, user_id, ex_names)
+        progression.rebuild(conn, user_id, ex_names)
+    cache.invalidate(user_id, "programs")
+    for kind in ("program", "exercises", "exercise", "program_view"):
+        cache.invalidate(user_id, kind, prog_id)
+    for ex_name in ex_names:
+        cache.invalidate(user_id, "pr", ex_name)
+        cache.invalidate(user_id, "rep_maxes", ex_name)
+        cache.invalidate(user_id, "cardio_stats", ex_name)
+        cache.invalidate(user_id, "exercise_state", ex_name)
+    cache.invalidate(user_id, "rollups")
+    if ex_names:
+        cache.invalidate(user_id, "program_view")
+
+
+# -------------------------
+# Exercises
+# -------------------------
+@cache.cached("exercises")
+def list_exercises(user_id, prog_id, day=None):
+    sql = "SELECT id, day, name, type, target_sets, target_reps FROM exercises WHERE program_id=? AND user_id=?"
+    params = (prog_id, user_id)
+    if day is not None:
+        sql += " AND day=?"
+        params += (day,)
+    with connection(user_id) as conn:
+        rows = conn.execute(sql, params).fetchall()
+    return tuple(Exercise._make(r) for r in rows)
+
+
+@cache.cached("exercise")
+def get_exercise(user_id, prog_id, name):
+    with connection(user_id) as conn:
+        row = conn.execute("""SELECT id, day, name, type, target_sets, target_reps FROM exercises
+                              WHERE program_id=? AND name=? AND user_id=?""",
+                           (prog_id, name, user_id)).fetchone()
+    return Exercise._make(row) if row else None
+
+
+def add_exercise(user_id, prog_id, day, name, ex_type, target_sets, target_reps):
+    with transaction(user_id) as conn:
+        cur = conn.execute("""INSERT INTO exercises (user_id, program_id, day, name, type, target_sets, target_reps)
+                              VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                           (user_id, prog_id, day, name, ex_type, target_sets, target_reps))
+        conn.execute("UPDATE programs SET version = version + 1 WHERE id=? AND user_id=?", (prog_id, user_id))
+    cache.invalidate(user_id, "exercises", prog_id)
+    cache.invalidate(user_id, "exercise", prog_id, name)
+    cache.invalidate(user_id, "program_view", prog_id)
+    return cur.lastrowid
+
+
+# -------------------------
+# Personal records
+# -------------------------
+@cache.cached("pr")
+def get_personal_record(user_id, ex_name):
+    with connection(user_id) as conn:
+        row = conn.execute("SELECT max_weight, reps, e1rm FROM personal_records WHERE exercise_name=? AND user_id=?",
+                           (ex_name, user_id)).fetchone()
+    return PersonalRecord._make(row) if row else None
+
+
+@cache.cached("rep_maxes")
+def get_rep_maxes(user_id, ex_name):
+    with connection(user_id) as conn:
+        rows = conn.execute("SELECT reps, max_weight FROM rep_maxes WHERE user_id=? AND exercise_name=? ORDER BY reps",
+                            (user_id, ex_name)).fetchall()
+    return tuple(RepMax._make(r) for r in rows)
+
+
+@cache.cached("exercise_state")
+def get_exercise_state(user_id, ex_name):
+    with connection(user_id) as conn:
+        row = conn.execute(f"SELECT {progression.COLUMNS} FROM exercise_state WHERE user_id=? AND exercise_name=?",
+                           (user_id, ex_name)).fetchone()
+    return progression.ExerciseState._make(row) if row else None
+
+
+# -------------------------
+# Program view
+# -------------------------
+@cache.cached("program_view")
+def get_program_view(user_id, prog_id):
+    # Program, its exercises and their PRs in one round trip.
+    # Returns a ProgramView whose days is ((day, (ExerciseView, ...)), ...)
+    # for every day of the program, or None if the program doesn't exist.
+    with connection(user_id) as conn:
+        rows = conn.execute("""
+            SELECT p.id, p.name, p.days, p.date_created,
+                   e.id, e.day, e.name, e.type, e.target_sets, e.target_reps,
+                   pr.max_weight, pr.reps, pr.e1rm
+            FROM programs p
+            LEFT JOIN exercises e ON e.program_id = p.id AND e.user_id = p.user_id
+            LEFT JOIN personal_records pr ON pr.exercise_name = e.name AND pr.user_id = p.user_id
+            WHERE p.id=? AND p.user_id=?
+            ORDER BY e.day, e.id
+        """, (prog_id, user_id)).fetchall()
+    if not rows:
+        return None
+
+    program = Program._make(rows[0][:4])
+    by_day = {day: [] for day in range(1, program.days + 1)}
+    for row in rows:
+        if row[4] is None:
+            continue
+        pr = PersonalRecord._make(row[10:13]) if row[10] is not None else None
+        by_day.setdefault(row[5], []).append(ExerciseView(*row[4:10], pr))
+    return ProgramView(program, tuple((day, tuple(exs)) for day, exs in sorted(by_day.items())))
+
+
+# -------------------------
+# Workouts
+# -------------------------
+def save_workout(user_id, prog_id, ex_name, date, sets):
+    # Workout row, all its sets and the record update in one transaction.
+    # sets: iterable of (reps, weight), numbered from 1
+    return save_workouts([WorkoutInput(user_id, prog_id, ex_name, date, list(sets))])[0]
+
+
+def save_cardio(user_id, prog_id, ex_name, date, distance_km, duration_s):
+    return save_workouts([WorkoutInput(user_id, prog_id, ex_name, date, [], "Cardio", distance_km, duration_s)])[0]
+
+
+def save_workouts(workouts, update_state=True):
+    # Bulk variant for imports and offline sync: one transaction, one
+    # executemany for every set, one record update per (user, exercise).
+    # Returns the new workout ids in input order. With sharded storage
+    # it is one transaction per shard the users are on. Bulk imports pass
+    # update_state=False and run progression.recompute() at the end.
+    workouts = [wk._replace(sets=list(wk.sets)) for wk in workouts]
+    by_shard = {}
+    for i, wk in enumerate(workouts):
+        by_shard.setdefault(shard_of(wk.user_id), []).append(i)
+    workout_ids = [None] * len(workouts)
+    for indexes in by_shard.values():
+        for i, workout_id in zip(indexes, _save_workouts([workouts[i] for i in indexes], update_state)):
+            workout_ids[i] = workout_id
+    return workout_ids
+
+
+def _save_workouts(workouts, update_state):
+    # All on one shard
+    workout_ids, set_rows, cardio_rows, strength_sets = [], [], [], {}
+    with transaction(workouts[0].user_id) as conn:
+        for wk in workouts:
+            cur = conn.execute("INSERT INTO workouts (user_id, program_id, exercise_name, date) VALUES (?, ?, ?, ?)",
+                               (wk.user_id, wk.program_id, wk.exercise_name, wk.date))
+            workout_ids.append(cur.lastrowid)
+            if wk.type == "Cardio":
+                cardio_rows.append((cur.lastrowid, wk.user_id, wk.exercise_name, wk.date, wk.distance, wk.duration))
+                continue
+            set_rows.extend((wk.user_id, cur.lastrowid, idx, r, w) for idx, (r, w) in enumerate(wk.sets, start=1))
+            strength_sets.setdefault((wk.user_id, wk.exercise_name), []).extend(wk.sets)
+        conn.executemany("""INSERT INTO workout_sets (user_id, workout_id, set_number, reps, weight)
+                            VALUES (?, ?, ?, ?, ?)""", set_rows)
+        conn.executemany("""INSERT INTO cardio_sessions (workout_id, user_id, exercise_name, date, distance_km, duration_s)
+                            VALUES (?, ?, ?, ?, ?, ?)""", cardio_rows)
+        for (user_id, ex_name), sets in strength_sets.items():
+            records.update_from_sets(conn, user_id, ex_name, sets)
+        rollups.update_from_workouts(conn, workouts)
+        if update_state:
+            progression.update_from_workouts(conn, workouts)
+
+    # A PR shows up in every program view that lists its exercise
+    for user_id, ex_name in strength_sets:
+        cache.invalidate(user_id, "pr", ex_name)
+        cache.invalidate(user_id, "rep_maxes", ex_name)
+        cache.invalidate(user_id, "exercise_state", ex_name)
+    for user_id in {user_id for user_id, _ in strength_sets}:
+        cache.invalidate(user_id, "program_view")
+    for user_id in {wk.user_id for wk in workouts}:
+        cache.invalidate(user_id, "rollups")
+    for user_id, ex_name in {(row[1], row[2]) for row in cardio_rows}:
+        cache.invalidate(user_id, "cardio_stats", ex_name)
+    return workout_ids
+
+
+# -------------------------
+# Rollups
+# -------------------------
+@cache.cached("rollups")
+def get_rollups(user_id, period="week", ex_name=None):
+    # Rows of the daily or weekly rollup table, oldest first
+    table = "weekly_rollups" if period == "week" else "daily_rollups"
+    sql = f"""SELECT exercise_name, {period}, sets, reps, tonnage, max_weight, best_e1rm, distance, duration
+              FROM {table} WHERE user_id=?"""
+    params = [user_id]
+    if ex_name is not None:
+        sql += " AND exercise_name=?"
+        params.append(ex_name)
+    with connection(user_id) as conn:
+        rows = conn.execute(sql + f" ORDER BY exercise_name, {period}", params).fetchall()
+    return tuple(Rollup._make(r) for r in rows)
+
+
+# -------------------------
+# History
+# -------------------------
+def _history_filter(user_id, ex_name, before, start_date, end_date, id_column="id"):
+    # Keyset condition on (date, id), newest first; dates are inclusive
+    sql = "user_id=? AND exercise_name=?"
+    params = [user_id, ex_name]
+    if before is not None:
+        sql += f" AND (date, {id_column}) < (?, ?)"
+        params.extend(before)
+    if start_date is not None:
+        sql += " AND date >= ?"
+        params.append(str(start_date))
+    if end_date is not None:
+        sql += " AND date <= ?"
+        params.append(str(end_date))
+    return sql, params
+
+
+def get_history_page(user_id, ex_name, before=None, limit=10, start_date=None, end_date=None):
+    # One page of sessions, newest first, summarised in SQL. Pass the
+    # returned cursor as `before` for the next page; it is None on the last.
+    # Archived sessions (see archive.py) are merged in from their summaries.
+    where, params = _history_filter(user_id, ex_name, before, start_date, end_date)
+    archived_where, archived_params = _history_filter(user_id, ex_name, before, start_date, end_date,
+                                                      id_column="workout_id")
+    with connection(user_id) as conn:
+        rows = conn.execute(f"""
+            SELECT * FROM (
+                SELECT w.id, w.date, COUNT(ws.id), SUM(ws.reps), SUM(ws.reps * ws.weight), MAX(ws.weight), ws.reps
+                FROM (SELECT id, date FROM workouts WHERE {where} ORDER BY date DESC, id DESC LIMIT ?) w
+                LEFT JOIN workout_sets ws ON ws.workout_id = w.id
+                GROUP BY w.id)
+            UNION ALL
+            SELECT * FROM (
+                SELECT workout_id, date, sets, total_reps, volume, top_weight, top_reps FROM archive.sessions
+                WHERE {archived_where} AND {archive.NOT_HOT} ORDER BY date DESC, workout_id DESC LIMIT ?)
+            ORDER BY 2 DESC, 1 DESC LIMIT ?
+        """, params + [limit + 1] + archived_params + [limit + 1, limit + 1]).fetchall()
+    # SQLite takes the bare ws.reps from the row holding MAX(ws.weight)
+    sessions = tuple(SessionSummary._make(r) for r in rows[:limit])
+    cursor = (sessions[-1].date, sessions[-1].workout_id) if len(rows) > limit else None
+    return sessions, cursor
+
+
+def get_session_sets(user_id, workout_ids):
+    # {workout_id: (HistoryRow, ...)} for the sessions on screen
+    workout_ids = list(workout_ids)
+    if not workout_ids:
+        return {}
+    with connection(user_id) as conn:
+        rows = conn.execute(f"""
+            SELECT w.id, w.date, ws.set_number, ws.reps, ws.weight
+            FROM workouts w
+            JOIN workout_sets ws ON w.id = ws.workout_id
+            WHERE w.user_id=? AND w.id IN ({', '.join('?' * len(workout_ids))})
+            ORDER BY ws.set_number
+        """, [user_id] + workout_ids).fetchall()
+        sets = {}
+        for row in rows:
+            sets.setdefault(row[0], []).append(HistoryRow._make(row[1:]))
+        # Whatever isn't in the hot tables may have been archived
+        missing = [workout_id for workout_id in workout_ids if workout_id not in sets]
+        for workout_id, rows in archive.session_sets(conn, user_id, missing).items():
+            sets[workout_id] = [HistoryRow._make(row) for row in rows]
+    return {workout_id: tuple(rows) for workout_id, rows in sets.items()}
+
+
+def iter_history(user_id, ex_name, start_date=None, end_date=None, page_size=200):
+    # Streams every set, newest session first, one keyset page at a time;
+    # memory stays bounded by page_size whatever the history length.
+    # Hot and archived sessions are merged on (date, workout id).
+    hot = _iter_hot_history(user_id, ex_name, start_date, end_date, page_size)
+    archived = _iter_archived_history(user_id, ex_name, start_date, end_date, page_size)
+    for _, row in heapq.merge(hot, archived, key=lambda item: item[0], reverse=True):
+        yield row
+
+
+def _iter_hot_history(user_id, ex_name, start_date, end_date, page_size):
+    before = None
+    while True:
+        where, params = _history_filter(user_id, ex_name, before, start_date, end_date)
+        with connection(user_id) as conn:
+            rows = conn.execute(f"""
+                SELECT w.id, w.date, ws.set_number, ws.reps, ws.weight
+                FROM (SELECT id, date FROM workouts WHERE {where} ORDER BY date DESC, id DESC LIMIT ?) w
+                JOIN workout_sets ws ON ws.workout_id = w.id
+                ORDER BY w.date DESC, w.id DESC, ws.set_number
+            """, params + [page_size]).fetchall()
+        if not rows:
+            return
+        for row in rows:
+            yield (row[1], row[0]), HistoryRow._make(row[1:])
+        before = (rows[-1][1], rows[-1][0])
+
+
+def _iter_archived_history(user_id, ex_name, start_date, end_date, page_size):
+    before = None
+    while True:
+        where, params = _history_filter(user_id, ex_name, before, start_date, end_date, id_column="workout_id")
+        with connection(user_id) as conn:
+            rows = conn.execute(f"""
+                SELECT workout_id, date, set_data FROM archive.sessions
+                WHERE {where} AND {archive.NOT_HOT} ORDER BY date DESC, workout_id DESC LIMIT ?
+            """, params + [page_size]).fetchall()
+        if not rows:
+            return
+        for workout_id, date, blob in rows:
+            for set_number, reps, weight in archive.unpack_sets(blob):
+                yield (date, workout_id), HistoryRow(date, set_number, reps, weight)
+        before = (rows[-1][1], rows[-1][0])
+
+
+# -------------------------
+# Cardio
+# -------------------------
+def get_cardio_page(user_id, ex_name, before=None, limit=10, start_date=None, end_date=None):
+    # Same keyset paging as get_history_page, over cardio_sessions and
+    # the archive
+    where, params = _history_filter(user_id, ex_name, before, start_date, end_date, id_column="workout_id")
+    with connection(user_id) as conn:
+        rows = conn.execute(f"""
+            SELECT * FROM (
+                SELECT workout_id, date, distance_km, duration_s, pace_s_per_km FROM cardio_sessions
+                WHERE {where}
+                ORDER BY date DESC, workout_id DESC LIMIT ?)
+            UNION ALL
+            SELECT * FROM (
+                SELECT workout_id, date, distance_km, duration_s,
+                       CASE WHEN distance_km > 0 THEN duration_s / distance_km END
+                FROM archive.sessions
+                WHERE {where} AND distance_km IS NOT NULL AND {archive.NOT_HOT}
+                ORDER BY date DESC, workout_id DESC LIMIT ?)
+            ORDER BY 2 DESC, 1 DESC LIMIT ?
+        """, params + [limit + 1] + params + [limit + 1, limit + 1]).fetchall()
+    sessions = tuple(CardioSession._make(r) for r in rows[:limit])
+    cursor = (sessions[-1].date, sessions[-1].workout_id) if len(rows) > limit else None
+    return sessions, cursor
+
+
+@cache.cached("cardio_stats")
+def get_cardio_stats(user_id, ex_name):
+    # Reads cardio_sessions (best pace via idx_cardio_pace) and the
+    # archived sessions; weekly distance is in the rollups
+    with connection(user_id) as conn:
+        row = conn.execute(f"""
+            SELECT SUM(n), SUM(distance), SUM(duration), MIN(pace), MAX(longest) FROM (
+                SELECT COUNT(*) AS n, SUM(distance_km) AS distance, SUM(duration_s) AS duration,
+                       MIN(pace_s_per_km) AS pace, MAX(distance_km) AS longest
+                FROM cardio_sessions WHERE user_id=? AND exercise_name=?
+                UNION ALL
+                SELECT COUNT(*), SUM(distance_km), SUM(duration_s),
+                       MIN(CASE WHEN distance_km > 0 THEN duration_s / distance_km END), MAX(distance_km)
+                FROM archive.sessions WHERE user_id=? AND exercise_name=? AND distance_km IS NOT NULL
+                  AND {archive.NOT_HOT})
+        """, (user_id, ex_name, user_id, ex_name)).fetchone()
+    return CardioStats._make(row) if row[0] else None
+
+
+# -------------------------
+# Hot paths
+# -------------------------
+# The reads behind the main pages, as (name, function, args) with sample
+# arguments that reach every statement shape the pages use.
+# migrations.py --check runs them and explains the SQL they send; each
+# must resolve to index lookups.
+HOT_READS = [
+    ("token generation", get_token_generation, (1,)),
+    ("login", get_credentials, ("user1@example.com",)),
+    ("cache epoch", cache_epoch, (1,)),
+    ("home programs", list_programs, (1,)),
+    ("program", get_program, (1, 1)),
+    ("program view", get_program_view, (1, 1)),
+    ("program snapshot", get_program_snapshot, (1, 1)),
+    ("exercises by day", list_exercises, (1, 1, 1)),
+    ("exercises by program", list_exercises, (1, 1)),
+    ("exercise", get_exercise, (1, 1, "Bench")),
+    ("personal record", get_personal_record, (1, "Bench")),
+    ("rep maxes", get_rep_maxes, (1, "Bench")),
+    ("exercise state", get_exercise_state, (1, "Bench")),
+    ("weekly rollups", get_rollups, (1, "week", "Bench")),
+    ("all rollups", get_rollups, (1, "week")),
+    ("history first page", get_history_page, (1, "Bench")),
+    ("history page", get_history_page, (1, "Bench", ("2024-06-01", 10), 10, "2024-01-01", "2024-12-31")),
+    ("session sets", get_session_sets, (1, [1, 2])),
+    ("history stream", iter_history, (1, "Bench", "2024-01-01", "2024-12-31")),
+    ("cardio first page", get_cardio_page, (1, "Run")),
+    ("cardio page", get_cardio_page, (1, "Run", ("2024-06-01", 10))),
+    ("cardio stats", get_cardio_stats, (1, "Run")),
+]
@@ -0,0 +1,144 @@
+import sys
+import datetime
+import archive
+import records
+
+# Pre-aggregated per user x exercise x day/week totals, so stats pages read
+# O(days/weeks) rows instead of every set. Weeks start on Monday. Like
+# records.py, functions take an open connection and run inside the
+# caller's transaction.
+
+PERIODS = {"daily_rollups": "day", "weekly_rollups": "week"}
+
+
+def week_start(date):
+    try:
+        day = datetime.date.fromisoformat(str(date))
+    except ValueError:
+        return str(date)
+    return str(day - datetime.timedelta(days=day.weekday()))
+
+
+# -------------------------
+# Incremental update on save
+# -------------------------
+def update_from_workouts(conn, workouts):
+    # workouts: repository.WorkoutInput rows (sets as lists) just inserted
+    totals = {}
+    for wk in workouts:
+        sets = wk.sets
+        if wk.type == "Cardio":
+            row = (0, 0, 0.0, None, None, wk.distance or 0.0, wk.duration or 0)
+        elif not sets:
+            continue
+        else:
+            row = (len(sets), sum(r for r, _ in sets), sum(r * w for r, w in sets),
+                   max(w for _, w in sets), max(records.estimate_1rm(w, r) for r, w in sets), 0.0, 0)
+        for table, period in (("daily_rollups", str(wk.date)), ("weekly_rollups", week_start(wk.date))):
+            key = (table, wk.user_id, wk.exercise_name, period)
+            totals[key] = _combine(totals[key], row) if key in totals else row
+
+    for table in PERIODS:
+        conn.executemany(f"""
+            INSERT INTO {table} (user_id, exercise_name, {PERIODS[table]},
+                                 sets, reps, tonnage, max_weight, best_e1rm, distance, duration)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, exercise_name, {PERIODS[table]}) DO UPDATE SET
+                sets = sets + excluded.sets,
+                reps = reps + excluded.reps,
+                tonnage = tonnage + excluded.tonnage,
+                max_weight = MAX(COALESCE(max_weight, excluded.max_weight), COALESCE(excluded.max_weight, max_weight)),
+                best_e1rm = MAX(COALESCE(best_e1rm, excluded.best_e1rm), COALESCE(excluded.best_e1rm, best_e1rm)),
+                distance = distance + excluded.distance,
+                duration = duration + excluded.duration
+        """, [key[1:] + row for key, row in totals.items() if key[0] == table])
+
+
+def _combine(a, b):
+    def top(x, y):
+        return y if x is None else x if y is None else max(x, y)
+    return (a[0] + b[0], a[1] + b[1], a[2] + b[2], top(a[3], b[3]), top(a[4], b[4]), a[5] + b[5], a[6] + b[6])
+
+
+# -------------------------
+# Rebuild from history
+# -------------------------
+def rebuild(conn, user_id=None, exercise_names=None):
+    # Regenerates both tables from workouts/workout_sets, cardio_sessions
+    # and the archive, optionally scoped to one user and some of their
+    # exercises
+    if exercise_names is not None:
+        exercise_names = list(exercise_names)
+        if not exercise_names:
+            return
+    scope, params = records.scope_filter(user_id, exercise_names)
+    history_scope, _ = records.scope_filter(user_id, exercise_names, "w.")
+    conn.create_function("e1rm", 2, records.estimate_1rm, deterministic=True)
+
+    for table, period in PERIODS.items():
+        conn.execute(f"DELETE FROM {table} WHERE {scope}", params)
+        strength_period = "w.date" if period == "day" else _week_sql("w.date")
+        conn.execute(f"""
+            INSERT INTO {table} (user_id, exercise_name, {period},
+                                 sets, reps, tonnage, max_weight, best_e1rm, distance, duration)
+            SELECT w.user_id, w.exercise_name, {strength_period},
+                   COUNT(*), SUM(ws.reps), SUM(ws.reps * ws.weight), MAX(ws.weight), MAX(e1rm(ws.weight, ws.reps)), 0.0, 0
+            FROM workouts w
+            JOIN workout_sets ws ON ws.workout_id = w.id
+            WHERE {history_scope}
+            GROUP BY w.user_id, w.exercise_name, {strength_period}
+        """, params)
+        # Cardio comes from its own table; an exercise name used for both
+        # kinds shares the row
+        cardio_period = "date" if period == "day" else _week_sql("date")
+        conn.execute(f"""
+            INSERT INTO {table} (user_id, exercise_name, {period},
+                                 sets, reps, tonnage, max_weight, best_e1rm, distance, duration)
+            SELECT user_id, exercise_name, {cardio_period}, 0, 0, 0.0, NULL, NULL,
+                   SUM(distance_km), SUM(duration_s)
+            FROM cardio_sessions
+            WHERE {scope}
+            GROUP BY user_id, exercise_name, {cardio_period}
+            ON CONFLICT (user_id, exercise_name, {period}) DO UPDATE SET
+                distance = distance + excluded.distance,
+                duration = duration + excluded.duration
+        """, params)
+        # Archived sessions (see archive.py) carry their own summaries
+        if records.archive_attached(conn):
+            archive_period = "date" if period == "day" else _week_sql("date")
+            conn.execute(f"""
+                INSERT INTO {table} (user_id, exercise_name, {period},
+                                     sets, reps, tonnage, max_weight, best_e1rm, distance, duration)
+                SELECT user_id, exercise_name, {archive_period}, SUM(sets), COALESCE(SUM(total_reps), 0),
+                       COALESCE(SUM(volume), 0.0), MAX(top_weight), MAX(best_e1rm),
+                       COALESCE(SUM(distance_km), 0.0), COALESCE(SUM(duration_s), 0)
+                FROM archive.sessions
+                WHERE {scope} AND (sets > 0 OR distance_km IS NOT NULL) AND {archive.NOT_HOT}
+                GROUP BY user_id, exercise_name, {archive_period}
+                ON CONFLICT (user_id, exercise_name, {period}) DO UPDATE SET
+                    sets = sets + excluded.sets,
+                    reps = reps + excluded.reps,
+                    tonnage = tonnage + excluded.tonnage,
+                    max_weight = MAX(COALESCE(max_weight, excluded.max_weight), COALESCE(excluded.max_weight, max_weight)),
+                    best_e1rm = MAX(COALESCE(best_e1rm, excluded.best_e1rm), COALESCE(excluded.best_e1rm, best_e1rm)),
+                    distance = distance + excluded.distance,
+                    duration = duration + excluded.duration
+            """, params)
+
+
+def _week_sql(column):
+    # Monday of the column's week, matching week_start()
+    return f"COALESCE(date({column}, 'weekday 0', '-6 days'), {column})"
+
+
+if __name__ == "__main__":
+    # Usage: python rollups.py [db_path]
+    import repository
+    repository.configure(sys.argv[1] if len(sys.argv) > 1 else repository.DB_PATH)
+    counts = [0] * len(PERIODS)
+    for pool in repository.pools():
+        with repository.transaction(pool=pool) as conn:
+            rebuild(conn)
+            for i, table in enumerate(PERIODS):
+                counts[i] += conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    print(f"✅ Rebuilt {counts[0]} daily and {counts[1]} weekly rollups")
@@ -0,0 +1,79 @@
+import random
+import datetime
+import argparse
+import auth
+import repository
+
+# Synthetic data for load testing: users with programs, exercises and
+# multi-year workout histories.
+# Usage: python seed.py --users 100 --years 2 [--db gym_data.db]
+
+STRENGTH = ["Bench Press", "Squat", "Deadlift", "Overhead Press", "Barbell Row", "Pull Up",
+            "Lunge", "Dip", "Curl", "Leg Press", "Incline Press", "Romanian Deadlift"]
+CARDIO = ["Run", "Bike", "Row Erg"]
+PASSWORD = "password"
+
+
+def seed(users=10, years=1, sessions_per_week=3, rng_seed=0, first_user=1):
+    # Returns the ids of the users created
+    rng = random.Random(rng_seed)
+    # One hash shared by every synthetic account: hashing is slow on purpose
+    password_hash = auth.hash_password(PASSWORD)
+    user_ids = []
+    for n in range(first_user, first_user + users):
+        user_id = repository.create_user(f"User {n}", rng.randint(18, 70), rng.uniform(50, 120),
+                                         f"user{n}@example.com", password_hash)
+        user_ids.append(user_id)
+        _seed_user(rng, user_id, years, sessions_per_week)
+    return user_ids
+
+
+def _seed_user(rng, user_id, years, sessions_per_week):
+    days = rng.randint(2, 5)
+    prog_id = repository.create_program(user_id, "Seeded Program", days)
+    plan = {}
+    for day in range(1, days + 1):
+        plan[day] = [(name, "Strength") for name in rng.sample(STRENGTH, 4)] + [(rng.choice(CARDIO), "Cardio")]
+        for name, ex_type in plan[day]:
+            target_sets, target_reps = (rng.randint(3, 5), rng.choice([5, 8, 10, 12])) if ex_type == "Strength" else (None, None)
+            repository.add_exercise(user_id, prog_id, day, name, ex_type, target_sets, target_reps)
+
+    start = datetime.date.today() - datetime.timedelta(days=365 * years)
+    base = {name: rng.uniform(30, 120) for name in STRENGTH}
+    workouts = []
+    for week in range(52 * years):
+        for session in range(sessions_per_week):
+            date = str(start + datetime.timedelta(days=week * 7 + session * 2))
+            day = session % days + 1
+            progress = 1 + week * 0.005
+            for name, ex_type in plan[day]:
+                if ex_type == "Cardio":
+                    distance = round(rng.uniform(2, 12), 1)
+                    workouts.append(repository.WorkoutInput(user_id, prog_id, name, date, [], "Cardio",
+                                                            distance, int(distance * rng.uniform(240, 420))))
+                else:
+                    weight = round(base[name] * progress * 2) / 2
+                    sets = [(rng.randint(3, 12), weight) for _ in range(rng.randint(3, 5))]
+                    workouts.append(repository.WorkoutInput(user_id, prog_id, name, date, sets))
+        # Keep each transaction a manageable size
+        if len(workouts) >= 2000:
+            repository.save_workouts(workouts)
+            workouts = []
+    if workouts:
+        repository.save_workouts(workouts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed gym_data.db with synthetic users and history")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--years", type=int, default=1)
+    parser.add_argument("--sessions-per-week", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db", default=repository.DB_PATH)
+    args = parser.parse_args()
+
+    repository.configure(args.db)
+    with repository.connection() as conn:
+        first = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM users").fetchone()[0]
+    ids = seed(args.users, args.years, args.sessions_per_week, args.seed, first_user=first)
+    print(f"✅ Seeded {len(ids)} users into {args.db}")
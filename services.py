@@ -0,0 +1,286 @@
+import math
+import sqlite3
+import datetime
+import auth
+import cache
+import progression
+import repository
+import writer
+
+# Program, exercise, workout and record operations with no UI code in
+# them. gym_app.py (Streamlit) and api.py (HTTP) are both clients. Writes
+# validate their input first: bad input raises ValidationError, a program
+# or exercise the user doesn't own raises NotFound.
+
+EXERCISE_TYPES = ("Strength", "Cardio")
+MAX_DAYS = 7
+# Largest integer SQLite can store
+MAX_INTEGER = 2 ** 63 - 1
+
+
+class ServiceError(Exception):
+    pass
+
+
+class ValidationError(ServiceError):
+    pass
+
+
+class NotFound(ServiceError):
+    pass
+
+
+class Conflict(ServiceError):
+    pass
+
+
+class Busy(ServiceError):
+    pass
+
+
+# -------------------------
+# Users
+# -------------------------
+def signup(name, age, weight, mail, code):
+    name, mail, code = _text(name, "name"), _text(mail, "mail"), _text(code, "password", strip=False)
+    if not name or not mail or not code:
+        raise ValidationError("All fields are required.")
+    age, weight = _integer(age, "age", 1), _number(weight, "weight")
+    try:
+        return repository.create_user(name, age, weight, _mail(mail), auth.hash_password(code))
+    except sqlite3.IntegrityError:
+        raise Conflict("Email already exists.") from None
+
+
+def login(mail, code):
+    # The User, or None when the mail/password pair doesn't match. Hashes
+    # made with an older cost setting are upgraded on the way through.
+    mail, code = _text(mail, "mail"), _text(code, "password", strip=False)
+    if not mail or not code:
+        return None
+    credentials = repository.get_credentials(_mail(mail))
+    if not auth.verify_password(code, credentials.password_hash if credentials else None):
+        return None
+    if auth.needs_rehash(credentials.password_hash):
+        repository.set_password_hash(credentials.id, auth.hash_password(code))
+    return repository.User(credentials.id, credentials.name)
+
+
+def issue_token(user, ttl=auth.TOKEN_TTL_S):
+    return auth.issue_token(user.id, user.name, repository.get_token_generation(user.id), ttl)
+
+
+def user_from_token(token):
+    # Signature and expiry first, then one primary-key read so a logout in
+    # any process (or a deleted account) revokes the token
+    claims = auth.read_token(token)
+    if claims is None:
+        return None
+    user_id, name, generation = claims
+    if repository.get_token_generation(user_id) != generation:
+        return None
+    return repository.User(user_id, name)
+
+
+def logout(user_id):
+    # Revokes every token issued to the user, on every device
+    repository.revoke_tokens(user_id)
+
+
+def _mail(mail):
+    return mail.strip().lower()
+
+
+# -------------------------
+# Reads (cached in the repository)
+# -------------------------
+list_programs = repository.list_programs
+get_program = repository.get_program
+get_program_view = repository.get_program_view
+list_exercises = repository.list_exercises
+get_exercise = repository.get_exercise
+get_personal_record = repository.get_personal_record
+get_rep_maxes = repository.get_rep_maxes
+get_rollups = repository.get_rollups
+get_cardio_stats = repository.get_cardio_stats
+get_cardio_page = repository.get_cardio_page
+get_session_sets = repository.get_session_sets
+get_exercise_state = repository.get_exercise_state
+
+
+def get_history_page(user_id, ex_name, before=None, limit=10, start_date=None, end_date=None):
+    # Session summaries plus their sets: (sessions, {workout_id: sets}, cursor)
+    sessions, cursor = repository.get_history_page(user_id, ex_name, before, limit, start_date, end_date)
+    return sessions, repository.get_session_sets(user_id, [s.workout_id for s in sessions]), cursor
+
+
+def iter_history(user_id, ex_name, start_date=None, end_date=None):
+    # Every set in the date range, newest first, read a page at a time as
+    # the caller iterates (repository.iter_history)
+    start_date = _date(start_date) if start_date is not None else None
+    end_date = _date(end_date) if end_date is not None else None
+    return repository.iter_history(user_id, ex_name, start_date, end_date)
+
+
+def recommend(user_id, ex_name, target_reps=None, today=None):
+    # Today's suggested top set from the stored progression state (one
+    # cached row), or None before the first logged session
+    return progression.recommend(repository.get_exercise_state(user_id, ex_name), target_reps, _date(today))
+
+
+def program_snapshot(user_id, prog_id, current=None):
+    # The program and its exercises. `current` (a snapshot the caller kept,
+    # e.g. in session state) is returned as is while the user's cache epoch
+    # hasn't moved, which costs no query beyond the epoch check done once
+    # per rerun or request (cache.scope()). Read first, so a write racing
+    # the re-read only makes the next check miss.
+    epoch = cache.epoch(user_id)
+    if current is not None and current.program.id == prog_id and current.epoch == epoch:
+        return current
+    snapshot = repository.get_program_snapshot(user_id, prog_id)
+    return snapshot._replace(epoch=epoch) if snapshot else None
+
+
+def require_program(user_id, prog_id):
+    program = repository.get_program(user_id, prog_id)
+    if program is None:
+        raise NotFound(f"Program {prog_id} not found.")
+    return program
+
+
+# -------------------------
+# Programs and exercises
+# -------------------------
+def create_program(user_id, name, days):
+    name = _text(name, "name")
+    if not name:
+        raise ValidationError("Program name is required.")
+    days = _integer(days, "days", 1, MAX_DAYS)
+    return repository.create_program(user_id, name, days)
+
+
+def delete_program(user_id, prog_id):
+    require_program(user_id, prog_id)
+    repository.delete_program(user_id, prog_id)
+
+
+def add_exercise(user_id, prog_id, day, name, ex_type, target_sets=None, target_reps=None):
+    program = require_program(user_id, prog_id)
+    day = _integer(day, "day", 1, program.days)
+    name = _text(name, "name")
+    if not name:
+        raise ValidationError("Exercise name is required.")
+    if ex_type not in EXERCISE_TYPES:
+        raise ValidationError(f"Exercise type must be one of {', '.join(EXERCISE_TYPES)}.")
+    if ex_type == "Strength":
+        target_sets = _integer(target_sets, "target sets", 1)
+        target_reps = _integer(target_reps, "target reps", 1)
+    else:
+        target_sets = target_reps = None
+    return repository.add_exercise(user_id, prog_id, day, name, ex_type, target_sets, target_reps)
+
+
+# -------------------------
+# Workouts
+# -------------------------
+# Saves go through the write-behind queue (writer.py), which commits
+# concurrent saves together; these wait for the commit and return the ids.
+def log_strength(user_id, prog_id, ex_name, sets, date=None):
+    # sets: iterable of (reps, weight). Returns the workout id.
+    return _wait(writer.submit([strength_input(user_id, prog_id, ex_name, sets, date)]))[0]
+
+
+def log_cardio(user_id, prog_id, ex_name, distance_km, duration_s, date=None):
+    return _wait(writer.submit([cardio_input(user_id, prog_id, ex_name, distance_km, duration_s, date)]))[0]
+
+
+def log_workouts(workouts):
+    # Bulk save (offline sync): every WorkoutInput is validated before any
+    # is queued, and they are committed together
+    return _wait(submit_workouts(workouts))
+
+
+def submit_workouts(workouts):
+    # Like log_workouts, but returns the Future without waiting
+    return writer.submit([strength_input(wk.user_id, wk.program_id, wk.exercise_name, wk.sets, wk.date)
+                          if wk.type != "Cardio" else
+                          cardio_input(wk.user_id, wk.program_id, wk.exercise_name, wk.distance, wk.duration, wk.date)
+                          for wk in workouts])
+
+
+def _wait(future):
+    try:
+        return future.result()
+    except sqlite3.OperationalError as e:
+        # The writer already retried with backoff
+        raise Busy("The database is busy, please try again.") from e
+
+
+def strength_input(user_id, prog_id, ex_name, sets, date=None):
+    _require_exercise(user_id, prog_id, ex_name)
+    sets = [(_integer(r, "reps", 1), _number(w, "weight")) for r, w in sets]
+    if not sets:
+        raise ValidationError("At least one set is required.")
+    return repository.WorkoutInput(user_id, prog_id, ex_name, _date(date), sets)
+
+
+def cardio_input(user_id, prog_id, ex_name, distance_km, duration_s, date=None):
+    _require_exercise(user_id, prog_id, ex_name)
+    return repository.WorkoutInput(user_id, prog_id, ex_name, _date(date), [], "Cardio",
+                                   _number(distance_km, "distance"), _integer(duration_s, "duration", 0))
+
+
+def _require_exercise(user_id, prog_id, ex_name):
+    if not isinstance(ex_name, str):
+        raise ValidationError("exercise name must be text.")
+    require_program(user_id, prog_id)
+    if repository.get_exercise(user_id, prog_id, ex_name) is None:
+        raise NotFound(f"Exercise '{ex_name}' is not in program {prog_id}.")
+
+
+# -------------------------
+# Input checks
+# -------------------------
+def _integer(value, field, minimum=None, maximum=None):
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ValidationError(f"{field} must be a whole number.") from None
+    if number != value and not isinstance(value, str):
+        raise ValidationError(f"{field} must be a whole number.")
+    if (minimum is not None and number < minimum) or (maximum is not None and number > maximum):
+        raise ValidationError(f"{field} must be between {minimum} and {maximum}." if maximum is not None
+                              else f"{field} must be at least {minimum}.")
+    if abs(number) > MAX_INTEGER:
+        raise ValidationError(f"{field} is too large.")
+    return number
+
+
+def _text(value, field, strip=True):
+    # None counts as empty; callers decide whether empty is allowed
+    if value is None:
+        return ""
+    if not isinstance(value, str):
+        raise ValidationError(f"{field} must be text.")
+    return value.strip() if strip else value
+
+
+def _number(value, field):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValidationError(f"{field} must be a number.") from None
+    if not math.isfinite(number):
+        raise ValidationError(f"{field} must be a finite number.")
+    if number < 0:
+        raise ValidationError(f"{field} can't be negative.")
+    return number
+
+
+def _date(value):
+    if value is None:
+        return str(datetime.date.today())
+    try:
+        return str(datetime.date.fromisoformat(str(value)))
+    except ValueError:
+        raise ValidationError(f"Invalid date '{value}' (expected YYYY-MM-DD).") from None
@@ -0,0 +1,131 @@
+import os
+import re
+import threading
+
+# Sharded storage: each user's programs, workouts, records and rollups live
+# in one of several SQLite files (gym_data.db -> gym_data_shard0.db, ...),
+# so one heavy user's history doesn't bloat everyone's indexes and saves
+# for users on different shards don't queue behind the same write lock.
+# The main file stays the catalog: the users table (logins look up by
+# mail, ids are allocated there) and user_shards, which maps each user to
+# their shard. A user with no user_shards row still lives in the catalog
+# file itself, which is where every user starts in an unsharded database.
+#
+# New users are placed by a jump consistent hash of their id, so growing
+# from n to n + 1 shards only moves about 1/(n + 1) of them; rebalance.py
+# moves existing users to match a new shard count.
+#
+# ShardedPool has the same interface as repository.ConnectionPool; set
+# GYM_SHARDS (or pass shards to repository.configure) to use it.
+
+_MASK = (1 << 64) - 1
+# The catalog lookup behind every user's first request
+ROUTE_QUERY = "SELECT shard FROM user_shards WHERE user_id=?"
+
+
+def _mix(key):
+    # splitmix64 finaliser: sequential ids become well spread 64-bit keys
+    key = (key + 0x9E3779B97F4A7C15) & _MASK
+    key = ((key ^ (key >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+    key = ((key ^ (key >> 27)) * 0x94D049BB133111EB) & _MASK
+    return key ^ (key >> 31)
+
+
+def jump_hash(key, buckets):
+    # Lamping & Veach, "A Fast, Minimal Memory, Consistent Hash Algorithm"
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & _MASK
+        j = int((b + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return b
+
+
+def shard_for(user_id, count):
+    # The shard a user belongs on with `count` shards; None with none
+    return jump_hash(_mix(user_id), count) if count else None
+
+
+def shard_path(db_path, shard):
+    root, ext = os.path.splitext(db_path)
+    return f"{root}_shard{shard}{ext or '.db'}"
+
+
+def existing_shards(db_path):
+    # Shard numbers that have a file next to db_path
+    root, ext = os.path.splitext(db_path)
+    pattern = re.compile(re.escape(os.path.basename(root)) + r"_shard(\d+)" + re.escape(ext or ".db") + "$")
+    matches = (pattern.match(name) for name in os.listdir(os.path.dirname(db_path) or "."))
+    return sorted(int(m.group(1)) for m in matches if m)
+
+
+class ShardedPool:
+    """Connection pools for a catalog file and its shard files.
+
+    ``for_user()`` picks the pool holding a user's data; routes are read
+    from the catalog once per user and kept in memory. ``setup`` prepares
+    a shard file (schema, migrations) the first time it is opened outside
+    ``pools()``, i.e. one beyond the configured count.
+    """
+
+    def __init__(self, path, count, size, pool_factory, setup):
+        self.path = path
+        self.count = count
+        self.catalog = pool_factory(path, size)
+        self.archive_path = self.catalog.archive_path
+        self._size = size
+        self._pool_factory = pool_factory
+        self._setup = setup
+        self._lock = threading.Lock()
+        self._shards = {shard: pool_factory(shard_path(path, shard), size) for shard in range(count)}
+        self._routes = {}
+
+    def pools(self):
+        # Catalog first, then every shard
+        with self._lock:
+            return [self.catalog] + [self._shards[shard] for shard in sorted(self._shards)]
+
+    def shard_of(self, user_id):
+        # Shard number, or None for a user whose data is in the catalog file
+        if user_id is None:
+            return None
+        try:
+            return self._routes[user_id]
+        except KeyError:
+            pass
+        with self.catalog.connection() as conn:
+            row = conn.execute(ROUTE_QUERY, (user_id,)).fetchone()
+        shard = row[0] if row else None
+        self._routes[user_id] = shard
+        return shard
+
+    def for_user(self, user_id):
+        return self.for_shard(self.shard_of(user_id))
+
+    def for_shard(self, shard):
+        if shard is None:
+            return self.catalog
+        with self._lock:
+            pool = self._shards.get(shard)
+        if pool is None:
+            pool = self._pool_factory(shard_path(self.path, shard), self._size)
+            self._setup(pool)
+            with self._lock:
+                pool = self._shards.setdefault(shard, pool)
+        return pool
+
+    def assign(self, conn, user_id):
+        # New user: conn is the catalog transaction inserting them
+        self.route(conn, user_id, shard_for(user_id, self.count))
+
+    def route(self, conn, user_id, shard):
+        # Records where a user's data lives (None: the catalog file)
+        if shard is None:
+            conn.execute("DELETE FROM user_shards WHERE user_id=?", (user_id,))
+        else:
+            conn.execute("INSERT OR REPLACE INTO user_shards (user_id, shard) VALUES (?, ?)", (user_id, shard))
+        self._routes[user_id] = shard
+
+    def close(self):
+        for pool in self.pools():
+            pool.close()
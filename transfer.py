@@ -0,0 +1,508 @@
+import os
+import csv
+import sys
+import itertools
+import argparse
+import datetime
+import archive
+import cache
+import progression
+import repository
+
+# Bulk export and import of users, programs, exercises and workout history.
+# An export is a directory holding one file per table in CSV, Parquet or
+# Arrow IPC (Parquet and Arrow need pyarrow). Both directions stream:
+# export reads each table through a cursor CHUNK_SIZE rows at a time,
+# import commits every BATCH_SIZE rows in its own transaction, so memory
+# doesn't grow with the size of the data. The export reads each database
+# file in one read transaction, i.e. a consistent snapshot per file, and
+# includes archived sessions (archive.py), which import back into the hot
+# tables. With sharded storage (sharding.py) ids are only unique within a
+# shard, so exported ids are made unique across them.
+#
+# Import dedupes, so re-running it (or resuming after a failed batch) is
+# safe: users match on mail, programs on (user, name, days, date created),
+# exercises on (program, day, name) and sessions on (user, exercise, date)
+# plus identical sets or distance/duration. Rows of one session must be
+# adjacent in the sets file, as exports write them. Imported history
+# usually arrives out of date order, so progression state is recomputed
+# for the affected users once at the end, in parallel (progression.py).
+#
+# Usage: python transfer.py export DIR [--user ID] [--format csv|parquet|arrow]
+#        python transfer.py import DIR [--user ID]
+
+CHUNK_SIZE = 5000
+BATCH_SIZE = 2000
+FORMATS = {"csv": ".csv", "parquet": ".parquet", "arrow": ".arrow"}
+
+# Column name and type of every exported table; ids are the source
+# database's and only link rows within one export
+TABLES = {
+    "users": [("user_id", int), ("name", str), ("age", int), ("weight", float), ("mail", str),
+              ("password_hash", str)],
+    "programs": [("program_id", int), ("user_id", int), ("name", str), ("days", int), ("date_created", str)],
+    "exercises": [("program_id", int), ("day", int), ("name", str), ("type", str), ("target_sets", int),
+                  ("target_reps", int)],
+    # One row per strength set, or one per cardio session (no set_number)
+    "sets": [("session", int), ("user_id", int), ("program_id", int), ("exercise", str), ("date", str),
+             ("set_number", int), ("reps", int), ("weight", float), ("distance_km", float), ("duration_s", int)],
+}
+
+
+# -------------------------
+# File formats
+# -------------------------
+class _CsvWriter:
+    def __init__(self, path, columns):
+        self._file = open(path, "w", newline="")
+        self._csv = csv.writer(self._file)
+        self._csv.writerow([name for name, _ in columns])
+
+    def write(self, rows):
+        self._csv.writerows(rows)
+
+    def close(self):
+        self._file.close()
+
+
+class _ArrowWriter:
+    # Each chunk becomes one record batch (Arrow) or row group (Parquet)
+    def __init__(self, path, columns, parquet):
+        pa = _pyarrow()
+        types = {int: pa.int64(), float: pa.float64(), str: pa.string()}
+        self._schema = pa.schema([(name, types[kind]) for name, kind in columns])
+        if parquet:
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(path, self._schema)
+        else:
+            self._writer = pa.ipc.new_file(path, self._schema)
+
+    def write(self, rows):
+        pa = _pyarrow()
+        arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), self._schema)]
+        self._writer.write_batch(pa.record_batch(arrays, schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+
+def _open_writer(path, columns, fmt):
+    if fmt == "csv":
+        return _CsvWriter(path, columns)
+    return _ArrowWriter(path, columns, parquet=fmt == "parquet")
+
+
+def _read_rows(path, columns, fmt):
+    # Yields one dict per row, typed per TABLES
+    if fmt == "csv":
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                yield {name: _cast(row.get(name), kind) for name, kind in columns}
+        return
+    pa = _pyarrow()
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        batches = pq.ParquetFile(path).iter_batches(batch_size=CHUNK_SIZE)
+    else:
+        reader = pa.ipc.open_file(pa.memory_map(path))
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+    for batch in batches:
+        for row in batch.to_pylist():
+            yield {name: _cast(row.get(name), kind) for name, kind in columns}
+
+
+def _cast(value, kind):
+    if value is None or value == "":
+        return None
+    return kind(value)
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc  # noqa: F401
+    except ImportError:
+        raise RuntimeError("Parquet and Arrow files need pyarrow (pip install pyarrow)") from None
+    return pyarrow
+
+
+def _detect_format(directory):
+    for fmt, ext in FORMATS.items():
+        if os.path.exists(os.path.join(directory, "sets" + ext)):
+            return fmt
+    raise FileNotFoundError(f"No sets.csv, sets.parquet or sets.arrow in {directory}")
+
+
+# -------------------------
+# Export
+# -------------------------
+def _export_queries(user_id, include_credentials, files=1, index=0):
+    # files/index: which of how many database files the queries run on
+    scope = "WHERE user_id = ?" if user_id is not None else ""
+    params = (user_id,) if user_id is not None else ()
+    password = "password_hash" if include_credentials else "NULL"
+    # Scoped exports walk idx_workouts_user_exercise; full ones the rowid
+    order = "w.exercise_name, w.date, w.id" if user_id is not None else "w.id"
+    return {
+        "users": (f"SELECT id, name, age, weight, mail, {password} FROM users "
+                  f"{'WHERE id = ?' if user_id is not None else ''} ORDER BY id", params),
+        "programs": (f"SELECT {_export_id('id', files, index)}, user_id, name, days, date_created FROM programs "
+                     f"{scope} ORDER BY id", params),
+        "exercises": (f"SELECT {_export_id('program_id', files, index)}, day, name, type, target_sets, target_reps "
+                      f"FROM exercises "
+                      f"{'WHERE program_id IN (SELECT id FROM programs WHERE user_id = ?)' if user_id is not None else ''} "
+                      f"ORDER BY program_id, id", params),
+        "sets": (f"""SELECT {_export_id('w.id', files, index)}, w.user_id, {_export_id('w.program_id', files, index)},
+                            w.exercise_name, w.date, ws.set_number, ws.reps, ws.weight, c.distance_km, c.duration_s
+                     FROM workouts w
+                     LEFT JOIN workout_sets ws ON ws.workout_id = w.id
+                     LEFT JOIN cardio_sessions c ON c.workout_id = w.id
+                     {scope.replace('user_id', 'w.user_id')}
+                     ORDER BY {order}, ws.set_number""", params),
+    }
+
+
+def _export_id(column, files, index):
+    return column if files == 1 else f"{column} * {files} + {index}"
+
+
+def export_data(directory, user_id=None, fmt="csv", include_credentials=False):
+    # Writes users/programs/exercises/sets files into directory; returns
+    # {table: rows written}. Password hashes are left out unless asked for.
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}; expected one of {', '.join(FORMATS)}")
+    os.makedirs(directory, exist_ok=True)
+    counts = dict.fromkeys(TABLES, 0)
+    writers = {}
+    try:
+        for table, columns in TABLES.items():
+            writers[table] = _open_writer(os.path.join(directory, table + FORMATS[fmt]), columns, fmt)
+        # Users come from the main file, everything else from the files
+        # holding user data (just the one user's when scoped)
+        with repository.connection() as conn:
+            _export_tables(conn, ["users"], _export_queries(user_id, include_credentials), writers, counts)
+        pools = [None] if user_id is not None else repository.pools()
+        for index, pool in enumerate(pools):
+            with repository.connection(user_id, pool) as conn:
+                queries = _export_queries(user_id, include_credentials, len(pools), index)
+                _export_tables(conn, ["programs", "exercises", "sets"], queries, writers, counts,
+                               lambda: _archived_rows(conn, user_id, len(pools), index))
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return counts
+
+
+def _export_tables(conn, tables, queries, writers, counts, archived=None):
+    conn.execute("BEGIN")
+    try:
+        for table in tables:
+            sql, params = queries[table]
+            cursor = conn.execute(sql, params)
+            chunks = iter(lambda: cursor.fetchmany(CHUNK_SIZE), [])
+            if table == "sets":
+                chunks = itertools.chain(chunks, _batches(archived(), CHUNK_SIZE))
+            for rows in chunks:
+                writers[table].write(rows)
+                counts[table] += len(rows)
+    finally:
+        conn.execute("COMMIT")
+
+
+def _archived_rows(conn, user_id, files, index):
+    # Archived sessions in the sets layout
+    for workout_id, owner, prog_id, ex_name, date, sets, distance, duration in archive.iter_sessions(conn, user_id):
+        # Old sessions can have no program, like hot ones in _export_id()
+        workout_id = workout_id * files + index
+        prog_id = prog_id * files + index if prog_id is not None else None
+        if not sets:
+            yield (workout_id, owner, prog_id, ex_name, date, None, None, None, distance, duration)
+        for set_number, reps, weight in sets:
+            yield (workout_id, owner, prog_id, ex_name, date, set_number, reps, weight, None, None)
+
+
+# -------------------------
+# Import
+# -------------------------
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _sessions(rows):
+    # Groups adjacent set rows sharing a session id
+    session, current = None, []
+    for row in rows:
+        if current and row["session"] != session:
+            yield current
+            current = []
+        session = row["session"]
+        current.append(row)
+    if current:
+        yield current
+
+
+def import_data(directory, user_id=None, fmt=None, batch_size=BATCH_SIZE, processes=None):
+    # Loads an export (or a hand-made directory in the same layout).
+    # With user_id, everything is imported into that existing account and
+    # the users file is ignored. Returns {table: (rows added, duplicates skipped)},
+    # counting sessions rather than rows for the sets file.
+    fmt = fmt or _detect_format(directory)
+
+    def rows(table):
+        path = os.path.join(directory, table + FORMATS[fmt])
+        return _read_rows(path, TABLES[table], fmt) if os.path.exists(path) else iter(())
+
+    counts = {}
+    users = _import_users(rows("users"), batch_size, counts) if user_id is None else None
+    programs = _import_programs(rows("programs"), users, user_id, batch_size, counts)
+    _import_exercises(rows("exercises"), programs, batch_size, counts)
+    touched = _import_sessions(rows("sets"), users, user_id, programs, batch_size, counts)
+    progression.recompute(touched, processes)
+    return counts
+
+
+def _import_users(rows, batch_size, counts):
+    # {source user id: user id}
+    mapping, added, skipped, locked = {}, 0, 0, 0
+    for batch in _batches(rows, batch_size):
+        with repository.transaction() as conn:
+            for row in batch:
+                mail = (row["mail"] or "").strip().lower() or None
+                existing = conn.execute("SELECT id FROM users WHERE mail = ?", (mail,)).fetchone() if mail else None
+                if existing:
+                    mapping[row["user_id"]] = existing[0]
+                    skipped += 1
+                    continue
+                # Joins this transaction; also routes the user to a shard
+                mapping[row["user_id"]] = repository.create_user(row["name"], row["age"], row["weight"], mail,
+                                                                 row["password_hash"])
+                added += 1
+                locked += row["password_hash"] is None
+    if locked:
+        # Exports leave hashes out unless asked (--include-credentials)
+        print(f"⚠️ {locked} imported account(s) have no password and can't log in; "
+              "re-export with --include-credentials to keep them", file=sys.stderr)
+    counts["users"] = (added, skipped)
+    return mapping
+
+
+def _target_user(row, users, user_id):
+    if user_id is not None:
+        return user_id
+    if row["user_id"] not in users:
+        raise ValueError(f"Unknown user_id {row['user_id']} (not in the users file)")
+    return users[row["user_id"]]
+
+
+def _by_shard(batch, owner):
+    # Splits a batch by the database file its rows' users live in, so each
+    # part commits in one transaction there
+    parts = {}
+    for row in batch:
+        parts.setdefault(repository.shard_of(owner(row)), []).append(row)
+    return parts.values()
+
+
+def _import_programs(rows, users, user_id, batch_size, counts):
+    # {source program id: (user id, program id)}
+    mapping, added, skipped = {}, 0, 0
+
+    def owner(row):
+        return _target_user(row, users, user_id)
+
+    for batch in _batches(rows, batch_size):
+        touched = set()
+        for part in _by_shard(batch, owner):
+            with repository.transaction(owner(part[0])) as conn:
+                for row in part:
+                    key = (owner(row), row["name"], row["days"], row["date_created"])
+                    existing = conn.execute("""SELECT id FROM programs
+                                               WHERE user_id = ? AND name = ? AND days = ? AND date_created IS ?""",
+                                            key).fetchone()
+                    if existing:
+                        mapping[row["program_id"]] = (key[0], existing[0])
+                        skipped += 1
+                        continue
+                    prog_id = conn.execute("INSERT INTO programs (user_id, name, days, date_created) VALUES (?, ?, ?, ?)",
+                                           key).lastrowid
+                    mapping[row["program_id"]] = (key[0], prog_id)
+                    touched.add(key[0])
+                    added += 1
+        for user in touched:
+            cache.invalidate(user, "programs")
+    counts["programs"] = (added, skipped)
+    return mapping
+
+
+def _import_exercises(rows, programs, batch_size, counts):
+    added, skipped = 0, 0
+
+    def owner(row):
+        # Unknown programs are reported below
+        return programs.get(row["program_id"], (None,))[0]
+
+    for batch in _batches(rows, batch_size):
+        touched = set()
+        for part in _by_shard(batch, owner):
+            with repository.transaction(owner(part[0])) as conn:
+                changed = set()
+                for row in part:
+                    if row["program_id"] not in programs:
+                        raise ValueError(f"Exercise '{row['name']}' refers to unknown program_id {row['program_id']}")
+                    user, prog_id = programs[row["program_id"]]
+                    if conn.execute("""SELECT 1 FROM exercises
+                                       WHERE program_id = ? AND user_id = ? AND day = ? AND name = ?""",
+                                    (prog_id, user, row["day"], row["name"])).fetchone():
+                        skipped += 1
+                        continue
+                    conn.execute("""INSERT INTO exercises (user_id, program_id, day, name, type, target_sets, target_reps)
+                                    VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                                 (user, prog_id, row["day"], row["name"], row["type"] or "Strength",
+                                  row["target_sets"], row["target_reps"]))
+                    changed.add((user, prog_id))
+                    added += 1
+                # Snapshots of these programs (see services.program_snapshot) are stale
+                conn.executemany("UPDATE programs SET version = version + 1 WHERE id = ? AND user_id = ?",
+                                 [(prog_id, user) for user, prog_id in changed])
+            touched |= changed
+        for user in {user for user, _ in touched}:
+            cache.invalidate(user)
+    counts["exercises"] = (added, skipped)
+
+
+def _session_input(rows, users, user_id, programs):
+    first = rows[0]
+    if first["program_id"] not in programs:
+        raise ValueError(f"Session {first['session']} refers to unknown program_id {first['program_id']}")
+    if not first["exercise"]:
+        raise ValueError(f"Session {first['session']} has no exercise")
+    try:
+        datetime.date.fromisoformat(first["date"] or "")
+    except ValueError:
+        raise ValueError(f"Session {first['session']} has an invalid date {first['date']!r}") from None
+    owner = _target_user(first, users, user_id)
+    prog_id = programs[first["program_id"]][1]
+    if first["set_number"] is None and first["distance_km"] is not None:
+        return repository.WorkoutInput(owner, prog_id, first["exercise"], first["date"], [], "Cardio",
+                                       first["distance_km"], first["duration_s"] or 0)
+    sets = [(r["reps"], r["weight"]) for r in sorted(rows, key=lambda r: r["set_number"] or 0)
+            if r["reps"] is not None]
+    # Logged sets always carry a weight; records and rollups rely on it
+    blank = [str(r["set_number"]) for r in rows if r["reps"] is not None and r["weight"] is None]
+    if blank:
+        raise ValueError(f"Session {first['session']} has no weight for set {', '.join(blank)}")
+    return repository.WorkoutInput(owner, prog_id, first["exercise"], first["date"], sets) if sets else None
+
+
+def _signature(wk):
+    if wk.type == "Cardio":
+        return (wk.user_id, wk.exercise_name, wk.date, ("cardio", wk.distance, wk.duration))
+    return (wk.user_id, wk.exercise_name, wk.date, tuple((r, float(w)) for r, w in wk.sets))
+
+
+def _existing_signatures(conn, workouts):
+    # Signatures of the sessions already stored for the batch's
+    # (user, exercise) pairs and date range
+    ranges = {}
+    for wk in workouts:
+        low, high = ranges.get((wk.user_id, wk.exercise_name), (wk.date, wk.date))
+        ranges[(wk.user_id, wk.exercise_name)] = (min(low, wk.date), max(high, wk.date))
+    signatures = set()
+    for (owner, ex_name), (low, high) in ranges.items():
+        sessions = {}
+        for workout_id, date, reps, weight, distance, duration in conn.execute("""
+                SELECT w.id, w.date, ws.reps, ws.weight, c.distance_km, c.duration_s
+                FROM workouts w
+                LEFT JOIN workout_sets ws ON ws.workout_id = w.id
+                LEFT JOIN cardio_sessions c ON c.workout_id = w.id
+                WHERE w.user_id = ? AND w.exercise_name = ? AND w.date BETWEEN ? AND ?
+                ORDER BY w.id, ws.set_number""", (owner, ex_name, low, high)):
+            session = sessions.setdefault(workout_id, [date, [], None])
+            if distance is not None:
+                session[2] = ("cardio", distance, duration)
+            elif reps is not None:
+                session[1].append((reps, float(weight)))
+        for date, sets, cardio in sessions.values():
+            signatures.add((owner, ex_name, date, cardio or tuple(sets)))
+        for _, _, _, _, date, sets, distance, duration in archive.iter_sessions(conn, owner, ex_name, low, high):
+            cardio = ("cardio", distance, duration) if distance is not None else None
+            signatures.add((owner, ex_name, date, cardio or tuple((r, float(w)) for _, r, w in sets if r is not None)))
+    return signatures
+
+
+def _import_sessions(rows, users, user_id, programs, batch_size, counts):
+    # Returns the ids of users who got new sessions
+    added, skipped, touched = 0, 0, set()
+    # A batch holds whole sessions, about batch_size set rows in total
+    batch, size = [], 0
+    for session_rows in _sessions(rows):
+        batch.append(session_rows)
+        size += len(session_rows)
+        if size >= batch_size:
+            new, s = _save_sessions(batch, users, user_id, programs)
+            added, skipped, batch, size = added + len(new), skipped + s, [], 0
+            touched.update(wk.user_id for wk in new)
+    if batch:
+        new, s = _save_sessions(batch, users, user_id, programs)
+        added, skipped = added + len(new), skipped + s
+        touched.update(wk.user_id for wk in new)
+    counts["sessions"] = (added, skipped)
+    return touched
+
+
+def _save_sessions(batch, users, user_id, programs):
+    workouts = [wk for wk in (_session_input(rows, users, user_id, programs) for rows in batch) if wk]
+    skipped = len(batch) - len(workouts)
+    new = []
+    for part in _by_shard(workouts, lambda wk: wk.user_id):
+        with repository.transaction(part[0].user_id) as conn:
+            seen = _existing_signatures(conn, part)
+            fresh = []
+            for wk in part:
+                signature = _signature(wk)
+                if signature in seen:
+                    skipped += 1
+                    continue
+                seen.add(signature)
+                fresh.append(wk)
+            # Records and rollups are updated as for any other save; progression
+            # state is recomputed once the whole import is in
+            repository.save_workouts(fresh, update_state=False)
+        new.extend(fresh)
+    # Again after the commit, in case a reader cached the old rows meanwhile
+    for owner in {wk.user_id for wk in new}:
+        cache.invalidate(owner)
+    return new, skipped
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk export/import of gym data")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("directory")
+    parser.add_argument("--user", type=int, help="export one user / import into this existing user")
+    parser.add_argument("--format", choices=list(FORMATS), help="export format (default csv); import detects it")
+    parser.add_argument("--include-credentials", action="store_true", help="export password hashes")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--processes", type=int, help="progression recompute workers (default: one per core)")
+    parser.add_argument("--db", default=repository.DB_PATH)
+    args = parser.parse_args()
+
+    repository.configure(args.db)
+    repository.init_db()
+    try:
+        if args.command == "export":
+            counts = export_data(args.directory, args.user, args.format or "csv", args.include_credentials)
+            print("✅ Exported " + ", ".join(f"{n} {table}" for table, n in counts.items()))
+        else:
+            counts = import_data(args.directory, args.user, args.format, args.batch_size, args.processes)
+            print("✅ Imported " + ", ".join(f"{a} {table} ({s} duplicates skipped)"
+                                            for table, (a, s) in counts.items()))
+    except (ValueError, RuntimeError, FileNotFoundError) as e:
+        sys.exit(f"❌ {e}")
@@ -0,0 +1,227 @@
+import time
+import queue
+import logging
+import sqlite3
+import threading
+import concurrent.futures
+import repository
+
+# Write-behind queue for workout saves. SQLite takes one writer at a time,
+# so rather than every request thread racing for the lock, saves are
+# queued and a single background thread group-commits them: whatever is
+# waiting when a batch starts (up to MAX_BATCH workouts) goes into one
+# save_workouts() transaction. Callers get a Future resolving to the new
+# workout ids. A locked database is retried a bounded number of times
+# with a short busy timeout and capped backoff, so a save fails in about
+# a second and a half at worst instead of stalling the page. With sharded
+# storage (sharding.py) every shard gets its own queue and thread, so
+# shards commit in parallel.
+
+MAX_BATCH = 500
+MAX_PENDING = 10000
+BUSY_TIMEOUT_MS = 250
+RETRIES = 4
+BACKOFF_S = 0.01
+MAX_BACKOFF_S = 0.2
+
+log = logging.getLogger("gym_app.writer")
+
+_STOP = object()
+
+
+class WriteBehind:
+    def __init__(self, max_batch=MAX_BATCH, max_pending=MAX_PENDING, name="gym-writer"):
+        self.max_batch = max_batch
+        self.name = name
+        # Bounded: submit() blocks once max_pending saves are waiting
+        self._queue = queue.Queue(max_pending)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stats = {"batches": 0, "workouts": 0, "largest_batch": 0, "retries": 0, "failures": 0}
+
+    def submit(self, workouts):
+        workouts = list(workouts)
+        future = concurrent.futures.Future()
+        if not workouts:
+            future.set_result([])
+            return future
+        self._start()
+        self._queue.put((workouts, future))
+        return future
+
+    def flush(self, timeout=None):
+        # Waits until everything submitted so far is committed
+        future = concurrent.futures.Future()
+        self._start()
+        self._queue.put((None, future))
+        future.result(timeout)
+
+    def close(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put((None, _STOP))
+            thread.join()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, pending=self._queue.qsize())
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            size = len(batch[0][0] or ())
+            while size < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(item)
+                size += len(item[0] or ())
+            self._commit([(workouts, future) for workouts, future in batch
+                          if workouts is not None and future.set_running_or_notify_cancel()])
+            # Flush markers resolve once everything queued before them is in
+            for workouts, future in batch:
+                if workouts is None:
+                    if future is _STOP:
+                        return
+                    future.set_result(None)
+
+    def _commit(self, pending):
+        if not pending:
+            return
+        try:
+            ids = self._save([wk for workouts, _ in pending for wk in workouts])
+        except Exception as e:
+            # A busy database already had its retries: retrying each
+            # submission alone would only multiply the wait
+            if len(pending) == 1 or (isinstance(e, sqlite3.OperationalError) and _is_busy(e)):
+                for _, future in pending:
+                    self._fail(future, e)
+                return
+            # One bad submission shouldn't sink the batch: retry each alone
+            for workouts, future in pending:
+                try:
+                    future.set_result(self._save(workouts))
+                except Exception as e:
+                    self._fail(future, e)
+            return
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["workouts"] += len(ids)
+            self._stats["largest_batch"] = max(self._stats["largest_batch"], len(ids))
+        start = 0
+        for workouts, future in pending:
+            future.set_result(ids[start:start + len(workouts)])
+            start += len(workouts)
+
+    def _save(self, workouts):
+        # Pins the shard's reserved connection, so the timeout applies to
+        # the save and no pool slot is needed: request threads waiting on
+        # this save may hold them all
+        with repository.writer_connection(workouts[0].user_id) as conn:
+            conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            try:
+                for attempt in range(RETRIES + 1):
+                    try:
+                        return repository.save_workouts(workouts)
+                    except sqlite3.OperationalError as e:
+                        if attempt == RETRIES or not _is_busy(e):
+                            raise
+                        with self._lock:
+                            self._stats["retries"] += 1
+                        time.sleep(min(BACKOFF_S * 2 ** attempt, MAX_BACKOFF_S))
+            finally:
+                conn.execute(f"PRAGMA busy_timeout={_default_busy_timeout()}")
+
+    def _fail(self, future, error):
+        log.warning("workout save failed: %s", error)
+        with self._lock:
+            self._stats["failures"] += 1
+        future.set_exception(error)
+
+
+def _is_busy(error):
+    message = str(error)
+    return "locked" in message or "busy" in message
+
+
+def _default_busy_timeout():
+    for pragma in repository.PRAGMAS:
+        if pragma.startswith("PRAGMA busy_timeout="):
+            return pragma.split("=", 1)[1]
+    return 0
+
+
+def _gather(parts, count):
+    # One Future for the ids of several writers' submissions; parts is
+    # [(input positions, future)]. Fails if any part does, though the
+    # other shards' saves are committed by then.
+    result = concurrent.futures.Future()
+    remaining = [len(parts)]
+    lock = threading.Lock()
+
+    def done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        ids = [None] * count
+        for positions, future in parts:
+            if future.exception() is not None:
+                result.set_exception(future.exception())
+                return
+            for i, workout_id in zip(positions, future.result()):
+                ids[i] = workout_id
+        result.set_result(ids)
+
+    for _, future in parts:
+        future.add_done_callback(done)
+    return result
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def _writer_for(shard):
+    with _writers_lock:
+        if shard not in _writers:
+            _writers[shard] = WriteBehind(name="gym-writer" if shard is None else f"gym-writer-{shard}")
+        return _writers[shard]
+
+
+def submit(workouts):
+    # Future of the workout ids, in input order
+    workouts = list(workouts)
+    by_shard = {}
+    for i, wk in enumerate(workouts):
+        by_shard.setdefault(repository.shard_of(wk.user_id), []).append(i)
+    if len(by_shard) <= 1:
+        return _writer_for(next(iter(by_shard), None)).submit(workouts)
+    return _gather([(positions, _writer_for(shard).submit([workouts[i] for i in positions]))
+                    for shard, positions in by_shard.items()], len(workouts))
+
+
+def flush(timeout=None):
+    with _writers_lock:
+        writers = list(_writers.values())
+    for w in writers:
+        w.flush(timeout)
+
+
+def stats():
+    # Totals over every shard's writer
+    with _writers_lock:
+        writers = list(_writers.values())
+    totals = {"batches": 0, "workouts": 0, "largest_batch": 0, "retries": 0, "failures": 0, "pending": 0}
+    for w in writers:
+        for key, value in w.stats().items():
+            totals[key] = max(totals[key], value) if key == "largest_batch" else totals[key] + value
+    return dict(totals, writers=len(writers))